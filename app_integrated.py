@@ -6,9 +6,12 @@ import streamlit as st
 import requests
 import pandas as pd
 import json
+import hashlib
+from collections import OrderedDict
 from datetime import datetime
 import time
 import os
+import re
 import sqlite3
 import psycopg2
 from typing import Optional
@@ -20,6 +23,8 @@ import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from init_db import namespace_for, attach_namespace
+from sql_validator import build_parser_schema, validate_sql
 
 # Load environment variables
 load_dotenv()
@@ -38,8 +43,77 @@ api_app.add_middleware(
 # Gemini 클라이언트 초기화
 client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
-def get_db_connection():
-    """Get database connection - PostgreSQL for production, SQLite for fallback"""
+# 네임스페이스(Spider 데이터베이스)별 스키마 캐시
+_schema_cache = {}
+_available_databases = []
+_parser_schemas = {}
+_schema_cache_lock = threading.Lock()
+
+# 쿼리 실행 가드레일 (0 이하이면 비활성화)
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "5000"))
+MAX_QUERY_COST = float(os.getenv("MAX_QUERY_COST", "1000000"))
+AUTO_LIMIT_ROWS = int(os.getenv("AUTO_LIMIT_ROWS", "1000"))
+# 행 수를 알 수 없는 스캔(CTE, 서브쿼리)에 대한 SQLite 추정치
+SQLITE_DEFAULT_SCAN_ROWS = 1000
+
+# 실행 경로 커넥션 풀과 커넥션별 prepared statement 캐시 크기
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+PREPARED_CACHE_SIZE = int(os.getenv("PREPARED_CACHE_SIZE", "128"))
+_connection_pool = {}
+_pool_lock = threading.Lock()
+
+# 자주 반복되는 GROUP BY 집계를 요약 테이블로 구체화 (opt-in, db_id 지정 쿼리만)
+MATERIALIZE_AGGREGATES = os.getenv("MATERIALIZE_AGGREGATES", "false").lower() == "true"
+MATERIALIZE_THRESHOLD = int(os.getenv("MATERIALIZE_THRESHOLD", "5"))
+SUMMARY_TABLE_PREFIX = 'mv_'
+_aggregate_query_counts = {}
+_summary_tables = {}
+_summary_connections = {}
+# 구체화/갱신 중인 키, 네임스페이스별 요약 커넥션 잠금, 결과를 그대로 저장할 수 없는 쿼리 형태
+_summaries_in_flight = set()
+_summary_writers = {}
+_unsupported_summaries = set()
+# 위 자료구조만 보호하며, 쿼리를 실행하는 동안에는 잡지 않음
+_summary_lock = threading.Lock()
+
+# 검증 실패 시 오류를 포함해 SQL을 다시 생성하는 횟수
+SQL_REPAIR_RETRIES = int(os.getenv("SQL_REPAIR_RETRIES", "1"))
+
+# 가드레일 메트릭
+query_metrics = {
+    'repaired': 0,
+    'regenerated': 0,
+    'executed': 0,
+    'auto_limited': 0,
+    'rejected': 0,
+    'timed_out': 0,
+    'failed': 0,
+    'plan_cache_hits': 0,
+    'plan_cache_misses': 0,
+    'summary_created': 0,
+    'summary_hits': 0,
+    'summary_refreshes': 0,
+}
+_metrics_lock = threading.Lock()
+
+def record_metric(name: str):
+    """Increment a query guardrail counter"""
+    with _metrics_lock:
+        query_metrics[name] += 1
+
+def get_db_connection(db_id: Optional[str] = None):
+    """Get database connection - PostgreSQL for production, SQLite for fallback
+
+    When db_id is given the connection is routed to that database's namespace
+    (PostgreSQL search_path / attached SQLite file); otherwise every namespace
+    is reachable through qualified `namespace.table` names.
+    """
+    conn, db_type = _connect()
+    enter_namespace(conn, db_type, db_id)
+    return conn, db_type
+
+def _connect():
+    """Open a raw database connection"""
     database_url = os.getenv("DATABASE_URL")
     
     # Check if running in deployment environment
@@ -67,18 +141,70 @@ def get_db_connection():
         except Exception as e:
             print(f"PostgreSQL connection failed: {str(e)}")
             if is_deployed:
-                return sqlite3.connect(':memory:'), 'sqlite_memory'
+                return _sqlite_connect(':memory:'), 'sqlite_memory'
     
     if is_deployed:
-        return sqlite3.connect(':memory:'), 'sqlite_memory'
+        return _sqlite_connect(':memory:'), 'sqlite_memory'
     else:
         sqlite_path = os.path.join(os.path.dirname(__file__), 'spider_demo.db')
-        return sqlite3.connect(sqlite_path), 'sqlite'
+        return _sqlite_connect(sqlite_path), 'sqlite'
+
+def _sqlite_connect(path):
+    """Open an SQLite connection that can be pooled across threads"""
+    return sqlite3.connect(path, check_same_thread=False, cached_statements=PREPARED_CACHE_SIZE)
+
+def list_namespaces(conn, db_type) -> list:
+    """List the namespaces created by init_db, one per Spider database"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT db_id FROM database_summary ORDER BY db_id")
+        return [namespace_for(row[0]) for row in cursor.fetchall()]
+    except Exception:
+        if db_type == 'postgresql':
+            conn.rollback()
+        return []
+    finally:
+        cursor.close()
+
+def enter_namespace(conn, db_type, db_id: Optional[str] = None):
+    """Route a connection to one namespace, or make all namespaces reachable"""
+    if db_type == 'postgresql':
+        if db_id:
+            cursor = conn.cursor()
+            cursor.execute(f"SET search_path TO {namespace_for(db_id)}, public")
+            cursor.close()
+    else:
+        namespaces = [namespace_for(db_id)] if db_id else list_namespaces(conn, db_type)
+        for namespace in namespaces:
+            attach_namespace(conn, namespace, db_type)
+
+def get_available_databases() -> list:
+    """Get the list of Spider databases that can be queried"""
+    with _schema_cache_lock:
+        if _available_databases:
+            return list(_available_databases)
+
+    conn, db_type = _connect()
+    databases = list_namespaces(conn, db_type)
+    conn.close()
+    with _schema_cache_lock:
+        _available_databases[:] = databases
+    return databases
+
+def resolve_db_id(db_id: Optional[str]) -> Optional[str]:
+    """Validate a requested db_id against the known namespaces"""
+    if not db_id:
+        return None
+    namespace = namespace_for(db_id)
+    if namespace not in get_available_databases():
+        raise HTTPException(status_code=404, detail=f"Unknown database: {db_id}")
+    return namespace
 
 # FastAPI 모델 정의
 class QueryRequest(BaseModel):
     question: str
     language: str = "en"
+    db_id: Optional[str] = None
     
 class QueryResponse(BaseModel):
     sql_query: str
@@ -90,27 +216,63 @@ def init_database():
     from init_db import init_database as init_db_func
     try:
         init_db_func()
+        clear_schema_cache()
         print("✅ Database initialized successfully")
     except Exception as e:
         print(f"❌ Database initialization failed: {e}")
 
-def get_database_schema():
-    """Get database schema information for context"""
+def clear_schema_cache():
+    """Drop all cached namespace schemas (e.g. after re-initializing the database)"""
+    with _schema_cache_lock:
+        _schema_cache.clear()
+        _available_databases.clear()
+        _parser_schemas.clear()
+    # Prepared statements and summaries may reference tables that were just re-created
+    close_connection_pool()
+    reset_summary_tables()
+
+def get_database_schema(db_id: Optional[str] = None):
+    """Get database schema information for context
+
+    With a db_id only that namespace is introspected and table names are
+    unqualified; without one every namespace is returned as `namespace.table`.
+    Results are cached per namespace.
+    """
+    if db_id:
+        return _get_namespace_schema(namespace_for(db_id))
+
+    schema_info = {}
+    for namespace in get_available_databases():
+        for table_name, columns in _get_namespace_schema(namespace).items():
+            schema_info[f"{namespace}.{table_name}"] = columns
+    return schema_info
+
+def _get_namespace_schema(namespace: str) -> dict:
+    """Introspect the tables of a single namespace, using the per-namespace cache"""
+    with _schema_cache_lock:
+        if namespace in _schema_cache:
+            return _schema_cache[namespace]
+
     try:
-        conn, db_type = get_db_connection()
+        conn, db_type = _connect()
+        if db_type != 'postgresql':
+            attach_namespace(conn, namespace, db_type)
         cursor = conn.cursor()
         
         if db_type == 'sqlite' or db_type == 'sqlite_memory':
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            cursor.execute(f"SELECT name FROM {namespace}.sqlite_master WHERE type='table';")
         elif db_type == 'postgresql':
-            cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public';")
+            cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema=%s;", (namespace,))
         
         tables = cursor.fetchall()
         schema_info = {}
         
         for (table_name,) in tables:
+            if table_name.startswith(SUMMARY_TABLE_PREFIX):
+                # Summary tables are an execution detail, not part of the prompt schema
+                continue
             if db_type == 'sqlite' or db_type == 'sqlite_memory':
-                cursor.execute(f"PRAGMA table_info({table_name});")
+                cursor.execute(f"PRAGMA {namespace}.table_info({table_name});")
                 columns = cursor.fetchall()
                 schema_info[table_name] = []
                 for col in columns:
@@ -120,11 +282,12 @@ def get_database_schema():
                         'nullable': 'YES' if col[3] == 0 else 'NO'
                     })
             elif db_type == 'postgresql':
-                cursor.execute(f"""
+                cursor.execute("""
                     SELECT column_name, data_type, is_nullable 
                     FROM information_schema.columns 
-                    WHERE table_name='{table_name}';
-                """)
+                    WHERE table_schema=%s AND table_name=%s
+                    ORDER BY ordinal_position;
+                """, (namespace, table_name))
                 columns = cursor.fetchall()
                 schema_info[table_name] = []
                 for col in columns:
@@ -136,19 +299,34 @@ def get_database_schema():
         
         cursor.close()
         conn.close()
-        return schema_info
     except Exception as e:
-        print(f"Error getting schema: {e}")
+        print(f"Error getting schema for {namespace}: {e}")
         return {}
 
-def generate_sql_with_gemini(question: str, schema: dict, language: str = "en") -> str:
-    """Generate SQL query using Gemini API"""
+    if schema_info:
+        with _schema_cache_lock:
+            _schema_cache[namespace] = schema_info
+    return schema_info
+
+def generate_sql_with_gemini(question: str, schema: dict, language: str = "en",
+                             previous_sql: Optional[str] = None, error: Optional[str] = None) -> str:
+    """Generate SQL query using Gemini API
+
+    previous_sql/error feed a failed validation back so the model can fix its query.
+    """
     schema_text = ""
     for table_name, columns in schema.items():
         schema_text += f"\nTable: {table_name}\n"
         for col in columns:
             schema_text += f"  - {col['column']} ({col['type']})\n"
     
+    feedback = ""
+    if previous_sql and error:
+        if language == "ko":
+            feedback = f"\n이전에 생성한 쿼리가 스키마 검증에 실패했습니다:\n{previous_sql}\n오류: {error}\n스키마에 있는 이름만 사용해 수정하세요.\n"
+        else:
+            feedback = f"\nYour previous query failed schema validation:\n{previous_sql}\nError: {error}\nFix it using only names from the schema.\n"
+    
     if language == "ko":
         prompt = f"""
 당신은 SQL 전문가입니다. 다음 데이터베이스 스키마와 자연어 질문을 보고 유효한 SQL 쿼리를 생성하세요.
@@ -157,7 +335,7 @@ def generate_sql_with_gemini(question: str, schema: dict, language: str = "en")
 {schema_text}
 
 질문: {question}
-
+{feedback}
 규칙:
 1. SQL 쿼리만 생성하고 설명은 하지 마세요
 2. 적절한 SQL 문법을 사용하세요
@@ -176,7 +354,7 @@ Database Schema:
 {schema_text}
 
 Question: {question}
-
+{feedback}
 Rules:
 1. Generate only the SQL query, no explanations
 2. Use proper SQL syntax
@@ -204,13 +382,679 @@ SQL Query:
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating SQL: {str(e)}")
 
-def execute_sql_query(sql_query: str):
-    """Execute SQL query and return results"""
+def set_statement_timeout(conn, db_type, cursor):
+    """Bound the statements of the current transaction by QUERY_TIMEOUT_MS"""
+    if QUERY_TIMEOUT_MS <= 0:
+        return
+    if db_type == 'postgresql':
+        cursor.execute("SET LOCAL statement_timeout = %s", (QUERY_TIMEOUT_MS,))
+    else:
+        deadline = time.monotonic() + QUERY_TIMEOUT_MS / 1000
+        # Returning a truthy value from the progress handler interrupts the running statement
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+
+def begin_guarded_transaction(conn, db_type):
+    """Start a read-only transaction with a per-statement timeout"""
+    if db_type == 'postgresql':
+        # Commit the connection check / search_path so the session can switch to read-only
+        conn.commit()
+        conn.set_session(readonly=True)
+    else:
+        conn.execute("PRAGMA query_only = ON")
+    cursor = conn.cursor()
+    set_statement_timeout(conn, db_type, cursor)
+    return cursor
+
+def _sqlite_scan_rows(cursor, sql_query: str, name: str) -> int:
+    """Estimate the rows produced by a full scan reported in an SQLite query plan"""
+    # EXPLAIN QUERY PLAN reports aliases, so map them back to the table they name
+    match = re.search(rf'(?:from|join|,)\s*([\w.]+)\s+(?:as\s+)?{re.escape(name)}\b', sql_query, re.IGNORECASE)
+    table = match.group(1) if match else name
     try:
-        conn, db_type = get_db_connection()
-        cursor = conn.cursor()
+        cursor.execute(f"SELECT count(*) FROM {table}")
+        return max(cursor.fetchone()[0], 1)
+    except sqlite3.OperationalError as e:
+        if 'interrupted' in str(e):
+            raise
+        return SQLITE_DEFAULT_SCAN_ROWS
+
+def estimate_query_cost(cursor, db_type, sql_query: str):
+    """Estimate the cost of a statement from its EXPLAIN plan
+
+    Returns (cost, limitable): PostgreSQL reports the planner's total cost;
+    SQLite has no cost model, so the row counts of all full scans in the
+    nested loop are multiplied. limitable tells whether a LIMIT can stop
+    the query early (no sort, grouping or aggregation over the whole input).
+    """
+    if db_type == 'postgresql':
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Total Cost'], True
+
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql_query}")
+    details = [row[3] for row in cursor.fetchall()]
+    cost = 1.0
+    for detail in details:
+        match = re.match(r'SCAN (?:TABLE )?([\w.]+)', detail)
+        if match and match.group(1) != 'CONSTANT':
+            cost *= _sqlite_scan_rows(cursor, sql_query, match.group(1))
+    limitable = not any('TEMP B-TREE' in detail for detail in details) and \
+        not re.search(r'\b(count|sum|avg|min|max|group\s+by|order\s+by|distinct)\b', sql_query, re.IGNORECASE)
+    return cost, limitable
+
+def apply_auto_limit(sql_query: str) -> str:
+    """Wrap a statement so it returns at most AUTO_LIMIT_ROWS rows"""
+    return f"SELECT * FROM ({sql_query}) AS limited_query LIMIT {AUTO_LIMIT_ROWS}"
+
+def guard_query_cost(cursor, db_type, sql_query: str) -> str:
+    """Reject or auto-LIMIT statements whose estimated cost exceeds MAX_QUERY_COST"""
+    if MAX_QUERY_COST <= 0:
+        return sql_query
+
+    cost, limitable = estimate_query_cost(cursor, db_type, sql_query)
+    if cost <= MAX_QUERY_COST:
+        return sql_query
+
+    if AUTO_LIMIT_ROWS > 0 and limitable and not re.search(r'\blimit\s+\d+\s*$', sql_query, re.IGNORECASE):
+        limited_query = apply_auto_limit(sql_query)
+        # PostgreSQL re-plans with the LIMIT; SQLite stops a streaming scan once the LIMIT is reached
+        if db_type != 'postgresql' or estimate_query_cost(cursor, db_type, limited_query)[0] <= MAX_QUERY_COST:
+            print(f"Query cost {cost:.0f} exceeds {MAX_QUERY_COST:.0f}, applying LIMIT {AUTO_LIMIT_ROWS}")
+            record_metric('auto_limited')
+            return limited_query
+
+    record_metric('rejected')
+    raise HTTPException(
+        status_code=400,
+        detail=f"Query rejected: estimated cost {cost:.0f} exceeds the limit of {MAX_QUERY_COST:.0f}"
+    )
+
+def is_timeout_error(e: Exception) -> bool:
+    """Check whether an execution error was caused by the statement timeout"""
+    if isinstance(e, psycopg2.extensions.QueryCanceledError):
+        return True
+    return isinstance(e, sqlite3.OperationalError) and 'interrupted' in str(e)
+
+def get_parser_schema(schema: dict, db_id: Optional[str] = None):
+    """Get the process_sql Schema for a namespace (or the whole catalog), cached"""
+    key = db_id or '*'
+    with _schema_cache_lock:
+        if key not in _parser_schemas:
+            _parser_schemas[key] = build_parser_schema(schema)
+        return _parser_schemas[key]
+
+def generate_valid_sql(question: str, schema: dict, language: str = "en", db_id: Optional[str] = None) -> str:
+    """Generate SQL and validate it against the cached schema before execution
+
+    Unknown tables/columns are repaired locally when a cheap fix exists
+    (quoted-identifier case, stale {db_id}_ / namespace prefixes); only
+    otherwise is the model asked again with the validation error.
+    """
+    parser_schema = get_parser_schema(schema, db_id)
+    sql_query = generate_sql_with_gemini(question, schema, language)
+    for attempt in range(SQL_REPAIR_RETRIES + 1):
+        validated_sql, error = validate_sql(sql_query, parser_schema, db_id)
+        if error is None:
+            if validated_sql != sql_query:
+                record_metric('repaired')
+            return validated_sql
+        if attempt == SQL_REPAIR_RETRIES:
+            break
+        print(f"SQL validation failed ({error}), regenerating")
+        record_metric('regenerated')
+        sql_query = generate_sql_with_gemini(question, schema, language, sql_query, error)
+    # Validation is best effort; let execution report the final error
+    return sql_query
+
+# SQL 토큰: 문자열 리터럴 | 따옴표 식별자 | 단어 | 숫자 | 기타
+_SQL_TOKEN_RE = re.compile(
+    r"(?P<string>'(?:[^']|'')*')|(?P<ident>\"(?:[^\"]|\"\")*\")|(?P<word>[A-Za-z_][\w$]*)"
+    r"|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|(?P<other>\S)|(?P<space>\s+)"
+)
+# Clauses that start a new part of a statement; literals are only parameterized in filters
+_CLAUSE_KEYWORDS = ('select', 'from', 'where', 'group', 'having', 'order', 'limit', 'offset',
+                    'union', 'intersect', 'except')
+_PARAMETER_CLAUSES = ('where', 'having')
+# Typed literals such as DATE '2020-01-01' must stay inline
+_TYPED_LITERAL_PREFIXES = ('date', 'time', 'timestamp', 'interval')
+
+def extract_literals(sql_query: str, db_type: str):
+    """Replace the constants of WHERE and HAVING conditions with placeholders
+
+    Returns (shape, params): queries that differ only in their filter values
+    share one shape, which keys the prepared statement cache. Constants in
+    other clauses stay in place: in the select list they name result columns
+    (SQLite names a column after its expression text), and in GROUP BY /
+    ORDER BY / LIMIT / OFFSET they are positions and row counts.
+    """
+    parts = []
+    params = []
+    clause = ''
+    # Clause around each open parenthesis, restored when a subquery closes
+    outer_clauses = []
+    previous_word = ''
+    for match in _SQL_TOKEN_RE.finditer(sql_query):
+        kind, text = match.lastgroup, match.group()
+        if kind == 'space':
+            # Kept as written: SQLite takes expression column names from the statement text
+            parts.append(text)
+            continue
+        if kind == 'word':
+            word = text.lower()
+            if word in _CLAUSE_KEYWORDS:
+                clause = word
+            previous_word = word
+            parts.append(text)
+            continue
+
+        if kind == 'other' and text == '(':
+            outer_clauses.append(clause)
+        elif kind == 'other' and text == ')' and outer_clauses:
+            clause = outer_clauses.pop()
+        if clause not in _PARAMETER_CLAUSES or kind in ('ident', 'other') or \
+                (kind == 'string' and previous_word in _TYPED_LITERAL_PREFIXES):
+            parts.append(text)
+            previous_word = ''
+            continue
+
+        if kind == 'string':
+            params.append(text[1:-1].replace("''", "'"))
+            placeholder = f"${len(params)}"
+        else:
+            is_integer = not re.search(r'[.eE]', text)
+            params.append(int(text) if is_integer else float(text))
+            # Keep the literal's type: an untyped parameter would resolve to text
+            if not is_integer:
+                placeholder = f"${len(params)}::numeric"
+            elif abs(params[-1]) < 2 ** 31:
+                placeholder = f"${len(params)}::integer"
+            else:
+                placeholder = f"${len(params)}::bigint"
+        parts.append(placeholder if db_type == 'postgresql' else '?')
+        previous_word = ''
+    return ''.join(parts).strip(), params
+
+def acquire_connection(db_id: Optional[str] = None) -> dict:
+    """Take an idle pooled connection for a namespace, or open a new one
+
+    Pool entries carry the connection's prepared statement and cost verdict
+    caches, which is why connections are pooled per namespace and reused by
+    the execution path.
+    """
+    with _pool_lock:
+        idle = _connection_pool.get(db_id or '*', [])
+        while idle:
+            entry = idle.pop()
+            if entry['db_type'] != 'postgresql' or not entry['conn'].closed:
+                return entry
+    conn, db_type = get_db_connection(db_id)
+    return {'conn': conn, 'db_type': db_type, 'statements': OrderedDict(), 'verdicts': OrderedDict()}
+
+def release_connection(db_id: Optional[str], entry: dict):
+    """Roll back and return a connection to the pool, closing it if broken or the pool is full"""
+    conn = entry['conn']
+    try:
+        conn.rollback()
+    except Exception:
+        conn.close()
+        return
+    with _pool_lock:
+        idle = _connection_pool.setdefault(db_id or '*', [])
+        if len(idle) < DB_POOL_SIZE:
+            idle.append(entry)
+            return
+    conn.close()
+
+def close_connection_pool():
+    """Close every idle pooled connection"""
+    with _pool_lock:
+        entries = [entry for idle in _connection_pool.values() for entry in idle]
+        _connection_pool.clear()
+    for entry in entries:
+        entry['conn'].close()
+
+def prepare_statement(entry: dict, cursor, shape: str) -> Optional[str]:
+    """PREPARE a statement shape on a PostgreSQL connection, returning its name
+
+    SQLite needs no explicit step: the sqlite3 module caches compiled statements
+    per connection by SQL text, so executing the same shape reuses its plan.
+    Returns None when PostgreSQL cannot prepare the shape (e.g. untyped params).
+    """
+    if entry['db_type'] != 'postgresql':
+        return None
+    name = 'stmt_' + hashlib.md5(shape.encode()).hexdigest()[:16]
+    cursor.execute("SAVEPOINT prepare_statement")
+    try:
+        cursor.execute(f"PREPARE {name} AS {shape}")
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+        print(f"Could not prepare statement, executing unprepared: {e}")
+        return None
+    cursor.execute("RELEASE SAVEPOINT prepare_statement")
+    return name
+
+def lookup_statement(entry: dict, cursor, sql_query: str):
+    """Find or create the cached statement for a query on this connection
+
+    The cost guard's verdict (reject, auto-LIMIT or run as is) depends on the
+    literal values, so it is cached per shape and values and re-checked when
+    the values change; the prepared plan is shared by every query that
+    executes the same shape. Returns (statement, params).
+    """
+    db_type = entry['db_type']
+    statements = entry['statements']
+    verdicts = entry['verdicts']
+    shape, params = extract_literals(sql_query, db_type)
+    verdict_key = (shape, tuple(params))
+    limited = verdicts.pop(verdict_key, None)
+    if limited is None:
+        # A rejected query raises here and is checked again next time
+        limited = guard_query_cost(cursor, db_type, sql_query) != sql_query
+    verdicts[verdict_key] = limited
+    if len(verdicts) > PREPARED_CACHE_SIZE:
+        verdicts.popitem(last=False)
+
+    if limited:
+        shape, _ = extract_literals(apply_auto_limit(sql_query), db_type)
+    statement = statements.get(shape)
+    if statement is not None:
+        statements.move_to_end(shape)
+        record_metric('plan_cache_hits')
+        return statement, params
+
+    record_metric('plan_cache_misses')
+    statement = {
+        'shape': shape,
+        'limited': limited,
+        'name': prepare_statement(entry, cursor, shape),
+    }
+    statements[shape] = statement
+    if len(statements) > PREPARED_CACHE_SIZE:
+        _, evicted = statements.popitem(last=False)
+        if evicted['name']:
+            cursor.execute(f"DEALLOCATE {evicted['name']}")
+    return statement, params
+
+def execute_statement(cursor, db_type, statement: dict, sql_query: str, params: list):
+    """Execute a cached statement with the literals extracted from the query"""
+    if db_type != 'postgresql':
+        cursor.execute(statement['shape'], params)
+    elif statement['name']:
+        if params:
+            cursor.execute(f"EXECUTE {statement['name']} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cursor.execute(f"EXECUTE {statement['name']}")
+    else:
+        cursor.execute(apply_auto_limit(sql_query) if statement['limited'] else sql_query)
+
+class UnsupportedSummary(Exception):
+    """A query whose result a summary table cannot reproduce exactly"""
+
+def _summary_writer(namespace: str) -> threading.Lock:
+    """Lock of the connection that builds and refreshes a namespace's summaries"""
+    with _summary_lock:
+        return _summary_writers.setdefault(namespace, threading.Lock())
+
+def _summary_connection(namespace: str):
+    """Writable connection used to build and refresh summary tables of a namespace
+
+    Only used while holding the namespace's _summary_writer lock.
+    """
+    with _summary_lock:
+        connection = _summary_connections.get(namespace)
+    if connection is None:
+        connection = get_db_connection(namespace)
+        with _summary_lock:
+            _summary_connections[namespace] = connection
+    return connection
+
+def reset_summary_tables():
+    """Forget materialized summaries and the query frequency log"""
+    with _summary_lock:
+        _aggregate_query_counts.clear()
+        _summary_tables.clear()
+        _unsupported_summaries.clear()
+        connections = list(_summary_connections.values())
+        _summary_connections.clear()
+    for conn, _ in connections:
+        conn.close()
+
+def is_aggregate_shape(shape: str, params: list) -> bool:
+    """Whether a normalized query is a constant-free GROUP BY aggregate worth materializing"""
+    return not params and shape.lower().startswith('select') and ';' not in shape and \
+        re.search(r'\bgroup\s+by\b', shape, re.IGNORECASE) is not None and \
+        re.search(r'\b(count|sum|avg|min|max)\s*\(', shape, re.IGNORECASE) is not None
+
+def _base_tables(sql_query: str, namespace: str) -> list:
+    """Namespace tables a query may read (over-approximated by name matching)"""
+    words = set(re.findall(r'[a-z_][\w$]*', sql_query.lower()))
+    return sorted(table for table in _get_namespace_schema(namespace) if table.lower() in words)
+
+def aggregate_key(sql_query: str, db_id: Optional[str]):
+    """Summary key of a hot-aggregate candidate, None for queries that are never materialized"""
+    if not MATERIALIZE_AGGREGATES or not db_id:
+        return None
+    shape, params = extract_literals(sql_query, 'sqlite')
+    if not is_aggregate_shape(shape, params):
+        return None
+    return (db_id, shape.lower())
+
+def number_result_rows(sql_query: str) -> Optional[str]:
+    """The query with an mv_row column that numbers its rows in the query's own order
+
+    row_number() is computed inside the query, over its ORDER BY keys: the row
+    order of a query wrapped around an ordered subquery is not guaranteed.
+    Returns None when the order cannot be reproduced that way: set operations,
+    SELECT DISTINCT (the extra column would change what is distinct) and
+    ORDER BY keys that refer to output positions or aliases.
+    """
+    depth = 0
+    previous = ''
+    from_pos = order_pos = order_end = None
+    aliases = set()
+    for match in _SQL_TOKEN_RE.finditer(sql_query):
+        kind, text = match.lastgroup, match.group()
+        if kind == 'other' and text in '()':
+            depth += 1 if text == '(' else -1
+            continue
+        if depth or kind == 'space':
+            continue
+        if previous == 'as' and from_pos is None:
+            aliases.add(text.strip('"').lower())
+        if kind != 'word':
+            previous = ''
+            continue
+        word = text.lower()
+        if word in ('union', 'intersect', 'except') or (previous == 'select' and word == 'distinct'):
+            return None
+        if word == 'from' and from_pos is None:
+            from_pos = match.start()
+        elif word == 'by' and previous == 'order':
+            order_pos = match.end()
+        elif word in ('limit', 'offset') and order_pos is not None and order_end is None:
+            order_end = match.start()
+        previous = word
+    if from_pos is None:
+        return None
+
+    order_keys = sql_query[order_pos:order_end].strip() if order_pos is not None else ''
+    key_tokens = [[]]
+    depth = 0
+    for match in _SQL_TOKEN_RE.finditer(order_keys):
+        kind, text = match.lastgroup, match.group()
+        if kind == 'space':
+            continue
+        if text == ',' and depth == 0:
+            key_tokens.append([])
+            continue
+        if text in '()':
+            depth += 1 if text == '(' else -1
+        key_tokens[-1].append((kind, text.lower()))
+    for tokens in key_tokens:
+        if not tokens or not all(text in ('asc', 'desc') for _, text in tokens[1:]):
+            continue
+        kind, text = tokens[0]
+        # Output column positions and aliases are not visible inside OVER (...)
+        if kind == 'number' or (kind in ('word', 'ident') and text.strip('"') in aliases):
+            return None
+
+    window = f"ORDER BY {order_keys}" if order_keys else ""
+    return f"{sql_query[:from_pos].rstrip()}, row_number() OVER ({window}) AS mv_row {sql_query[from_pos:]}"
+
+def track_base_tables(conn, db_type, namespace: str, tables: list):
+    """Install triggers that bump mv_table_versions whenever a base table changes"""
+    cursor = conn.cursor()
+    versions_table = f"{namespace}.{SUMMARY_TABLE_PREFIX}table_versions"
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {versions_table} (table_name TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0)")
+    if db_type == 'postgresql':
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {namespace}.{SUMMARY_TABLE_PREFIX}bump_version() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO {versions_table} (table_name, version) VALUES (TG_TABLE_NAME, 1)
+                ON CONFLICT (table_name) DO UPDATE SET version = {versions_table}.version + 1;
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql;
+        """)
+    for table in tables:
+        if db_type == 'postgresql':
+            trigger = f"{SUMMARY_TABLE_PREFIX}track_{table}"
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {namespace}.{table}")
+            cursor.execute(f"""
+                CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {namespace}.{table}
+                FOR EACH STATEMENT EXECUTE FUNCTION {namespace}.{SUMMARY_TABLE_PREFIX}bump_version()
+            """)
+        else:
+            for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {namespace}.{SUMMARY_TABLE_PREFIX}track_{table}_{operation.lower()}
+                    AFTER {operation} ON {table}
+                    BEGIN
+                        INSERT INTO {SUMMARY_TABLE_PREFIX}table_versions (table_name, version) VALUES ('{table}', 1)
+                        ON CONFLICT (table_name) DO UPDATE SET version = version + 1;
+                    END
+                """)
+    cursor.close()
+
+def read_table_versions(conn, namespace: str, tables: list) -> dict:
+    """Current change counters of the given base tables"""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT table_name, version FROM {namespace}.{SUMMARY_TABLE_PREFIX}table_versions")
+    versions = dict(cursor.fetchall())
+    cursor.close()
+    return {table: versions.get(table, 0) for table in tables}
+
+def read_current_versions(conn, db_type, summary: dict) -> dict:
+    """Base table versions of a summary, read on a request's read-only connection"""
+    if db_type != 'postgresql':
+        return read_table_versions(conn, summary['namespace'], summary['base_tables'])
+    # A failed read must not abort the request's transaction
+    cursor = conn.cursor()
+    cursor.execute("SAVEPOINT summary_versions")
+    try:
+        versions = read_table_versions(conn, summary['namespace'], summary['base_tables'])
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT summary_versions")
+        raise
+    finally:
+        cursor.close()
+    return versions
+
+def begin_summary_transaction(conn, db_type, sql_query: str):
+    """Cursor for (re)computing a summary under the query guardrails
+
+    Summaries are written on the namespace's own writable connection, so the
+    build gets the statement timeout and the EXPLAIN cost limit explicitly.
+    There is no auto-LIMIT: a truncated result must not be stored as the
+    whole aggregate.
+    """
+    cursor = conn.cursor()
+    set_statement_timeout(conn, db_type, cursor)
+    if MAX_QUERY_COST > 0:
+        cost, _ = estimate_query_cost(cursor, db_type, sql_query)
+        if cost > MAX_QUERY_COST:
+            raise ValueError(f"estimated cost {cost:.0f} exceeds the limit of {MAX_QUERY_COST:.0f}")
+    return cursor
+
+def end_summary_transaction(conn, db_type):
+    """Drop the SQLite timeout handler; PostgreSQL's SET LOCAL ends with the transaction"""
+    if db_type != 'postgresql':
+        conn.set_progress_handler(None, 0)
+
+def _fill_summary(cursor, summary: dict, create: bool):
+    """(Re)compute a summary table; mv_row keeps the result order of the original query"""
+    if create:
+        cursor.execute(f"DROP TABLE IF EXISTS {summary['table']}")
+        cursor.execute(f"CREATE TABLE {summary['table']} AS {summary['fill_sql']}")
+    else:
+        cursor.execute(f"DELETE FROM {summary['table']}")
+        cursor.execute(f"INSERT INTO {summary['table']} {summary['fill_sql']}")
+
+def materialize_aggregate(namespace: str, shape: str, sql_query: str, column_names: list) -> Optional[dict]:
+    """Create the summary table for a hot aggregate query and return its descriptor
+
+    column_names are the result columns of the query's own execution; the
+    summary must return exactly those. Returns None when another summary of
+    the namespace is being written, so the caller can try again later.
+    """
+    fill_sql = number_result_rows(sql_query)
+    if fill_sql is None:
+        raise UnsupportedSummary("its row order cannot be numbered in the query")
+    if len(set(column_names)) != len(column_names) or 'mv_row' in column_names:
+        # CREATE TABLE AS renames (SQLite) or rejects (PostgreSQL) duplicate column names
+        raise UnsupportedSummary(f"duplicate result column names {column_names}")
+
+    writer = _summary_writer(namespace)
+    if not writer.acquire(blocking=False):
+        return None
+    try:
+        conn, db_type = _summary_connection(namespace)
+        summary = {
+            'namespace': namespace,
+            'table': f"{namespace}.{SUMMARY_TABLE_PREFIX}{hashlib.md5(shape.encode()).hexdigest()[:16]}",
+            'sql': sql_query,
+            'fill_sql': fill_sql,
+            'base_tables': _base_tables(sql_query, namespace),
+        }
+        try:
+            cursor = begin_summary_transaction(conn, db_type, sql_query)
+            track_base_tables(conn, db_type, namespace, summary['base_tables'])
+            summary['versions'] = read_table_versions(conn, namespace, summary['base_tables'])
+            _fill_summary(cursor, summary, create=True)
+            cursor.execute(f"SELECT * FROM {summary['table']} LIMIT 0")
+            columns = [description[0] for description in cursor.description][:-1]
+            if columns != column_names:
+                cursor.execute(f"DROP TABLE {summary['table']}")
+                conn.commit()
+                raise UnsupportedSummary(f"summary columns {columns} differ from the result columns {column_names}")
+            cursor.close()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            end_summary_transaction(conn, db_type)
+    finally:
+        writer.release()
+    quoted_columns = ', '.join('"' + column.replace('"', '""') + '"' for column in columns)
+    summary['select_sql'] = f"SELECT {quoted_columns} FROM {summary['table']} ORDER BY mv_row"
+    return summary
+
+def refresh_summary(summary: dict) -> bool:
+    """Recompute a summary if any of its base tables changed since it was built
+
+    Returns False, without waiting, when another summary of the namespace is
+    being written.
+    """
+    writer = _summary_writer(summary['namespace'])
+    if not writer.acquire(blocking=False):
+        return False
+    try:
+        conn, db_type = _summary_connection(summary['namespace'])
+        try:
+            cursor = begin_summary_transaction(conn, db_type, summary['sql'])
+            versions = read_table_versions(conn, summary['namespace'], summary['base_tables'])
+            if versions != summary['versions']:
+                _fill_summary(cursor, summary, create=False)
+                summary['versions'] = versions
+                record_metric('summary_refreshes')
+            cursor.close()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            end_summary_transaction(conn, db_type)
+    finally:
+        writer.release()
+    return True
+
+def rewrite_with_summary(conn, db_type, sql_query: str, db_id: Optional[str]) -> str:
+    """Serve hot GROUP BY aggregates from summary tables
+
+    Summaries are only looked up here; record_aggregate_execution counts a
+    shape once its guarded execution succeeded. Triggers version the base
+    tables: the first request that finds a summary stale recomputes it, and
+    requests meanwhile query the base tables instead of waiting for it.
+    """
+    key = aggregate_key(sql_query, db_id)
+    if key is None:
+        return sql_query
+    with _summary_lock:
+        summary = _summary_tables.get(key)
+        if summary is None or key in _summaries_in_flight:
+            return sql_query
+    try:
+        if read_current_versions(conn, db_type, summary) != summary['versions']:
+            with _summary_lock:
+                if key in _summaries_in_flight:
+                    return sql_query
+                _summaries_in_flight.add(key)
+            try:
+                if not refresh_summary(summary):
+                    return sql_query
+            finally:
+                with _summary_lock:
+                    _summaries_in_flight.discard(key)
+    except Exception as e:
+        # Summaries are an optimization; fall back to the base tables
+        print(f"Summary table unavailable, querying base tables: {e}")
+        return sql_query
+    record_metric('summary_hits')
+    return summary['select_sql']
+
+def record_aggregate_execution(sql_query: str, db_id: Optional[str], column_names: list):
+    """Count a successful guarded run of an aggregate; materialize it once it is hot
+
+    Every constant-free aggregate query is counted by its normalized shape;
+    once a shape has been run MATERIALIZE_THRESHOLD times its result is stored
+    in a summary table, and matching queries read from it instead. The build
+    runs outside _summary_lock, marked in flight so it happens only once.
+    """
+    key = aggregate_key(sql_query, db_id)
+    if key is None:
+        return
+    with _summary_lock:
+        if key in _summary_tables or key in _summaries_in_flight or key in _unsupported_summaries:
+            return
+        _aggregate_query_counts[key] = _aggregate_query_counts.get(key, 0) + 1
+        if _aggregate_query_counts[key] < MATERIALIZE_THRESHOLD:
+            return
+        _summaries_in_flight.add(key)
+
+    summary = None
+    try:
+        summary = materialize_aggregate(db_id, key[1], sql_query, column_names)
+    except UnsupportedSummary as e:
+        print(f"Not materializing aggregate: {e}")
+        with _summary_lock:
+            _unsupported_summaries.add(key)
+    except Exception as e:
+        print(f"Could not materialize aggregate, querying base tables: {e}")
+        with _summary_lock:
+            # Start counting again rather than retrying on every request
+            _aggregate_query_counts[key] = 0
+    finally:
+        with _summary_lock:
+            _summaries_in_flight.discard(key)
+            if summary is not None:
+                _summary_tables[key] = summary
+    if summary is not None:
+        record_metric('summary_created')
+
+def execute_sql_query(sql_query: str, db_id: Optional[str] = None):
+    """Execute SQL query in a read-only, time-limited transaction and return results"""
+    entry = None
+    try:
+        entry = acquire_connection(db_id)
+        conn, db_type = entry['conn'], entry['db_type']
+        cursor = begin_guarded_transaction(conn, db_type)
         
-        cursor.execute(sql_query)
+        sql_query = sql_query.strip().rstrip(';')
+        executed_query = rewrite_with_summary(conn, db_type, sql_query, db_id)
+        statement, params = lookup_statement(entry, cursor, executed_query)
+        execute_statement(cursor, db_type, statement, executed_query, params)
         results = cursor.fetchall()
         
         if db_type == 'sqlite' or db_type == 'sqlite_memory':
@@ -226,10 +1070,24 @@ def execute_sql_query(sql_query: str):
             result_list.append(result_dict)
         
         cursor.close()
-        conn.close()
-        return result_list
+        record_metric('executed')
+    except HTTPException:
+        raise
     except Exception as e:
+        if is_timeout_error(e):
+            record_metric('timed_out')
+            raise HTTPException(status_code=408, detail=f"SQL execution timed out after {QUERY_TIMEOUT_MS} ms")
+        record_metric('failed')
         raise HTTPException(status_code=400, detail=f"SQL execution error: {str(e)}")
+    finally:
+        if entry is not None:
+            release_connection(db_id, entry)
+
+    if executed_query == sql_query and not statement['limited']:
+        # Only complete results of queries that passed the guardrails count towards materializing;
+        # counted after the read transaction ended, so a build does not wait on its locks
+        record_aggregate_execution(sql_query, db_id, column_names)
+    return result_list
 
 def generate_explanation(question: str, sql_query: str, results: list, language: str = "en") -> str:
     """Generate explanation using Gemini"""
@@ -298,19 +1156,32 @@ async def health_check():
     except Exception as e:
         return {"status": "unhealthy", "error": str(e)}
 
+@api_app.get("/metrics")
+async def get_metrics():
+    with _metrics_lock:
+        metrics = dict(query_metrics)
+    lookups = metrics['plan_cache_hits'] + metrics['plan_cache_misses']
+    metrics['plan_cache_hit_rate'] = metrics['plan_cache_hits'] / lookups if lookups else 0.0
+    return {"queries": metrics}
+
+@api_app.get("/databases")
+async def get_databases():
+    return {"databases": get_available_databases()}
+
 @api_app.get("/schema")
-async def get_schema():
-    schema = get_database_schema()
+async def get_schema(db_id: Optional[str] = None):
+    schema = get_database_schema(resolve_db_id(db_id))
     return {"schema": schema}
 
 @api_app.post("/query", response_model=QueryResponse)
 async def process_query(request: QueryRequest):
-    schema = get_database_schema()
+    db_id = resolve_db_id(request.db_id)
+    schema = get_database_schema(db_id)
     if not schema:
         raise HTTPException(status_code=500, detail="Unable to retrieve database schema")
     
-    sql_query = generate_sql_with_gemini(request.question, schema, request.language)
-    results = execute_sql_query(sql_query)
+    sql_query = generate_valid_sql(request.question, schema, request.language, db_id)
+    results = execute_sql_query(sql_query, db_id)
     explanation = generate_explanation(request.question, sql_query, results, request.language)
     
     return QueryResponse(
@@ -345,6 +1216,8 @@ LANGUAGES = {
         "api_connected": "✅ API 서버 연결됨",
         "api_disconnected": "❌ API 서버 연결 실패",
         "db_schema": "📋 데이터베이스 스키마",
+        "database": "🗄️ 데이터베이스",
+        "all_databases": "전체 데이터베이스",
         "schema_error": "스키마 정보를 가져올 수 없습니다.",
         "ask_question": "💬 질문하기",
         "sample_questions": "📝 예시 질문들",
@@ -369,6 +1242,8 @@ LANGUAGES = {
         "api_connected": "✅ API Server Connected",
         "api_disconnected": "❌ API Server Connection Failed",
         "db_schema": "📋 Database Schema",
+        "database": "🗄️ Database",
+        "all_databases": "All databases",
         "schema_error": "Unable to retrieve schema information.",
         "ask_question": "💬 Ask a Question",
         "sample_questions": "📝 Sample Questions",
@@ -413,23 +1288,34 @@ def check_api_health():
     except:
         return False
 
-def get_database_schema_api():
+def get_databases_api():
+    """Get available Spider databases from API"""
+    try:
+        response = requests.get(f"{API_BASE_URL}/databases", timeout=10)
+        if response.status_code == 200:
+            return response.json()["databases"]
+        return []
+    except:
+        # 배포 환경에서는 직접 목록 가져오기
+        return get_available_databases()
+
+def get_database_schema_api(db_id=None):
     """Get database schema from API"""
     try:
-        response = requests.get(f"{API_BASE_URL}/schema", timeout=10)
+        response = requests.get(f"{API_BASE_URL}/schema", params={"db_id": db_id} if db_id else None, timeout=10)
         if response.status_code == 200:
             return response.json()["schema"]
         return None
     except:
         # 배포 환경에서는 직접 스키마 가져오기
-        return get_database_schema()
+        return get_database_schema(db_id)
 
-def query_api(question, language="en"):
+def query_api(question, language="en", db_id=None):
     """Send query to API and get response"""
     try:
         response = requests.post(
             f"{API_BASE_URL}/query",
-            json={"question": question, "language": language},
+            json={"question": question, "language": language, "db_id": db_id},
             timeout=30
         )
         if response.status_code == 200:
@@ -441,12 +1327,12 @@ def query_api(question, language="en"):
     except Exception as e:
         # 배포 환경에서는 직접 처리
         try:
-            schema = get_database_schema()
+            schema = get_database_schema(db_id)
             if not schema:
                 return {"error": "Unable to retrieve database schema"}
             
-            sql_query = generate_sql_with_gemini(question, schema, language)
-            results = execute_sql_query(sql_query)
+            sql_query = generate_valid_sql(question, schema, language, db_id)
+            results = execute_sql_query(sql_query, db_id)
             explanation = generate_explanation(question, sql_query, results, language)
             
             return {
@@ -473,8 +1359,17 @@ with st.sidebar:
     
     st.header(lang["db_schema"])
     
+    # 데이터베이스 선택 (선택하지 않으면 전체 카탈로그 사용)
+    databases = get_databases_api()
+    selected_db = st.selectbox(
+        lang["database"],
+        [None] + databases,
+        format_func=lambda db: lang["all_databases"] if db is None else db,
+        key="db_id"
+    )
+    
     # 데이터베이스 스키마 표시
-    schema = get_database_schema_api()
+    schema = get_database_schema_api(selected_db)
     if schema:
         for table_name, columns in schema.items():
             with st.expander(f"📁 {table_name}"):
@@ -538,7 +1433,7 @@ if st.button(lang["ask_button"], type="primary") or st.session_state.user_questi
         
         with st.spinner(lang["thinking"]):
             language_code = "ko" if selected_lang == "한국어" else "en"
-            result = query_api(question, language_code)
+            result = query_api(question, language_code, selected_db)
         
         # 대화 기록에 추가
         timestamp = datetime.now().strftime("%H:%M:%S")
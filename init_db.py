@@ -3,6 +3,8 @@ Database initialization script for PostgreSQL
 Creates sample Spider dataset tables and inserts data
 """
 import os
+import re
+import sys
 import json
 import sqlite3
 import psycopg2
@@ -10,6 +12,9 @@ from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 import logging
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spider'))
+from schema_catalog import load_catalog
+
 # Load environment variables
 load_dotenv()
 
@@ -17,6 +22,34 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Directory holding one SQLite file per Spider database (attached as a namespace)
+NAMESPACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spider_dbs')
+
+def namespace_for(db_id):
+    """Map a Spider db_id to its namespace (PostgreSQL schema / attached SQLite database name)"""
+    return re.sub(r'\W', '_', db_id.replace(' ', '_').replace('-', '_').lower())
+
+def attach_namespace(conn, namespace, db_type='sqlite'):
+    """Attach the SQLite file backing a namespace to the connection, if not attached yet"""
+    attached = {row[1] for row in conn.execute("PRAGMA database_list").fetchall()}
+    if namespace in attached:
+        return
+    if db_type == 'sqlite_memory':
+        path = ':memory:'
+    else:
+        os.makedirs(NAMESPACE_DIR, exist_ok=True)
+        path = os.path.join(NAMESPACE_DIR, f"{namespace}.sqlite")
+    conn.execute(f"ATTACH DATABASE ? AS {namespace}", (path,))
+
+def create_namespace(conn, db_type, namespace):
+    """Create the namespace that holds all tables of one Spider database"""
+    if db_type == 'postgresql':
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {namespace};")
+        cursor.close()
+    else:
+        attach_namespace(conn, namespace, db_type)
+
 def get_db_connection():
     """Get database connection with fallback logic"""
     # Check if we're in a deployment environment
@@ -56,8 +89,8 @@ def load_spider_schema():
         return []
     
     try:
-        with open(tables_path, 'r', encoding='utf-8') as f:
-            databases = json.load(f)
+        # Compiled once into tables.catalog next to tables.json, recompiled when tables.json changes
+        databases = load_catalog(tables_path).entries()
         logger.info(f"Loaded {len(databases)} databases from Spider dataset")
         return databases
     except Exception as e:
@@ -87,11 +120,15 @@ def get_sql_type(column_type, db_type):
     return mapping.get(column_type, mapping['others'])
 
 def create_database_schema(conn, db_type, database_info):
-    """Create tables for a single database"""
+    """Create tables for a single database inside its own namespace"""
     cursor = conn.cursor()
     db_id = database_info['db_id']
+    namespace = namespace_for(db_id)
     
     try:
+        create_namespace(conn, db_type, namespace)
+        
+
         # Get table information
         table_names = database_info['table_names_original']
         column_names = database_info['column_names_original']
@@ -102,7 +139,7 @@ def create_database_schema(conn, db_type, database_info):
         # Create tables
         for table_idx, table_name in enumerate(table_names):
             # Clean table name for SQL
-            clean_table_name = f"{db_id}_{table_name}".replace(' ', '_').replace('-', '_').lower()
+            clean_table_name = table_name.replace(' ', '_').replace('-', '_').lower()
             
             # Get columns for this table
             table_columns = []
@@ -137,13 +174,13 @@ def create_database_schema(conn, db_type, database_info):
                 # Create table SQL
                 columns_sql = ',\n    '.join(table_columns)
                 create_sql = f"""
-                CREATE TABLE IF NOT EXISTS {clean_table_name} (
+                CREATE TABLE IF NOT EXISTS {namespace}.{clean_table_name} (
                     {columns_sql}
                 );
                 """
                 
                 cursor.execute(create_sql)
-                logger.info(f"Created table: {clean_table_name}")
+                logger.info(f"Created table: {namespace}.{clean_table_name}")
         
         conn.commit()
         return True
@@ -157,46 +194,47 @@ def insert_sample_data(conn, db_type, database_info):
     """Insert sample data for demonstration"""
     cursor = conn.cursor()
     db_id = database_info['db_id']
+    namespace = namespace_for(db_id)
     
     try:
         # Sample data for popular databases
         sample_data = {
             'concert_singer': {
-                f'{db_id}_stadium': [
+                'stadium': [
                     (1, 'Rosemont', 'Allstate Arena', 18500, 20000, 10000, 15000),
                     (2, 'Phoenix', 'Talking Stick Resort Arena', 18422, 19000, 9000, 14000),
                     (3, 'Anaheim', 'Honda Center', 17174, 18000, 8000, 13000)
                 ],
-                f'{db_id}_singer': [
+                'singer': [
                     (1, 'John Mayer', 'United States', 'Gravity', 2006, 45, 1),
                     (2, 'Taylor Swift', 'United States', 'Love Story', 2008, 34, 0),
                     (3, 'Ed Sheeran', 'United Kingdom', 'Shape of You', 2017, 33, 1)
                 ],
-                f'{db_id}_concert': [
+                'concert': [
                     (1, 'Summer Music Festival', 'Pop', 1, 2023),
                     (2, 'Rock Night', 'Rock', 2, 2023),
                     (3, 'Acoustic Evening', 'Acoustic', 3, 2024)
                 ]
             },
             'student_transcripts_tracking': {
-                f'{db_id}_students': [
+                'students': [
                     (1, 'John', 'Doe', 'john.doe@email.com', '2000-01-15'),
                     (2, 'Jane', 'Smith', 'jane.smith@email.com', '1999-05-20'),
                     (3, 'Mike', 'Johnson', 'mike.j@email.com', '2001-03-10')
                 ],
-                f'{db_id}_courses': [
+                'courses': [
                     (1, 'Computer Science', 'CS101'),
                     (2, 'Mathematics', 'MATH201'),
                     (3, 'Physics', 'PHYS101')
                 ]
             },
             'world_1': {
-                f'{db_id}_country': [
+                'country': [
                     ('AFG', 'Afghanistan', 'Asia', 'Southern and Central Asia', 652090, 1919, 22720000, 45.9, 5976, None, 'Afganistan/Afqanestan', 'Islamic Emirate', 'Mohammad Omar', 1, 'AF'),
                     ('USA', 'United States', 'North America', 'North America', 9363520, 1776, 278357000, 78.3, 8510700, 8110900, 'United States', 'Federal Republic', 'George W. Bush', 3813, 'US'),
                     ('KOR', 'South Korea', 'Asia', 'Eastern Asia', 99720, 1948, 46844000, 74.4, 320749, 442544, 'Taehan Min\'guk (South Korea)', 'Republic', 'Kim Dae-jung', 2331, 'KR')
                 ],
-                f'{db_id}_city': [
+                'city': [
                     (1, 'Kabul', 'AFG', 'Kabol', 1780000),
                     (2, 'New York', 'USA', 'New York', 8008278),
                     (3, 'Seoul', 'KOR', 'Seoul', 9981619)
@@ -210,22 +248,25 @@ def insert_sample_data(conn, db_type, database_info):
                 if rows:
                     # Get column count for this table
                     if db_type == 'postgresql':
-                        cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}' ORDER BY ordinal_position")
+                        cursor.execute(
+                            "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position",
+                            (namespace, table_name)
+                        )
                     else:
-                        cursor.execute(f"PRAGMA table_info({table_name})")
+                        cursor.execute(f"PRAGMA {namespace}.table_info({table_name})")
                     
                     columns = cursor.fetchall()
                     if columns:
                         col_count = len(columns)
                         placeholders = ', '.join(['%s' if db_type == 'postgresql' else '?' for _ in range(col_count)])
                         
-                        insert_sql = f"INSERT OR IGNORE INTO {table_name} VALUES ({placeholders})" if db_type == 'sqlite' else f"INSERT INTO {table_name} VALUES ({placeholders}) ON CONFLICT DO NOTHING"
+                        insert_sql = f"INSERT INTO {namespace}.{table_name} VALUES ({placeholders}) ON CONFLICT DO NOTHING" if db_type == 'postgresql' else f"INSERT OR IGNORE INTO {namespace}.{table_name} VALUES ({placeholders})"
                         
                         for row in rows:
                             try:
                                 cursor.execute(insert_sql, row[:col_count])
                             except Exception as e:
-                                logger.warning(f"Could not insert sample data into {table_name}: {e}")
+                                logger.warning(f"Could not insert sample data into {namespace}.{table_name}: {e}")
         
         conn.commit()
         logger.info(f"Inserted sample data for {db_id}")
@@ -0,0 +1,66 @@
+"""
+CPU throughput of batched SQLNet inference (forward + gen_sql) by batch size
+
+usage: python bench_inference.py --dataset data/ [--batch_sizes 1,2,4,8,16,32,64,128] [--threads N] [--random_init]
+
+Runs the dev questions through SQLNetPredictor on the CPU, as serve.py does,
+and reports questions/s, ms per batch and the part of it spent decoding the
+scores into SQL (gen_sql) for every batch size. The first batches of each
+size are a warm-up and are not timed. --random_init skips loading
+saved_models/, which does not change the cost of a forward pass.
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import torch
+import argparse
+from scripts.inference import SQLNetPredictor, TEST_ENTRY
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='',
+            help='dataset directory holding tables.json and dev.json')
+    parser.add_argument('--batch_sizes', type=str, default='1,2,4,8,16,32,64,128')
+    parser.add_argument('--examples', type=int, default=512,
+            help='dev questions timed per batch size')
+    parser.add_argument('--threads', type=int, default=0,
+            help='torch CPU threads, 0 keeps the torch default')
+    parser.add_argument('--random_init', action='store_true')
+    args = parser.parse_args()
+
+    N_word=300
+    B_word=42
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    predictor = SQLNetPredictor(os.path.join(args.dataset, 'tables.json'),
+            'glove/glove.%dB.%dd.txt'%(B_word,N_word), gpu=False, N_word=N_word,
+            load_models=not args.random_init)
+    with open(os.path.join(args.dataset, 'dev.json')) as inf:
+        requests = [{'question': sql['question'], 'question_toks': sql['question_toks'], 'db_id': sql['db_id']}
+                for sql in json.load(inf)]
+    while len(requests) < args.examples:
+        requests = requests + requests
+    requests = requests[:args.examples]
+
+    def run(batch):
+        q_seq, col_seq, col_num, col_org_seq, schema_seq = predictor.to_batch(batch)
+        score = predictor.model.forward(q_seq, col_seq, col_num, TEST_ENTRY)
+        start = time.time()
+        predictor.model.gen_sql(score, col_org_seq, schema_seq)
+        return time.time() - start
+
+    print('{:>6} {:>12} {:>12} {:>12}'.format('batch', 'questions/s', 'ms/batch', 'decode ms'))
+    for batch_size in [int(x) for x in args.batch_sizes.split(',')]:
+        for st in range(0, min(2 * batch_size, len(requests)), batch_size):
+            run(requests[st:st + batch_size])
+        decode = 0.0
+        start = time.time()
+        for st in range(0, len(requests), batch_size):
+            decode += run(requests[st:st + batch_size])
+        elapsed = time.time() - start
+        n_batches = (len(requests) + batch_size - 1) // batch_size
+        print('{:>6} {:>12.1f} {:>12.2f} {:>12.2f}'.format(batch_size, len(requests) / elapsed,
+                elapsed / n_batches * 1e3, decode / n_batches * 1e3))
@@ -0,0 +1,120 @@
+"""
+Microbenchmark of WordEmbedding batch construction (gen_x_batch + gen_col_batch)
+
+usage: python bench_word_embedding.py [--batch_size 64] [--glove glove/glove.42B.300d.txt] [--is_list]
+
+Compares the previous per-token loops (looking up one vector at a time and
+copying it element-wise into the padded array) with the index-based batching
+(token-id matrix + one gather). Without --glove a random 50k-word vocabulary
+is used; with a converted GloVe store (scripts/glove_store.py) the gather
+reads the memory-mapped matrix. --is_list builds TypeSQL-style batches where
+every question position is a list of words whose vectors are averaged.
+"""
+from __future__ import print_function
+import time
+import argparse
+import numpy as np
+from scripts.glove_store import GloveStore
+from scripts.model.modules.word_embedding import WordEmbedding
+
+
+def legacy_x_batch(word_emb, N_word, q, is_list=False, is_q=False):
+    """Fixed-embedding part of gen_x_batch before index-based batching"""
+    B = len(q)
+    val_embs = []
+    val_len = np.zeros(B, dtype=np.int64)
+    for i, one_q in enumerate(q):
+        if not is_list:
+            q_val = [word_emb.get(x, np.zeros(N_word, dtype=np.float32)) for x in one_q]
+        else:
+            q_val = []
+            for ws in one_q:
+                emb_list = [word_emb.get(w, np.zeros(N_word, dtype=np.float32)) for w in ws]
+                q_val.append(emb_list[0] if len(ws) == 1 else sum(emb_list) / float(len(ws)))
+        if not is_list or is_q:
+            val_embs.append([np.zeros(N_word, dtype=np.float32)] + q_val + [np.zeros(N_word, dtype=np.float32)])
+        else:
+            val_embs.append(q_val)
+        val_len[i] = len(val_embs[-1])
+    max_len = max(val_len)
+    val_emb_array = np.zeros((B, max_len, N_word), dtype=np.float32)
+    for i in range(B):
+        for t in range(len(val_embs[i])):
+            val_emb_array[i, t, :] = val_embs[i][t]
+    return val_emb_array, val_len
+
+
+def legacy_col_batch(word_emb, N_word, cols):
+    names = []
+    for one_cols in cols:
+        names = names + one_cols
+    val_embs = [[word_emb.get(x, np.zeros(N_word, dtype=np.float32)) for x in one_str] for one_str in names]
+    val_len = np.array([len(val) for val in val_embs], dtype=np.int64)
+    val_emb_array = np.zeros((len(names), max(val_len), N_word), dtype=np.float32)
+    for i in range(len(names)):
+        for t in range(len(val_embs[i])):
+            val_emb_array[i, t, :] = val_embs[i][t]
+    return val_emb_array, val_len
+
+
+def random_batch(rng, words, batch_size, is_list):
+    def phrase(n):
+        return [words[rng.randint(len(words))] for _ in range(n)]
+    if is_list:
+        q = [[phrase(rng.randint(1, 4)) for _ in range(rng.randint(5, 25))] for _ in range(batch_size)]
+    else:
+        q = [phrase(rng.randint(8, 40)) for _ in range(batch_size)]
+    cols = [[phrase(rng.randint(1, 4)) for _ in range(rng.randint(5, 40))] for _ in range(batch_size)]
+    return q, cols
+
+
+def bench(fn, batches, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        for q, cols in batches:
+            fn(q, cols)
+        elapsed = (time.time() - start) / len(batches)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--glove', type=str, default=None,
+            help='GloVe text file converted with scripts/glove_store.py')
+    parser.add_argument('--is_list', action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    if args.glove:
+        word_emb = GloveStore.load(args.glove)
+        N_word = word_emb.N_word
+    else:
+        N_word = 300
+        vocab = ['w%d' % i for i in range(50000)]
+        word_emb = GloveStore(dict((w, i) for i, w in enumerate(vocab)),
+                rng.randn(len(vocab), N_word).astype(np.float32))
+    words = sorted(word_emb.w2i)[:50000] + ['<unk%d>' % i for i in range(5000)]
+    batches = [random_batch(rng, words, args.batch_size, args.is_list) for _ in range(args.batches)]
+    embed = WordEmbedding(word_emb, N_word, False, [])
+
+    def legacy(q, cols):
+        legacy_x_batch(word_emb, N_word, q, is_list=args.is_list, is_q=True)
+        legacy_col_batch(word_emb, N_word, cols)
+
+    def indexed(q, cols):
+        embed.gen_x_batch(q, cols, is_list=args.is_list, is_q=True)
+        embed.gen_col_batch(cols)
+
+    q, cols = batches[0]
+    same = np.array_equal(legacy_x_batch(word_emb, N_word, q, is_list=args.is_list, is_q=True)[0],
+            embed.gen_x_batch(q, cols, is_list=args.is_list, is_q=True)[0].data.cpu().numpy())
+    print('batch size {}, identical question batch: {}'.format(args.batch_size, same))
+    old = bench(legacy, batches, args.repeats)
+    new = bench(indexed, batches, args.repeats)
+    print('per-token loops: {:8.2f} ms/batch'.format(old * 1e3))
+    print('index + gather:  {:8.2f} ms/batch ({:.1f}x faster)'.format(new * 1e3, old / new))
@@ -0,0 +1,275 @@
+"""
+Pre-tokenized, pre-indexed cache of a processed dataset split
+
+load_data_new used to json.load the whole split, run lower_keys over it and
+redo process() on every launch. The cache keeps the process() output in flat
+numpy arrays instead (one .npz next to the json file):
+    tokens          vocabulary ids, with per-example offsets
+    int lists       sel/agg/cond/group/having/order columns and ops, with offsets
+    texts           question and query as utf-8 bytes, with offsets
+    values          condition/having values as json, decoded per example
+Loading it takes milliseconds; examples are sliced out of the arrays when a
+batch asks for them. The cache is rebuilt when the json or tables.json changes.
+
+Build it ahead of time with
+    python -m scripts.data_cache data/
+or let load_dataset write it on the first run.
+"""
+import os
+import sys
+import json
+import numpy as np
+
+# process() fields holding a list of tokens
+TOKEN_FIELDS = ('question_tok', 'query_tok', 'conj')
+# process() fields holding a list of token lists
+NESTED_TOKEN_FIELDS = ()
+# Dataset splits cached by the command line
+SPLITS = ('train.json', 'dev.json')
+
+TEXT_FIELDS = ('question', 'query')
+INT_FIELDS = ('agg', 'sel', 'cond_col', 'cond_op', 'group_col', 'hv_agg', 'hv_col', 'hv_op',
+        'order_agg', 'order_col')
+SCALAR_FIELDS = ('order_par', 'special', 'db')
+
+
+def cache_path(sql_path):
+    return os.path.splitext(sql_path)[0] + '.cache.npz'
+
+
+def source_stamp(*paths):
+    """(size, mtime) of the files a cache was built from"""
+    stamp = []
+    for path in paths:
+        stat = os.stat(path)
+        stamp.extend([stat.st_size, stat.st_mtime])
+    return np.array(stamp, dtype=np.float64)
+
+
+def _offsets(lens):
+    off = np.zeros(len(lens) + 1, dtype=np.int64)
+    np.cumsum(lens, out=off[1:])
+    return off
+
+
+def _ragged(lists, dtype=np.int32):
+    """Flat values and offsets of a list of lists"""
+    values = np.array([v for x in lists for v in x], dtype=dtype)
+    return values, _offsets([len(x) for x in lists])
+
+
+def _to_bytes(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def _texts(texts):
+    data = [_to_bytes(text) for text in texts]
+    return np.frombuffer(b''.join(data), dtype=np.uint8), _offsets([len(x) for x in data])
+
+
+def _int_lists(sql):
+    having = sql['group'][-1]
+    return {
+        'agg': sql['agg'],
+        'sel': sql['sel'],
+        'cond_col': [x[0] for x in sql['cond']],
+        'cond_op': [x[1] for x in sql['cond']],
+        'group_col': sql['group'][:-1],
+        'hv_agg': having[0],
+        'hv_col': having[1],
+        'hv_op': having[2],
+        'order_agg': sql['order'][0],
+        'order_col': sql['order'][1],
+    }
+
+
+def build_cache(sql_data, db_ids, path, stamp):
+    """Write the process() output of one split to path"""
+    vocab = {}
+
+    def ids(tokens):
+        return [vocab.setdefault(tok, len(vocab)) for tok in tokens]
+
+    db_index = dict((db_id, idx) for idx, db_id in enumerate(db_ids))
+    arrays = {'stamp': stamp}
+    for field in TOKEN_FIELDS:
+        arrays[field], arrays[field + '_off'] = _ragged([ids(sql[field]) for sql in sql_data])
+    for field in NESTED_TOKEN_FIELDS:
+        items = [ids(item) for sql in sql_data for item in sql[field]]
+        arrays[field], arrays[field + '_item_off'] = _ragged(items)
+        arrays[field + '_off'] = _offsets([len(sql[field]) for sql in sql_data])
+    int_lists = [_int_lists(sql) for sql in sql_data]
+    for field in INT_FIELDS:
+        arrays[field], arrays[field + '_off'] = _ragged([x[field] for x in int_lists])
+    arrays['order_par'] = np.array([sql['order'][2] for sql in sql_data], dtype=np.int32)
+    arrays['special'] = np.array([sql['special'] for sql in sql_data], dtype=np.int32)
+    arrays['db'] = np.array([db_index[sql['table_id']] for sql in sql_data], dtype=np.int32)
+    for field in TEXT_FIELDS:
+        arrays[field], arrays[field + '_off'] = _texts([sql[field] for sql in sql_data])
+    arrays['values'], arrays['values_off'] = _texts(
+            [json.dumps([[x[2] for x in sql['cond']], sql['group'][-1][3:]]) for sql in sql_data])
+    tokens = [tok for tok, _ in sorted(vocab.items(), key=lambda x: x[1])]
+    arrays['vocab'], arrays['vocab_off'] = _texts(tokens)
+    arrays['db_ids'], arrays['db_ids_off'] = _texts(db_ids)
+
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.rename(tmp, path)
+
+
+def _decode_all(blob, off):
+    data = blob.tobytes()
+    off = off.tolist()
+    return [data[off[i]:off[i + 1]].decode('utf-8') for i in range(len(off) - 1)]
+
+
+def _ranges(off, idx):
+    """Positions covered by the [off[i], off[i + 1]) ranges of idx, and the range lengths"""
+    starts = off[idx]
+    lens = off[idx + 1] - starts
+    ends = np.cumsum(lens)
+    pos = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lens, lens) + np.repeat(starts, lens)
+    return pos, lens
+
+
+def _split(flat, lens):
+    ends = np.cumsum(lens)
+    return [flat[st:ed] for st, ed in zip((ends - lens).tolist(), ends.tolist())]
+
+
+class CachedSQLData(object):
+    """Read-only sequence of process() examples backed by a cache file
+
+    Indexing returns the same dict process() builds; slicing returns a view.
+    take() decodes the examples of a batch with one gather per field, the
+    first time they are asked for; later epochs reuse the decoded dicts.
+    """
+
+    def __init__(self, arrays, tables, vocab, db_ids, idxes=None, decoded=None):
+        self._arrays = arrays
+        self._tables = tables
+        self._vocab = vocab
+        self._db_ids = db_ids
+        self._idxes = idxes if idxes is not None else np.arange(len(arrays['db']))
+        self._decoded = decoded if decoded is not None else {}
+        self._texts = dict((field, (arrays[field].tobytes(), arrays[field + '_off'].tolist()))
+                for field in TEXT_FIELDS + ('values',))
+
+    @classmethod
+    def load(cls, path, table_data, stamp=None):
+        """Open a cache, None when it is missing or was built from other files"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            arrays = dict((key, data[key]) for key in data.files)
+        if stamp is not None and not np.array_equal(arrays['stamp'], stamp):
+            return None
+        tables = dict((tab['db_id'], tab) for tab in table_data)
+        return cls(arrays, tables, _decode_all(arrays['vocab'], arrays['vocab_off']),
+                _decode_all(arrays['db_ids'], arrays['db_ids_off']))
+
+    def __len__(self):
+        return len(self._idxes)
+
+    def __iter__(self):
+        for st in range(0, len(self), 1024):
+            for sql in self.take(range(st, min(st + 1024, len(self)))):
+                yield sql
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return CachedSQLData(self._arrays, self._tables, self._vocab, self._db_ids, self._idxes[i],
+                    self._decoded)
+        return self.take([i])[0]
+
+    def _ints(self, field, idx):
+        pos, lens = _ranges(self._arrays[field + '_off'], idx)
+        return _split(self._arrays[field][pos].tolist(), lens)
+
+    def _tokens(self, field, idx, off_key='_off'):
+        vocab = self._vocab
+        pos, lens = _ranges(self._arrays[field + off_key], idx)
+        return _split([vocab[t] for t in self._arrays[field][pos].tolist()], lens)
+
+    def _nested_tokens(self, field, idx):
+        items, lens = _ranges(self._arrays[field + '_off'], idx)
+        return _split(self._tokens(field, items, '_item_off'), lens)
+
+    def _text(self, field, idx):
+        data, off = self._texts[field]
+        return [data[off[i]:off[i + 1]].decode('utf-8') for i in idx.tolist()]
+
+    def take(self, idxes):
+        """process() output of the examples at positions idxes, as a list"""
+        idx = self._idxes[np.asarray(idxes, dtype=np.int64)].tolist()
+        decoded = self._decoded
+        missing = [i for i in idx if i not in decoded]
+        if missing:
+            decoded.update(zip(missing, self._decode(np.array(missing, dtype=np.int64))))
+        return [decoded[i] for i in idx]
+
+    def _decode(self, idx):
+        fields = {}
+        for field in TEXT_FIELDS:
+            fields[field] = self._text(field, idx)
+        for field in TOKEN_FIELDS:
+            fields[field] = self._tokens(field, idx)
+        for field in NESTED_TOKEN_FIELDS:
+            fields[field] = self._nested_tokens(field, idx)
+        ints = dict((field, self._ints(field, idx)) for field in INT_FIELDS)
+        values = [json.loads(text) for text in self._text('values', idx)]
+        db_ids = [self._db_ids[db] for db in self._arrays['db'][idx].tolist()]
+        order_par = self._arrays['order_par'][idx].tolist()
+        special = self._arrays['special'][idx].tolist()
+
+        ret = []
+        for b, db_id in enumerate(db_ids):
+            table = self._tables[db_id]
+            cond_vals, having_val = values[b]
+            sql = dict((field, fields[field][b]) for field in fields)
+            sql['table_id'] = db_id
+            sql['col_org'] = table['column_names_original']
+            sql['table_org'] = table['table_names_original']
+            sql['fk_info'] = table['foreign_keys']
+            sql['agg'] = ints['agg'][b]
+            sql['sel'] = ints['sel'][b]
+            sql['cond'] = [[col, op, val] for col, op, val in zip(ints['cond_col'][b], ints['cond_op'][b], cond_vals)]
+            sql['group'] = ints['group_col'][b] + [[ints['hv_agg'][b], ints['hv_col'][b], ints['hv_op'][b]] + having_val]
+            sql['order'] = [ints['order_agg'][b], ints['order_col'][b], order_par[b]]
+            sql['special'] = special[b]
+            ret.append(sql)
+        return ret
+
+
+def take(sql_data, idxes):
+    """Examples of sql_data (a list or a CachedSQLData) at positions idxes"""
+    if isinstance(sql_data, CachedSQLData):
+        return sql_data.take(idxes)
+    return [sql_data[i] for i in idxes]
+
+
+def load_cached(sql_path, table_path, table_data):
+    """Cached process() output of a split, None when there is no up-to-date cache"""
+    return CachedSQLData.load(cache_path(sql_path), table_data, source_stamp(sql_path, table_path))
+
+
+def write_cache(sql_path, table_path, sql_data, table_data):
+    build_cache(sql_data, [tab['db_id'] for tab in table_data], cache_path(sql_path),
+            source_stamp(sql_path, table_path))
+
+
+if __name__ == '__main__':
+    from scripts.utils import lower_keys, process
+
+    if len(sys.argv) != 2:
+        print('Usage: python -m scripts.data_cache [dataset dir with tables.json and %s]' % ', '.join(SPLITS))
+        sys.exit(1)
+    table_path = os.path.join(sys.argv[1], 'tables.json')
+    with open(table_path) as inf:
+        table_data = json.load(inf)
+    for split in SPLITS:
+        sql_path = os.path.join(sys.argv[1], split)
+        with open(sql_path) as inf:
+            sql_data, _ = process(lower_keys(json.load(inf)), table_data)
+        write_cache(sql_path, table_path, sql_data, table_data)
+        print('Cached %d examples of %s in %s' % (len(sql_data), sql_path, cache_path(sql_path)))
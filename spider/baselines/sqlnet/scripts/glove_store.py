@@ -0,0 +1,117 @@
+"""
+Binary GloVe store: a word -> row index map (word2idx.json) and a float32
+matrix (.npy) that is memory-mapped instead of parsed, so every training or
+test process shares the same pages of the OS cache.
+
+Convert the text file once:
+    python scripts/glove_store.py glove/glove.42B.300d.txt
+which writes glove/glove.42B.300d.word2idx.json and glove/glove.42B.300d.npy;
+load_word_emb then picks them up automatically.
+"""
+import io
+import os
+import sys
+import json
+from array import array
+
+import numpy as np
+
+# Number of leading lines read with use_small, as load_word_emb does
+SMALL_SIZE = 5000
+
+
+def store_paths(file_name):
+    """(word2idx.json, matrix .npy) paths of the store converted from a GloVe text file"""
+    prefix = os.path.splitext(file_name)[0]
+    return prefix + '.word2idx.json', prefix + '.npy'
+
+
+def has_store(file_name):
+    return all(os.path.exists(path) for path in store_paths(file_name))
+
+
+def convert_glove(file_name):
+    """Convert a GloVe text file into a word2idx.json + float32 .npy store
+
+    Words are kept exactly as load_word_emb keeps them. The first pass
+    assigns a row to every kept line, the second parses the vectors straight
+    into a memory-mapped output matrix, so memory use stays flat.
+    """
+    w2i = {}
+    line_rows = array('l')
+    dim = None
+    with io.open(file_name, 'r', encoding='utf-8', newline='\n') as inf:
+        for line in inf:
+            word, _, rest = line.strip().partition(' ')
+            if dim is None:
+                dim = len(rest.split(' '))
+            if word.lower() in w2i:
+                line_rows.append(-1)
+                continue
+            line_rows.append(w2i.setdefault(word, len(w2i)))
+
+    w2i_path, matrix_path = store_paths(file_name)
+    matrix = np.lib.format.open_memmap(matrix_path + '.tmp', mode='w+', dtype=np.float32, shape=(len(w2i), dim))
+    with io.open(file_name, 'r', encoding='utf-8', newline='\n') as inf:
+        for idx, line in enumerate(inf):
+            row = line_rows[idx]
+            if row >= 0:
+                matrix[row] = np.array(line.strip().split(' ')[1:], dtype=np.float32)
+    matrix.flush()
+    del matrix
+    with open(w2i_path + '.tmp', 'w') as outf:
+        json.dump(w2i, outf)
+    os.rename(matrix_path + '.tmp', matrix_path)
+    os.rename(w2i_path + '.tmp', w2i_path)
+    return w2i_path, matrix_path
+
+
+class GloveStore(object):
+    """Read-only word embedding backed by a memory-mapped matrix
+
+    Behaves like the {word: vector} dict load_word_emb used to return
+    (get, in, iteration), and also exposes integer lookups: index(word)
+    gives the row of a word, or -1 when it is unknown.
+    """
+
+    def __init__(self, w2i, matrix):
+        self.w2i = w2i
+        self.matrix = matrix
+        self.N_word = matrix.shape[1]
+
+    @classmethod
+    def load(cls, file_name, use_small=False):
+        w2i_path, matrix_path = store_paths(file_name)
+        with open(w2i_path) as inf:
+            w2i = json.load(inf)
+        if use_small:
+            w2i = dict((w, idx) for w, idx in w2i.items() if idx < SMALL_SIZE)
+        return cls(w2i, np.load(matrix_path, mmap_mode='r'))
+
+    def index(self, word):
+        return self.w2i.get(word, -1)
+
+    def get(self, word, default=None):
+        idx = self.w2i.get(word)
+        if idx is None:
+            return default
+        return np.asarray(self.matrix[idx])
+
+    def __getitem__(self, word):
+        return np.asarray(self.matrix[self.w2i[word]])
+
+    def __contains__(self, word):
+        return word in self.w2i
+
+    def __iter__(self):
+        return iter(self.w2i)
+
+    def __len__(self):
+        return len(self.w2i)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: python scripts/glove_store.py [glove text file, e.g. glove/glove.42B.300d.txt]')
+        sys.exit(1)
+    print('Converted to %s and %s' % convert_glove(sys.argv[1]))
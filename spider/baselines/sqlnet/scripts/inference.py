@@ -0,0 +1,75 @@
+"""
+Batched SQLNet inference: the model, tables.json and the word embedding are
+loaded once, then every batch of (question, db_id) requests goes through one
+forward pass and gen_sql. Works on CPU-only hosts (gpu=False), including with
+dumps that were saved from a GPU run.
+"""
+import json
+import torch
+from scripts.utils import load_word_emb, process
+from scripts.model.sqlnet import SQLNet
+
+TEST_ENTRY = (True, True, True)  # (AGG, SEL, COND)
+PREDICTORS = ('sel', 'cond', 'group', 'order')
+
+
+def load_saved_models(model, model_dir='saved_models', gpu=True):
+    """Load the sel/cond/group/order dumps written by train.py into model"""
+    # storages saved on a GPU are mapped to the CPU when there is none
+    map_location = None if gpu else (lambda storage, loc: storage)
+    for name in PREDICTORS:
+        print('Loading from %s model...' % name)
+        getattr(model, name + '_pred').load_state_dict(
+                torch.load('%s/%s_models.dump' % (model_dir, name), map_location=map_location))
+
+
+def question_tokens(request):
+    """Question tokens of a request, tokenized like the Spider question_toks when not given"""
+    if request.get('question_toks'):
+        return request['question_toks']
+    from nltk import word_tokenize
+    return word_tokenize(request['question'])
+
+
+class SQLNetPredictor(object):
+    """Turns lists of {'question': ..., 'db_id': ...} requests into SQL strings"""
+
+    def __init__(self, table_path, glove_path, model_dir='saved_models', gpu=False, N_word=300,
+            train_emb=False, load_models=True):
+        with open(table_path) as inf:
+            table_data = json.load(inf)
+        self.schemas = dict((tab['db_id'], tab) for tab in table_data)
+        self.tables = process([], table_data)[1]
+        word_emb = load_word_emb(glove_path, load_used=train_emb)
+        self.model = SQLNet(word_emb, N_word=N_word, gpu=gpu, trainable_emb=train_emb)
+        if load_models:
+            load_saved_models(self.model, model_dir, gpu)
+        self.model.eval()
+
+    def __contains__(self, db_id):
+        return db_id in self.tables
+
+    def to_batch(self, requests):
+        """Model inputs of a batch, as to_batch_seq builds them from the dataset"""
+        q_seq = []
+        col_seq = []
+        col_num = []
+        col_org_seq = []
+        schema_seq = []
+        for request in requests:
+            table = self.tables[request['db_id']]
+            schema = self.schemas[request['db_id']]
+            q_seq.append(question_tokens(request))
+            col_seq.append(table['col_toks'])
+            col_num.append(len(table['col_map']))
+            col_org_seq.append(schema['column_names_original'])
+            schema_seq.append(schema)
+        return q_seq, col_seq, col_num, col_org_seq, schema_seq
+
+    def predict(self, requests):
+        """Predicted SQL of every request, in order"""
+        if not requests:
+            return []
+        q_seq, col_seq, col_num, col_org_seq, schema_seq = self.to_batch(requests)
+        score = self.model.forward(q_seq, col_seq, col_num, TEST_ENTRY)
+        return self.model.gen_sql(score, col_org_seq, schema_seq)
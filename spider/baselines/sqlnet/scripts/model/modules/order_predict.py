@@ -81,7 +81,7 @@ class OrderPredictor(nn.Module):
         q_weighted = (q_enc.unsqueeze(1) * att_prob_qc.unsqueeze(3)).sum(2)
         # Compute prediction scores
         # self.col_out.squeeze(): (B, max_col_len)
-        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze()
+        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze(2)
         for idx, num in enumerate(col_len):
             if num < max_col_len:
                 col_score[idx, num:] = -100
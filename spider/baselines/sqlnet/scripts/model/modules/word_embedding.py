@@ -4,6 +4,29 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
 import numpy as np
+from scripts.glove_store import GloveStore
+
+
+def seq_positions(lens, offset=0):
+    """(row, col) of every element of a batch of sequences with the given lengths
+
+    Elements are in batch order, so a flat array of per-element values can be
+    written into a padded (B, max_len, ...) array with one assignment.
+    """
+    lens = np.asarray(lens, dtype=np.int64)
+    rows = np.repeat(np.arange(len(lens)), lens)
+    starts = np.cumsum(lens) - lens
+    cols = np.arange(lens.sum()) - np.repeat(starts, lens) + offset
+    return rows, cols
+
+
+def gather_rows(table, ids):
+    """Rows of table for ids, zeros where the id is -1 (unknown word)"""
+    if len(table) == 0:
+        return np.zeros((len(ids), table.shape[1]), dtype=table.dtype)
+    vals = np.take(table, np.maximum(ids, 0), axis=0)
+    vals[ids < 0] = 0
+    return vals
 
 
 class WordEmbedding(nn.Module):
@@ -25,102 +48,122 @@ class WordEmbedding(nn.Module):
             # else use word2vec or glove
             self.word_emb = word_emb
             print "Using fixed embedding for words but trainable embedding for types"
+            if isinstance(word_emb, GloveStore):
+                # memory-mapped store: words are looked up by row index
+                self.emb_w2i, self.emb_matrix = word_emb.w2i, word_emb.matrix
+            else:
+                self.emb_w2i, self.emb_matrix = None, None
+
+
+    def lookup(self, words):
+        """Row ids of words in an embedding table and that table, -1 marks unknown words
+
+        A GloveStore is indexed directly; with a plain dict only the words of
+        the batch are copied into a small table.
+        """
+        if self.emb_matrix is not None:
+            w2i = self.emb_w2i
+            return np.array([w2i.get(w, -1) for w in words], dtype=np.int64), self.emb_matrix
+        rows = {}
+        ids = np.array([rows.setdefault(w, len(rows)) if w in self.word_emb else -1 for w in words],
+                dtype=np.int64)
+        if not rows:
+            return ids, np.zeros((0, self.N_word), dtype=np.float32)
+        table = np.array([self.word_emb[w] for w, _ in sorted(rows.items(), key=lambda x: x[1])])
+        return ids, table
+
+
+    def word_vecs(self, words):
+        """Fixed embeddings of a flat list of words, zeros for unknown ones"""
+        ids, table = self.lookup(words)
+        return gather_rows(table, ids)
+
+
+    def word_list_vecs(self, word_lists):
+        """Mean fixed embedding of each (non-empty) list of words"""
+        lens = np.array([len(ws) for ws in word_lists], dtype=np.int64)
+        if (lens == 0).any():
+            raise Exception("word list should not be empty!")
+        vecs = self.word_vecs([w for ws in word_lists for w in ws])
+        starts = np.cumsum(lens) - lens
+        sums = np.zeros((len(lens), vecs.shape[1]), dtype=vecs.dtype)
+        # add the k-th word of every list at once, summing in word order like sum(emb_list)
+        for k in range(lens.max() if len(lens) else 0):
+            has_k = lens > k
+            sums[has_k] += vecs[starts[has_k] + k]
+        return sums / lens.astype(sums.dtype)[:, None]
+
+
+    def word_vec(self, word):
+        """Fixed embedding of a word, zeros when it is unknown"""
+        return self.word_vecs([word])[0]
+
+
+    def to_tok_var(self, val_tok_array):
+        val_tok = torch.from_numpy(val_tok_array)
+        if self.gpu:
+            val_tok = val_tok.cuda()
+        val_tok_var = Variable(val_tok)
+        return self.embedding(val_tok_var)
+
+
+    def to_emb_var(self, val_emb_array):
+        val_inp = torch.from_numpy(val_emb_array)
+        if self.gpu:
+            val_inp = val_inp.cuda()
+        return Variable(val_inp)
 
 
     def gen_xc_type_batch(self, xc_type, is_col=False, is_list=False):
         B = len(xc_type)
-        val_embs = []
-        val_len = np.zeros(B, dtype=np.int64)
-        for i, one_q in enumerate(xc_type):
-            if is_list:
-                q_val = map(lambda x:self.w2i.get(" ".join(sorted(x)), 0), one_q)
-            else:
-                q_val = map(lambda x:self.w2i.get(x, 0), one_q)
-            if is_col:
-                val_embs.append(q_val)  #<BEG> and <END>
-                val_len[i] = len(q_val)
-            else:
-                val_embs.append([1] + q_val + [2])  #<BEG> and <END>
-                val_len[i] = 1 + len(q_val) + 1
+        offset = 0 if is_col else 1     # <BEG> and <END> around questions
+        if is_list:
+            toks = [" ".join(sorted(x)) for one_q in xc_type for x in one_q]
+        else:
+            toks = [x for one_q in xc_type for x in one_q]
+        q_len = np.array([len(one_q) for one_q in xc_type], dtype=np.int64)
+        val_len = q_len + 2 * offset
         max_len = max(val_len)
         val_tok_array = np.zeros((B, max_len), dtype=np.int64)
-        for i in range(B):
-            for t in range(len(val_embs[i])):
-                val_tok_array[i,t] = val_embs[i][t]
-        val_tok = torch.from_numpy(val_tok_array)
-        if self.gpu:
-            val_tok = val_tok.cuda()
-        val_tok_var = Variable(val_tok)
-        val_inp_var = self.embedding(val_tok_var)
+        if offset:
+            val_tok_array[:, 0] = 1
+            val_tok_array[np.arange(B), val_len - 1] = 2
+        rows, cols = seq_positions(q_len, offset)
+        val_tok_array[rows, cols] = [self.w2i.get(x, 0) for x in toks]
 
-        return val_inp_var, val_len
+        return self.to_tok_var(val_tok_array), val_len
 
 
     def gen_x_batch(self, q, col, is_list=False, is_q=False):
         B = len(q)
-        val_embs = []
-        val_len = np.zeros(B, dtype=np.int64)
-        for i, (one_q, one_col) in enumerate(zip(q, col)):
-            if self.trainable:
-                # q_val is only the indexes of words
-                q_val = map(lambda x:self.w2i.get(x, 0), one_q)
-            elif not is_list:
-                q_val = map(lambda x:self.word_emb.get(x, np.zeros(self.N_word, dtype=np.float32)), one_q)
-            else:
-                q_val = []
-                for ws in one_q:
-                    emb_list = []
-                    ws_len = len(ws)
-                    for w in ws:
-                        emb_list.append(self.word_emb.get(w, np.zeros(self.N_word, dtype=np.float32)))
-                    if ws_len == 0:
-                        raise Exception("word list should not be empty!")
-                    elif ws_len == 1:
-                        q_val.append(emb_list[0])
-                    else:
-                        q_val.append(sum(emb_list) / float(ws_len))
-
-            if self.trainable:
-                val_embs.append([1] + q_val + [2])  #<BEG> and <END>
-                val_len[i] = 1 + len(q_val) + 1
-            elif not is_list or is_q:
-                val_embs.append([np.zeros(self.N_word, dtype=np.float32)] + q_val + [np.zeros(self.N_word, dtype=np.float32)])  #<BEG> and <END>
-                val_len[i] = 1 + len(q_val) + 1
-            else:
-                val_embs.append(q_val)
-                val_len[i] = len(q_val)
+        # <BEG> and <END> around the sequence: token 1/2 when trainable, zero vectors otherwise
+        offset = 1 if self.trainable or not is_list or is_q else 0
+        q_len = np.array([len(one_q) for one_q in q], dtype=np.int64)
+        val_len = q_len + 2 * offset
         max_len = max(val_len)
+        rows, cols = seq_positions(q_len, offset)
 
         if self.trainable:
+            # q_val is only the indexes of words
             val_tok_array = np.zeros((B, max_len), dtype=np.int64)
-            for i in range(B):
-                for t in range(len(val_embs[i])):
-                    val_tok_array[i,t] = val_embs[i][t]
-            val_tok = torch.from_numpy(val_tok_array)
-            if self.gpu:
-                val_tok = val_tok.cuda()
-            val_tok_var = Variable(val_tok)
-            val_inp_var = self.embedding(val_tok_var)
+            val_tok_array[:, 0] = 1
+            val_tok_array[np.arange(B), val_len - 1] = 2
+            val_tok_array[rows, cols] = [self.w2i.get(x, 0) for one_q in q for x in one_q]
+            val_inp_var = self.to_tok_var(val_tok_array)
         else:
+            if is_list:
+                vals = self.word_list_vecs([ws for one_q in q for ws in one_q])
+            else:
+                vals = self.word_vecs([x for one_q in q for x in one_q])
             val_emb_array = np.zeros((B, max_len, self.N_word), dtype=np.float32)
-            for i in range(B):
-                for t in range(len(val_embs[i])):
-                    val_emb_array[i,t,:] = val_embs[i][t]
-            val_inp = torch.from_numpy(val_emb_array)
-            if self.gpu:
-                val_inp = val_inp.cuda()
-            val_inp_var = Variable(val_inp)
+            val_emb_array[rows, cols] = vals
+            val_inp_var = self.to_emb_var(val_emb_array)
         return val_inp_var, val_len
 
 
     def gen_col_batch(self, cols):
-        ret = []
-        col_len = np.zeros(len(cols), dtype=np.int64)
-
-        names = []
-        for b, one_cols in enumerate(cols):
-            names = names + one_cols
-            col_len[b] = len(one_cols)
+        col_len = np.array([len(one_cols) for one_cols in cols], dtype=np.int64)
+        names = [name for one_cols in cols for name in one_cols]
         #TODO: what is the diff bw name_len and col_len?
         name_inp_var, name_len = self.str_list_to_batch(names)
         return name_inp_var, name_len, col_len
@@ -128,62 +171,32 @@ class WordEmbedding(nn.Module):
 
     def gen_agg_batch(self, q):
         B = len(q)
-        ret = []
         agg_ops = ['none', 'maximum', 'minimum', 'count', 'total', 'average']
-        for b in range(B):
-            if self.trainable:
-                ct_val = map(lambda x:self.w2i.get(x, 0), agg_ops)
-            else:
-                ct_val = map(lambda x:self.word_emb.get(x, np.zeros(self.N_word, dtype=np.float32)), agg_ops)
-            ret.append(ct_val)
-
+        if self.trainable:
+            agg_val = np.array([self.w2i.get(x, 0) for x in agg_ops], dtype=np.float32)[:, None]
+        else:
+            agg_val = self.word_vecs(agg_ops)
         agg_emb_array = np.zeros((B, 6, self.N_word), dtype=np.float32)
-        for i in range(B):
-            for t in range(len(ret[i])):
-                agg_emb_array[i,t,:] = ret[i][t]
-        agg_inp = torch.from_numpy(agg_emb_array)
-        if self.gpu:
-            agg_inp = agg_inp.cuda()
-        agg_inp_var = Variable(agg_inp)
+        agg_emb_array[:] = agg_val
 
-        return agg_inp_var
+        return self.to_emb_var(agg_emb_array)
 
 
     def str_list_to_batch(self, str_list):
         """get a list var of wemb of words in each column name in current bactch"""
         B = len(str_list)
-
-        val_embs = []
-        val_len = np.zeros(B, dtype=np.int64)
-        for i, one_str in enumerate(str_list):
-            if self.trainable:
-                val = [self.w2i.get(x, 0) for x in one_str]
-            else:
-                val = [self.word_emb.get(x, np.zeros(
-                    self.N_word, dtype=np.float32)) for x in one_str]
-            val_embs.append(val)
-            val_len[i] = len(val)
+        val_len = np.array([len(one_str) for one_str in str_list], dtype=np.int64)
         max_len = max(val_len)
+        rows, cols = seq_positions(val_len)
+        words = [x for one_str in str_list for x in one_str]
 
         if self.trainable:
             val_tok_array = np.zeros((B, max_len), dtype=np.int64)
-            for i in range(B):
-                for t in range(len(val_embs[i])):
-                    val_tok_array[i,t] = val_embs[i][t]
-            val_tok = torch.from_numpy(val_tok_array)
-            if self.gpu:
-                val_tok = val_tok.cuda()
-            val_tok_var = Variable(val_tok)
-            val_inp_var = self.embedding(val_tok_var)
+            val_tok_array[rows, cols] = [self.w2i.get(x, 0) for x in words]
+            val_inp_var = self.to_tok_var(val_tok_array)
         else:
-            val_emb_array = np.zeros(
-                    (B, max_len, self.N_word), dtype=np.float32)
-            for i in range(B):
-                for t in range(len(val_embs[i])):
-                    val_emb_array[i,t,:] = val_embs[i][t]
-            val_inp = torch.from_numpy(val_emb_array)
-            if self.gpu:
-                val_inp = val_inp.cuda()
-            val_inp_var = Variable(val_inp)
+            val_emb_array = np.zeros((B, max_len, self.N_word), dtype=np.float32)
+            val_emb_array[rows, cols] = self.word_vecs(words)
+            val_inp_var = self.to_emb_var(val_emb_array)
 
         return val_inp_var, val_len
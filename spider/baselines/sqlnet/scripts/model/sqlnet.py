@@ -11,6 +11,7 @@ from modules.sel_predict import SelPredictor
 from modules.cond_predict import CondPredictor
 from modules.group_predict import GroupPredictor
 from modules.order_predict import OrderPredictor
+from modules.join_paths import JoinPaths
 
 
 AGG_OPS = ['none', 'max', 'min', 'count', 'sum', 'avg']
@@ -51,6 +52,8 @@ class SQLNet(nn.Module):
         self.log_softmax = nn.LogSoftmax()
         self.bce_logit = nn.BCEWithLogitsLoss()
         self.sigm = nn.Sigmoid()
+        # foreign key graph and join paths per db_id, shared by every batch
+        self.join_path_cache = {}
         if gpu:
             self.cuda()
 
@@ -515,58 +518,88 @@ class SQLNet(nn.Module):
         return np.array((sel_err, cond_err, gby_err, ody_err)), tot_err
 
 
-    def gen_query(self, score, q, col, raw_q, raw_col, pred_entry, verbose=False):
-        pred_agg, pred_sel, pred_cond = pred_entry
+    def decode_scores(self, score):
+        """Argmax and descending-score column orders of the whole batch
 
+        One numpy call per score tensor instead of one per example; gen_query
+        and gen_sql only take the top-k of these rows and assemble strings per
+        example.
+        """
         sel_score, cond_score, group_score, order_score = score
 
-        sel_num_score, sel_col_score, agg_num_score, agg_op_score = [x.data.cpu().numpy() if x is not None else None for x in sel_score]
-        cond_num_score, cond_col_score, cond_op_score = [x.data.cpu().numpy() if x is not None else None for x in cond_score]
-        gby_num_score, gby_score, hv_score, hv_col_score, hv_agg_score, hv_op_score = [x.data.cpu().numpy() if x is not None else None for x in group_score]
-        ody_num_score, ody_col_score, ody_agg_score, ody_par_score = [x.data.cpu().numpy() if x is not None else None for x in order_score]
+        sel_num_score, sel_col_score, agg_num_score, agg_op_score = [x.data.cpu().numpy() for x in sel_score]
+        cond_num_score, cond_col_score, cond_op_score = [x.data.cpu().numpy() for x in cond_score]
+        gby_num_score, gby_score, hv_score, hv_col_score, hv_agg_score, hv_op_score = [x.data.cpu().numpy() for x in group_score]
+        ody_num_score, ody_col_score, ody_agg_score, ody_par_score = [x.data.cpu().numpy() for x in order_score]
+
+        return {
+            'sel_num': np.argmax(sel_num_score, axis=1) + 1,
+            'sel': np.argsort(-sel_col_score, axis=1),
+            'agg_num': np.argmax(agg_num_score, axis=2),
+            'agg': np.argsort(-agg_op_score, axis=2),
+            'cond_num': np.argmax(cond_num_score, axis=1),
+            'cond': np.argsort(-cond_col_score, axis=1),
+            'cond_op': np.argmax(cond_op_score, axis=2),
+            'gby_num': np.argmax(gby_num_score, axis=1),
+            'group': np.argsort(-gby_score, axis=1),
+            'hv': np.argmax(hv_score, axis=1),
+            'hv_col': np.argmax(hv_col_score, axis=1),
+            'hv_agg': np.argmax(hv_agg_score, axis=1),
+            'hv_op': np.argmax(hv_op_score, axis=1),
+            'ody_num': np.argmax(ody_num_score, axis=1),
+            'order': np.argsort(-ody_col_score, axis=1),
+            'ody_agg': np.argmax(ody_agg_score, axis=1),
+            'parity': np.argmax(ody_par_score, axis=1),
+        }
+
+
+    def gen_query(self, score, q, col, raw_q, raw_col, pred_entry, verbose=False):
+        pred_agg, pred_sel, pred_cond = pred_entry
+
+        dec = self.decode_scores(score)
 
         ret_queries = []
-        B = len(sel_num_score)
+        B = len(dec['sel_num'])
         for b in range(B):
             cur_query = {}
             # ------------get sel predict
-            sel_num_cols = np.argmax(sel_num_score[b]) + 1
+            sel_num_cols = dec['sel_num'][b]
             cur_query['sel_num'] = sel_num_cols
-            cur_query['sel'] = np.argsort(-sel_col_score[b])[:sel_num_cols]
+            cur_query['sel'] = dec['sel'][b][:sel_num_cols]
 
             agg_nums = []
             agg_preds = []
             for idx in range(sel_num_cols):
-                curr_num_aggs = np.argmax(agg_num_score[b][idx])
+                curr_num_aggs = dec['agg_num'][b][idx]
                 agg_nums.append(curr_num_aggs)
                 if curr_num_aggs == 0:
                     curr_agg_ops = [0]
                 else:
-                    curr_agg_ops = [x for x in list(np.argsort(-agg_op_score[b][idx])) if x != 0][:curr_num_aggs]
+                    curr_agg_ops = [x for x in dec['agg'][b][idx] if x != 0][:curr_num_aggs]
                 agg_preds += curr_agg_ops
             cur_query['agg_num'] = agg_nums
             cur_query['agg'] = agg_preds
             #----------get group by predict
-            gby_num_cols = np.argmax(gby_num_score[b])
+            gby_num_cols = dec['gby_num'][b]
             cur_query['gby_num'] = gby_num_cols
-            cur_query['group'] = np.argsort(-gby_score[b])[:gby_num_cols]
-            cur_query['hv'] = np.argmax(hv_score[b])
+            cur_query['group'] = dec['group'][b][:gby_num_cols]
+            cur_query['hv'] = dec['hv'][b]
             if gby_num_cols != 0 and cur_query['hv'] != 0:
-                cur_query['hv_agg'] = np.argmax(hv_agg_score[b])
-                cur_query['hv_col'] = np.argmax(hv_col_score[b])
-                cur_query['hv_op'] = np.argmax(hv_op_score[b])
+                cur_query['hv_agg'] = dec['hv_agg'][b]
+                cur_query['hv_col'] = dec['hv_col'][b]
+                cur_query['hv_op'] = dec['hv_op'][b]
             else:
                 cur_query['hv'] = 0
                 cur_query['hv_agg'] = 0
                 cur_query['hv_col'] = -1
                 cur_query['hv_op'] = -1
             # --------get order by
-            ody_num_cols = np.argmax(ody_num_score[b])
+            ody_num_cols = dec['ody_num'][b]
             cur_query['ody_num'] = ody_num_cols
-            cur_query['order'] = np.argsort(-ody_col_score[b])[:ody_num_cols]
+            cur_query['order'] = dec['order'][b][:ody_num_cols]
             if ody_num_cols != 0:
-                cur_query['ody_agg'] = np.argmax(ody_agg_score[b])
-                cur_query['parity'] = np.argmax(ody_par_score[b])
+                cur_query['ody_agg'] = dec['ody_agg'][b]
+                cur_query['parity'] = dec['parity'][b]
             else:
                 cur_query['ody_agg'] = 0
                 cur_query['parity'] = -1
@@ -581,30 +614,24 @@ class SQLNet(nn.Module):
             #---------get cond predict
             #cond_num_score, cond_col_score, cond_op_score = [x.data.cpu().numpy() if x is not None else None for x in cond_score]
             cur_query['conds'] = []
-            cond_num = np.argmax(cond_num_score[b])
-            max_idxes = np.argsort(-cond_col_score[b])[:cond_num]
+            cond_num = dec['cond_num'][b]
+            max_idxes = dec['cond'][b][:cond_num]
             for idx in range(cond_num):
                 cur_cond = []
                 cur_cond.append(max_idxes[idx])
-                cur_cond.append(np.argmax(cond_op_score[b][idx]))
+                cur_cond.append(dec['cond_op'][b][idx])
                 cur_query['conds'].append(cur_cond)
             ret_queries.append(cur_query)
 
         return ret_queries
 
 
-    def find_shortest_path(self, start, end, graph):
-        stack = [[start, []]]
-        visited = set()
-        while len(stack) > 0:
-            ele, history = stack.pop()
-            if ele == end:
-                return history
-            for node in graph[ele]:
-                if node[0] not in visited:
-                    stack.append((node[0], history + [(node[0], node[1])]))
-                    visited.add(node[0])
-        #print("Could not find a path between table {} and table {}".format(start, end))
+    def join_paths(self, schema):
+        """JoinPaths of a database, built on first use"""
+        paths = self.join_path_cache.get(schema["db_id"])
+        if paths is None:
+            paths = self.join_path_cache[schema["db_id"]] = JoinPaths(schema)
+        return paths
 
 
     def gen_from(self, candidate_tables, schema):
@@ -621,12 +648,7 @@ class SQLNet(nn.Module):
         for t in candidate_tables:
             uf_dict[t] = -1
         idx = 1
-        graph = defaultdict(list)
-        for acol, bcol in schema["foreign_keys"]:
-            t1 = schema["column_names"][acol][0]
-            t2 = schema["column_names"][bcol][0]
-            graph[t1].append((t2, (acol, bcol)))
-            graph[t2].append((t1, (bcol, acol)))
+        join_paths = self.join_paths(schema)
         candidate_tables = list(candidate_tables)
         start = candidate_tables[0]
         table_alias_dict[start] = idx
@@ -636,7 +658,7 @@ class SQLNet(nn.Module):
             for end in candidate_tables[1:]:
                 if end in table_alias_dict:
                     continue
-                path = self.find_shortest_path(start, end, graph)
+                path = join_paths.path(start, end)
                 prev_table = start
                 if not path:
                     table_alias_dict[end] = idx
@@ -668,16 +690,12 @@ class SQLNet(nn.Module):
 
     def gen_sql(self, score, col_org, schema_seq):
 
-        sel_score, cond_score, group_score, order_score = score
-
-        sel_num_score, sel_col_score, agg_num_score, agg_op_score = [x.data.cpu().numpy() if x is not None else None for x in sel_score]
-        cond_num_score, cond_col_score, cond_op_score = [x.data.cpu().numpy() if x is not None else None for x in cond_score]
-        gby_num_score, gby_score, hv_score, hv_col_score, hv_agg_score, hv_op_score = [x.data.cpu().numpy() if x is not None else None for x in group_score]
-        ody_num_score, ody_col_score, ody_agg_score, ody_par_score = [x.data.cpu().numpy() if x is not None else None for x in order_score]
+        # python lists index faster than numpy arrays in the per-example string assembly below
+        dec = dict((key, val.tolist()) for key, val in self.decode_scores(score).items())
 
         ret_queries = []
         ret_sqls = []
-        B = len(sel_num_score)
+        B = len(dec['sel_num'])
 
         for b in range(B):
             cur_cols = col_org[b]
@@ -692,20 +710,20 @@ class SQLNet(nn.Module):
             cur_tables = defaultdict(list)
 
             # ------------get sel predict
-            sel_num_cols = np.argmax(sel_num_score[b]) + 1
+            sel_num_cols = dec['sel_num'][b]
             cur_query['sel_num'] = sel_num_cols
-            cur_query['sel'] = np.argsort(-sel_col_score[b])[:sel_num_cols]
+            cur_query['sel'] = dec['sel'][b][:sel_num_cols]
 
             agg_nums = []
             agg_preds = []
             agg_preds_gen = []
             for idx in range(sel_num_cols):
-                curr_num_aggs = np.argmax(agg_num_score[b][idx])
+                curr_num_aggs = dec['agg_num'][b][idx]
                 agg_nums.append(curr_num_aggs)
                 if curr_num_aggs == 0:
                     curr_agg_ops = [0]
                 else:
-                    curr_agg_ops = [x for x in list(np.argsort(-agg_op_score[b][idx])) if x != 0][:curr_num_aggs]
+                    curr_agg_ops = [x for x in dec['agg'][b][idx] if x != 0][:curr_num_aggs]
                 agg_preds += curr_agg_ops
                 agg_preds_gen.append(curr_agg_ops)
             cur_query['agg_num'] = agg_nums
@@ -735,14 +753,14 @@ class SQLNet(nn.Module):
 
 
             #----------get group by predict
-            gby_num_cols = np.argmax(gby_num_score[b])
+            gby_num_cols = dec['gby_num'][b]
             cur_query['gby_num'] = gby_num_cols
-            cur_query['group'] = np.argsort(-gby_score[b])[:gby_num_cols]
-            cur_query['hv'] = np.argmax(hv_score[b])
+            cur_query['group'] = dec['group'][b][:gby_num_cols]
+            cur_query['hv'] = dec['hv'][b]
             if gby_num_cols != 0 and cur_query['hv'] != 0:
-                cur_query['hv_agg'] = np.argmax(hv_agg_score[b])
-                cur_query['hv_col'] = np.argmax(hv_col_score[b])
-                cur_query['hv_op'] = np.argmax(hv_op_score[b])
+                cur_query['hv_agg'] = dec['hv_agg'][b]
+                cur_query['hv_col'] = dec['hv_col'][b]
+                cur_query['hv_op'] = dec['hv_op'][b]
             else:
                 cur_query['hv'] = 0
                 cur_query['hv_agg'] = 0
@@ -771,12 +789,12 @@ class SQLNet(nn.Module):
                     cur_group.append(VALUE)
 
             # --------get order by
-            ody_num_cols = np.argmax(ody_num_score[b])
+            ody_num_cols = dec['ody_num'][b]
             cur_query['ody_num'] = ody_num_cols
-            cur_query['order'] = np.argsort(-ody_col_score[b])[:ody_num_cols]
+            cur_query['order'] = dec['order'][b][:ody_num_cols]
             if ody_num_cols != 0:
-                cur_query['ody_agg'] = np.argmax(ody_agg_score[b])
-                cur_query['parity'] = np.argmax(ody_par_score[b])
+                cur_query['ody_agg'] = dec['ody_agg'][b]
+                cur_query['parity'] = dec['parity'][b]
             else:
                 cur_query['ody_agg'] = 0
                 cur_query['parity'] = -1
@@ -807,12 +825,12 @@ class SQLNet(nn.Module):
             #---------get cond predict
             #cond_num_score, cond_col_score, cond_op_score = [x.data.cpu().numpy() if x is not None else None for x in cond_score]
             cur_query['conds'] = []
-            cond_num = np.argmax(cond_num_score[b])
-            max_idxes = np.argsort(-cond_col_score[b])[:cond_num]
+            cond_num = dec['cond_num'][b]
+            max_idxes = dec['cond'][b][:cond_num]
             for idx in range(cond_num):
                 cur_cond = []
                 cur_cond.append(max_idxes[idx])
-                cur_cond.append(np.argmax(cond_op_score[b][idx]))
+                cur_cond.append(dec['cond_op'][b][idx])
                 cur_query['conds'].append(cur_cond)
             ret_queries.append(cur_query)
 
@@ -0,0 +1,80 @@
+"""
+Background batch assembly for epoch_train
+
+to_batch_seq is pure python work done between two optimizer steps, so the
+model used to sit idle while every batch was put together. BatchPrefetcher
+builds the next `depth` batches on a thread while the current one trains
+(torch releases the GIL inside its kernels and in backward) and keeps track of
+how long the training loop still had to wait for data.
+"""
+import sys
+import time
+import threading
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+_DONE = object()
+
+
+class BatchPrefetcher(object):
+    """Iterates over (st, ed, make_batch(st, ed)) for consecutive batches of [0, n)
+
+    With depth 0 the batches are built inline, as before. wait_time is the
+    time the consumer spent waiting for batches (building them, with depth 0).
+    """
+
+    def __init__(self, make_batch, n, batch_size, depth=2):
+        self.make_batch = make_batch
+        self.bounds = [(st, min(st + batch_size, n)) for st in range(0, n, batch_size)]
+        self.depth = depth
+        self.wait_time = 0.0
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for st, ed in self.bounds:
+                start = time.time()
+                batch = self.make_batch(st, ed)
+                self.wait_time += time.time() - start
+                yield st, ed, batch
+            return
+
+        queue = Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(item):
+            # give up when the consumer is gone, instead of blocking on a full queue forever
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def work():
+            try:
+                for st, ed in self.bounds:
+                    if not put((st, ed, self.make_batch(st, ed))):
+                        return
+            except Exception:
+                put((_DONE, sys.exc_info()[1], None))
+                return
+            put((_DONE, None, None))
+
+        worker = threading.Thread(target=work)
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                start = time.time()
+                st, ed, batch = queue.get()
+                self.wait_time += time.time() - start
+                if st is _DONE:
+                    if ed is not None:
+                        raise ed
+                    return
+                yield st, ed, batch
+        finally:
+            stop.set()
@@ -1,8 +1,13 @@
 import re
 import io
 import json
+import time
 import numpy as np
 import os
+from scripts.glove_store import GloveStore, has_store
+from scripts.data_cache import cache_path, load_cached, take, write_cache
+from scripts.prefetch import BatchPrefetcher
+from scripts.bucketing import bucket_perm, example_sizes, padding_ratio
 #from lib.dbengine import DBEngine
 
 def lower_keys(x):
@@ -19,15 +24,23 @@ def get_main_table_name(file_path):
         return prefix_pattern.search(file_path).group(2)
     return None
 
-def load_data_new(sql_path, table_data, use_small=False):
+def load_data_new(sql_path, table_data, use_small=False, table_path=None):
     sql_data = []
 
-    print "Loading data from %s"%sql_path
-    with open(sql_path) as inf:
-        data = lower_keys(json.load(inf))
-        sql_data += data
+    # with table_path, the process() output is cached next to sql_path (see scripts/data_cache.py)
+    sql_data_new = load_cached(sql_path, table_path, table_data) if table_path else None
+    if sql_data_new is not None:
+        print "Loading data from %s"%cache_path(sql_path)
+        table_data_new = process([], table_data)[1]
+    else:
+        print "Loading data from %s"%sql_path
+        with open(sql_path) as inf:
+            data = lower_keys(json.load(inf))
+            sql_data += data
 
-    sql_data_new, table_data_new = process(sql_data, table_data)  # comment out if not on full dataset
+        sql_data_new, table_data_new = process(sql_data, table_data)  # comment out if not on full dataset
+        if table_path:
+            write_cache(sql_path, table_path, sql_data_new, table_data)
 
     schemas = {}
     for tab in table_data:
@@ -49,9 +62,9 @@ def load_dataset(dataset_dir, use_small=False):
     with open(TABLE_PATH) as inf:
         print "Loading data from %s"%TABLE_PATH
         table_data= json.load(inf)
-    train_sql_data, train_table_data, schemas_all = load_data_new(TRAIN_PATH, table_data, use_small=use_small)
-    val_sql_data, val_table_data, schemas = load_data_new(DEV_PATH, table_data, use_small=use_small)
-    test_sql_data, test_table_data, schemas = load_data_new(TEST_PATH, table_data, use_small=use_small)
+    train_sql_data, train_table_data, schemas_all = load_data_new(TRAIN_PATH, table_data, use_small=use_small, table_path=TABLE_PATH)
+    val_sql_data, val_table_data, schemas = load_data_new(DEV_PATH, table_data, use_small=use_small, table_path=TABLE_PATH)
+    test_sql_data, test_table_data, schemas = load_data_new(TEST_PATH, table_data, use_small=use_small, table_path=TABLE_PATH)
 
     TRAIN_DB = '../alt/data/train.db'
     DEV_DB = '../alt/data/dev.db'
@@ -73,15 +86,14 @@ def to_batch_seq(sql_data, table_data, idxes, st, ed, schemas, ret_vis_data=Fals
     col_org_seq = []
     schema_seq = []
 
-    for i in range(st, ed):
-        sql = sql_data[idxes[i]]
+    for sql in take(sql_data, idxes[st:ed]):
         col_org_seq.append(sql['col_org'])
         q_seq.append(sql['question_tok'])
         table = table_data[sql['table_id']]
         schema_seq.append(schemas[sql['table_id']])
         col_num.append(len(table['col_map']))
-        tab_cols = [col[1] for col in table['col_map']]
-        col_seq.append([x.split(" ") for x in tab_cols])
+        tab_cols = table['col_names']
+        col_seq.append(table['col_toks'])
         ans_seq.append((sql['agg'],     # sel agg # 0
             sql['sel'],                 # sel col # 1
             len(sql['cond']),           # cond # 2
@@ -113,22 +125,26 @@ def to_batch_seq(sql_data, table_data, idxes, st, ed, schemas, ret_vis_data=Fals
 def to_batch_query(sql_data, idxes, st, ed):
     query_gt = []
     table_ids = []
-    for i in range(st, ed):
-        query_gt.append(sql_data[idxes[i]])
-        table_ids.append(sql_data[idxes[i]]['table_id'])
+    for sql in take(sql_data, idxes[st:ed]):
+        query_gt.append(sql)
+        table_ids.append(sql['table_id'])
     return query_gt, table_ids
 
 
-def epoch_train(model, optimizer, batch_size, sql_data, table_data, schemas, pred_entry):
+def epoch_train(model, optimizer, batch_size, sql_data, table_data, schemas, pred_entry, prefetch=2, bucket=False):
     model.train()
-    perm=np.random.permutation(len(sql_data))
+    q_lens, col_nums = example_sizes(sql_data, table_data)
+    if bucket:
+        perm = bucket_perm(q_lens, col_nums, batch_size)
+    else:
+        perm=np.random.permutation(len(sql_data))
     cum_loss = 0.0
-    st = 0
-    while st < len(sql_data):
-        ed = st+batch_size if st+batch_size < len(perm) else len(perm)
-
-        q_seq, col_seq, col_num, ans_seq, query_seq, gt_cond_seq, col_org_seq, schema_seq = \
-                to_batch_seq(sql_data, table_data, perm, st, ed, schemas)
+    start = time.time()
+    # to_batch_seq of the next batches runs in the background while this one trains
+    batches = BatchPrefetcher(lambda st, ed: to_batch_seq(sql_data, table_data, perm, st, ed, schemas),
+            len(sql_data), batch_size, depth=prefetch)
+    for st, ed, batch in batches:
+        q_seq, col_seq, col_num, ans_seq, query_seq, gt_cond_seq, col_org_seq, schema_seq = batch
         gt_sel_seq = [x[1] for x in ans_seq]
         score = model.forward(q_seq, col_seq, col_num, pred_entry, gt_cond=gt_cond_seq, gt_sel=gt_sel_seq)
         loss = model.loss(score, ans_seq, pred_entry)
@@ -137,8 +153,10 @@ def epoch_train(model, optimizer, batch_size, sql_data, table_data, schemas, pre
         loss.backward()
         optimizer.step()
 
-        st = ed
-
+    elapsed = time.time() - start
+    print ' Data wait: %.1f%% of %.1fs (prefetch depth %d)'%(100.0 * batches.wait_time / max(elapsed, 1e-9), elapsed, prefetch)
+    print ' %.0f question tokens/s, %.1f%% padding (%s batches)'%(q_lens.sum() / max(elapsed, 1e-9),
+            100.0 * padding_ratio(perm, q_lens, col_nums, batch_size), 'bucketed' if bucket else 'random')
     return cum_loss / len(sql_data)
 
 
@@ -173,6 +191,8 @@ def print_results(model, batch_size, sql_data, table_data, output_file, schemas,
     one_acc_num = 0.0
     tot_acc_num = 0.0
     output =  open(output_file, 'w')
+    decode_time = 0.0
+    n_batch = 0
     while st < len(sql_data):
         ed = st+batch_size if st+batch_size < len(perm) else len(perm)
         q_seq, col_seq, col_num, ans_seq, query_seq, gt_cond_seq,\
@@ -181,10 +201,14 @@ def print_results(model, batch_size, sql_data, table_data, output_file, schemas,
         raw_col_seq = [x[1] for x in raw_data]
         query_gt, table_ids = to_batch_query(sql_data, perm, st, ed)
         score = model.forward(q_seq, col_seq, col_num, pred_entry)
+        decode_st = time.time()
         gen_sqls = model.gen_sql(score, col_org_seq, schema_seq)
+        decode_time += time.time() - decode_st
+        n_batch += 1
         for sql in gen_sqls:
             output.write(sql+"\n")
         st = ed
+    print 'Decoding: %.2f ms per batch (%d batches)'%(decode_time * 1e3 / max(n_batch, 1), n_batch)
 
 def load_para_wemb(file_name):
     f = io.open(file_name, 'r', encoding='utf-8')
@@ -218,8 +242,12 @@ def load_concat_wemb(fn1, fn2):
 
 
 def load_word_emb(file_name, load_used=False, use_small=False):
-    if not load_used:
-        print ('Loading word embedding from %s'%file_name)
+    if not load_used and has_store(file_name):
+        # converted with scripts/glove_store.py: memory-mapped, nothing to parse
+        print ('Loading word embedding store for %s'%file_name)
+        return GloveStore.load(file_name, use_small=use_small)
+    elif not load_used:
+        print ('Loading word embedding from %s (convert it once with scripts/glove_store.py to skip parsing)'%file_name)
         ret = {}
         with open(file_name) as inf:
             for idx, line in enumerate(inf):
@@ -245,6 +273,10 @@ def process(sql_data, table_data):
         table = table_data[i]
         temp = {}
         temp['col_map'] = table['column_names']
+        # column names and their tokens, shared by every batch instead of rebuilt per batch;
+        # tuples, so an in-place edit downstream cannot change them for later batches
+        temp['col_names'] = tuple(col[1] for col in table['column_names'])
+        temp['col_toks'] = tuple(tuple(x.split(" ")) for x in temp['col_names'])
         db_name = table['db_id']
         # print table
         output_tab[db_name] = temp
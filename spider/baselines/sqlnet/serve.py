@@ -0,0 +1,109 @@
+"""
+Batched SQLNet inference over a stream of requests
+
+usage: python serve.py --dataset data/ [--cpu] [--batch_size 64] [--max_wait 20] < requests.jsonl
+
+Reads one JSON request per line from stdin, {"question": ..., "db_id": ...}
+(optionally with "question_toks"; otherwise the question is tokenized with
+nltk), and writes the request back with the predicted "query" added, one line
+per request and in input order. The model is loaded once; requests are
+grouped into batches of up to --batch_size, waiting at most --max_wait ms for
+a batch to fill before running what has arrived. Requests that cannot be
+parsed or name an unknown db_id get an "error" instead of a "query".
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import torch
+import argparse
+import threading
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+from scripts.inference import SQLNetPredictor
+
+
+def read_lines(inf, queue):
+    # readline instead of file iteration, which buffers ahead on python 2 and stalls a live stream
+    for line in iter(inf.readline, ''):
+        line = line.strip()
+        if line:
+            queue.put(line)
+    queue.put(None)
+
+
+def batches(queue, batch_size, max_wait):
+    """Lists of up to batch_size lines, cut short when max_wait seconds pass"""
+    while True:
+        line = queue.get()
+        if line is None:
+            return
+        batch = [line]
+        deadline = time.time() + max_wait
+        while len(batch) < batch_size:
+            try:
+                line = queue.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                break
+            if line is None:
+                yield batch
+                return
+            batch.append(line)
+        yield batch
+
+
+def parse_request(line, predictor):
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return None, {'error': 'invalid json: %s' % e}
+    if not isinstance(request, dict) or 'question' not in request or 'db_id' not in request:
+        return None, {'error': 'a request needs "question" and "db_id"'}
+    if request['db_id'] not in predictor:
+        return None, dict(request, error='unknown db_id %s' % request['db_id'])
+    return request, None
+
+
+def serve(predictor, inf, outf, batch_size, max_wait):
+    queue = Queue(maxsize=4 * batch_size)
+    reader = threading.Thread(target=read_lines, args=(inf, queue))
+    reader.daemon = True
+    reader.start()
+    for lines in batches(queue, batch_size, max_wait):
+        parsed = [parse_request(line, predictor) for line in lines]
+        requests = [request for request, _ in parsed if request is not None]
+        sqls = iter(predictor.predict(requests))
+        for request, error in parsed:
+            outf.write(json.dumps(error if request is None else dict(request, query=next(sqls))) + '\n')
+        outf.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='',
+            help='dataset directory holding tables.json')
+    parser.add_argument('--models', type=str, default='saved_models',
+            help='directory with the sel/cond/group/order dumps written by train.py')
+    parser.add_argument('--cpu', action='store_true',
+            help='Run on CPU even when CUDA is available.')
+    parser.add_argument('--train_emb', action='store_true',
+            help='Use trained word embedding for SQLNet.')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--max_wait', type=float, default=20,
+            help='milliseconds to wait for a batch to fill')
+    args = parser.parse_args()
+
+    N_word=300
+    B_word=42
+    GPU = torch.cuda.is_available() and not args.cpu
+
+    # loading progress and model messages go to stderr, stdout only carries predictions
+    out, sys.stdout = sys.stdout, sys.stderr
+    predictor = SQLNetPredictor(os.path.join(args.dataset, 'tables.json'),
+            'glove/glove.%dB.%dd.txt'%(B_word,N_word), model_dir=args.models, gpu=GPU, N_word=N_word,
+            train_emb=args.train_emb)
+    print('Serving on %s, batch size %d' % ('GPU' if GPU else 'CPU', args.batch_size))
+    serve(predictor, sys.stdin, out, args.batch_size, args.max_wait / 1000.0)
@@ -5,6 +5,7 @@ import argparse
 import numpy as np
 from scripts.utils import *
 from scripts.model.sqlnet import SQLNet
+from scripts.inference import load_saved_models
 
 
 if __name__ == '__main__':
@@ -17,17 +18,18 @@ if __name__ == '__main__':
             help='output file where predicted SQL queries will be printed on')
     parser.add_argument('--train_emb', action='store_true',
             help='Use trained word embedding for SQLNet.')
+    parser.add_argument('--cpu', action='store_true',
+            help='Run on CPU even when CUDA is available.')
     args = parser.parse_args()
 
     N_word=300
     B_word=42
+    GPU = torch.cuda.is_available() and not args.cpu
     if args.toy:
         USE_SMALL=True
-        GPU=True
         BATCH_SIZE=15
     else:
         USE_SMALL=False
-        GPU=True
         BATCH_SIZE=64
     TEST_ENTRY=(True, True, True)  # (AGG, SEL, COND)
 
@@ -40,13 +42,6 @@ if __name__ == '__main__':
 
     model = SQLNet(word_emb, N_word=N_word, gpu=GPU, trainable_emb = args.train_emb)
 
-    print "Loading from sel model..."
-    model.sel_pred.load_state_dict(torch.load("saved_models/sel_models.dump"))
-    print "Loading from sel model..."
-    model.cond_pred.load_state_dict(torch.load("saved_models/cond_models.dump"))
-    print "Loading from sel model..."
-    model.group_pred.load_state_dict(torch.load("saved_models/group_models.dump"))
-    print "Loading from sel model..."
-    model.order_pred.load_state_dict(torch.load("saved_models/order_models.dump"))
+    load_saved_models(model, gpu=GPU)
 
     print_results(model, BATCH_SIZE, test_sql_data, test_table_data, args.output, schemas, TEST_ENTRY)
@@ -14,18 +14,23 @@ if __name__ == '__main__':
             help='to dataset directory where includes train, test and table json file.')
     parser.add_argument('--train_emb', action='store_true',
             help='Train word embedding.')
+    parser.add_argument('--prefetch', type=int, default=2,
+            help='Batches prepared in the background while training, 0 to build them inline.')
+    parser.add_argument('--bucket', action='store_true',
+            help='Batch questions of similar length and column count together to cut padding.')
+    parser.add_argument('--cpu', action='store_true',
+            help='Run on CPU even when CUDA is available.')
 
     args = parser.parse_args()
 
     N_word=300
     B_word=42
+    GPU = torch.cuda.is_available() and not args.cpu
     if args.toy:
         USE_SMALL=True
-        GPU=True
         BATCH_SIZE=20
     else:
         USE_SMALL=False
-        GPU=True
         BATCH_SIZE=64
     TRAIN_ENTRY=(True, True, True)  # (AGG, SEL, COND)
     TRAIN_AGG, TRAIN_SEL, TRAIN_COND = TRAIN_ENTRY
@@ -53,7 +58,7 @@ if __name__ == '__main__':
 
     for i in range(300):
         print 'Epoch %d @ %s'%(i+1, datetime.datetime.now())
-        print ' Loss = %s'%epoch_train(model, optimizer, BATCH_SIZE, sql_data, table_data, schemas, TRAIN_ENTRY)
+        print ' Loss = %s'%epoch_train(model, optimizer, BATCH_SIZE, sql_data, table_data, schemas, TRAIN_ENTRY, prefetch=args.prefetch, bucket=args.bucket)
         train_tot_acc, train_bkd_acc = epoch_acc(model, BATCH_SIZE, sql_data, table_data, schemas, TRAIN_ENTRY, train_flag = True)
         print ' Train acc_qm: %s' % train_tot_acc
         print ' Breakdown results: sel: %s, cond: %s, group: %s, order: %s'\
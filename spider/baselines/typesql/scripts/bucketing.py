@@ -0,0 +1,77 @@
+"""
+Length-bucketed batch order for epoch_train
+
+A random permutation pads every batch to its longest question and to the
+database with the most columns in it. bucket_perm keeps the epoch random but
+groups examples of similar size: it shuffles, cuts the order into windows of
+BUCKET_BATCHES batches, sorts each window by (column count, question length),
+cuts it into batches and shuffles the batch order. run_lstm already packs the
+padded sequences, so the LSTM encoders skip the padding either way; bucketing
+also shrinks the padded embedding and attention tensors around them.
+
+    python -m scripts.bucketing data/ [batch size]
+prints the padding ratio of both orders on the training split.
+"""
+import os
+import sys
+import json
+import numpy as np
+
+# process() field with the question tokens
+QUESTION_FIELD = 'question_tok_concol'
+# Batches sorted together; larger windows pad less but make batches less random
+BUCKET_BATCHES = 50
+
+
+def example_sizes(sql_data, table_data):
+    """(question length, column count) of every example, as numpy arrays"""
+    q_len = np.array([len(sql[QUESTION_FIELD]) for sql in sql_data], dtype=np.int64)
+    col_num = np.array([len(table_data[sql['table_id']]['col_map']) for sql in sql_data], dtype=np.int64)
+    return q_len, col_num
+
+
+def bucket_perm(q_len, col_num, batch_size, rng=np.random):
+    """Example order whose consecutive batch_size runs have similar sizes"""
+    perm = rng.permutation(len(q_len))
+    window = batch_size * BUCKET_BATCHES
+    batches = []
+    for st in range(0, len(perm), window):
+        idx = perm[st:st + window]
+        # column counts vary far more than question lengths, so they are the primary key;
+        # lexsort is stable, so equal sizes stay in random order
+        idx = idx[np.lexsort((q_len[idx], col_num[idx]))]
+        batches.extend(idx[i:i + batch_size] for i in range(0, len(idx), batch_size))
+    # only the last batch can be short; it stays last so the batch boundaries hold
+    last = [batches.pop()] if batches and len(batches[-1]) < batch_size else []
+    batches = [batches[i] for i in rng.permutation(len(batches))] + last
+    return np.concatenate(batches) if batches else perm
+
+
+def padding_ratio(perm, q_len, col_num, batch_size):
+    """Share of the question and column positions of the batches that are padding"""
+    real = 0
+    padded = 0
+    for st in range(0, len(perm), batch_size):
+        idx = perm[st:st + batch_size]
+        real += q_len[idx].sum() + col_num[idx].sum()
+        padded += len(idx) * (q_len[idx].max() + col_num[idx].max())
+    return 1.0 - float(real) / max(padded, 1)
+
+
+if __name__ == '__main__':
+    from scripts.data_cache import SPLITS
+    from scripts.utils import load_data_new
+
+    if len(sys.argv) not in (2, 3):
+        print('Usage: python -m scripts.bucketing [dataset dir] [batch size, default 64]')
+        sys.exit(1)
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    table_path = os.path.join(sys.argv[1], 'tables.json')
+    with open(table_path) as inf:
+        table_data = json.load(inf)
+    sql_data, table_data, _ = load_data_new(os.path.join(sys.argv[1], SPLITS[0]), table_data, table_path=table_path)
+    q_len, col_num = example_sizes(sql_data, table_data)
+    rng = np.random.RandomState(0)
+    print('random:   %.1f%% padding' % (100 * padding_ratio(rng.permutation(len(q_len)), q_len, col_num, batch_size)))
+    print('bucketed: %.1f%% padding' % (100 * padding_ratio(bucket_perm(q_len, col_num, batch_size, rng),
+            q_len, col_num, batch_size)))
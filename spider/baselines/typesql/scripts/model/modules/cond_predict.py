@@ -78,7 +78,7 @@ class CondPredictor(nn.Module):
         q_weighted = (q_enc.unsqueeze(1) * att_prob_qc.unsqueeze(3)).sum(2)
         # Compute prediction scores
         # self.col_out.squeeze(): (B, max_col_len)
-        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze()
+        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze(2)
         for idx, num in enumerate(col_len):
             if num < max_col_len:
                 col_score[idx, num:] = -100
@@ -100,7 +100,7 @@ class CondPredictor(nn.Module):
 
         # Predict op
         op_att_val = torch.matmul(self.op_att(q_enc).unsqueeze(1),
-                col_emb.unsqueeze(3)).squeeze()
+                col_emb.unsqueeze(3)).squeeze(3)
         for idx, num in enumerate(q_len):
             if num < max_q_len:
                 op_att_val[idx, :, num:] = -100
@@ -108,7 +108,7 @@ class CondPredictor(nn.Module):
         q_weighted_op = (q_enc.unsqueeze(1) * op_att.unsqueeze(3)).sum(2)
 
         op_score = self.op_out(self.op_out_q(q_weighted_op) +
-                            self.op_out_c(col_emb)).squeeze()
+                            self.op_out_c(col_emb))
 
         score = (col_num_score, col_score, op_score)
 
@@ -89,7 +89,7 @@ class GroupPredictor(nn.Module):
         gby_att = self.softmax(gby_att_val.view((-1, max_q_len))).view(B, -1, max_q_len)
         K_gby_expand = (q_enc.unsqueeze(1) * gby_att.unsqueeze(3)).sum(2)
         gby_score = self.gby_out(self.gby_out_K(K_gby_expand) + \
-                self.gby_out_col(col_enc)).squeeze()
+                self.gby_out_col(col_enc)).squeeze(2)
 
         for idx, num in enumerate(col_len):
             if num < max_col_len:
@@ -118,7 +118,7 @@ class GroupPredictor(nn.Module):
         q_weighted = (q_enc.unsqueeze(1) * att_prob_qc.unsqueeze(3)).sum(2)
         # Compute prediction scores
         # self.col_out.squeeze(): (B, max_col_len)
-        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze()
+        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze(2)
         for idx, num in enumerate(col_len):
             if num < max_col_len:
                 col_score[idx, num:] = -100
@@ -0,0 +1,47 @@
+from collections import defaultdict
+
+
+class JoinPaths(object):
+    """Foreign key graph of one database and the join paths between its tables
+
+    Built once per db_id instead of once per predicted query. path(start, end)
+    is the [(table, (acol, bcol)), ...] walk gen_from joins along; it comes
+    from the same depth-first search gen_from used to run for every candidate
+    table. That search marks tables as visited when they are pushed, so the
+    walk to a table does not depend on where the search stops: one full
+    search from start gives the walk to every reachable table, and it is kept
+    for all later queries on the database.
+    """
+
+    def __init__(self, schema):
+        self.graph = defaultdict(list)
+        for acol, bcol in schema["foreign_keys"]:
+            t1 = schema["column_names"][acol][0]
+            t2 = schema["column_names"][bcol][0]
+            self.graph[t1].append((t2, (acol, bcol)))
+            self.graph[t2].append((t1, (bcol, acol)))
+        self.paths = {}
+
+    def search(self, start):
+        """Walks from start to every table reachable from it"""
+        paths = {}
+        stack = [[start, []]]
+        visited = set()
+        while len(stack) > 0:
+            ele, history = stack.pop()
+            for node in self.graph.get(ele, ()):
+                if node[0] not in visited:
+                    path = history + [(node[0], node[1])]
+                    stack.append((node[0], path))
+                    visited.add(node[0])
+                    paths.setdefault(node[0], path)
+        return paths
+
+    def path(self, start, end):
+        """Join walk from start to end, None when they are not connected"""
+        if start == end:
+            return []
+        paths = self.paths.get(start)
+        if paths is None:
+            paths = self.paths[start] = self.search(start)
+        return paths.get(end)
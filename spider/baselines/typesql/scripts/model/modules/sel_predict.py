@@ -83,7 +83,7 @@ class SelPredictor(nn.Module):
         q_weighted = (q_enc.unsqueeze(1) * att_prob_qc.unsqueeze(3)).sum(2)
         # Compute prediction scores
         # self.col_out.squeeze(): (B, max_col_len)
-        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze()
+        col_score = self.col_out(self.col_out_q(q_weighted) + self.col_out_c(col_enc)).squeeze(2)
         for idx, num in enumerate(col_len):
             if num < max_col_len:
                 col_score[idx, num:] = -100
@@ -116,7 +116,7 @@ class SelPredictor(nn.Module):
         # col_emb.unsqueeze(3): (B, 4, hd, 1)
         # agg_num_att_val.squeeze: (B, 4, max_x_len)
         agg_num_att_val = torch.matmul(self.agg_num_att(q_enc).unsqueeze(1),
-                col_emb.unsqueeze(3)).squeeze()
+                col_emb.unsqueeze(3)).squeeze(3)
         for idx, num in enumerate(q_len):
             if num < max_q_len:
                 agg_num_att_val[idx, :, num:] = -100
@@ -124,10 +124,10 @@ class SelPredictor(nn.Module):
         q_weighted_agg_num = (q_enc.unsqueeze(1) * agg_num_att.unsqueeze(3)).sum(2)
         # (B, 4, 4)
         agg_num_score = self.agg_num_out(self.agg_num_out_q(q_weighted_agg_num) +
-                self.agg_num_out_c(col_emb)).squeeze()
+                self.agg_num_out_c(col_emb))
 
         agg_att_val = torch.matmul(self.agg_att(q_enc).unsqueeze(1),
-                col_emb.unsqueeze(3)).squeeze()
+                col_emb.unsqueeze(3)).squeeze(3)
         for idx, num in enumerate(q_len):
             if num < max_q_len:
                 agg_att_val[idx, :, num:] = -100
@@ -135,7 +135,7 @@ class SelPredictor(nn.Module):
         q_weighted_agg = (q_enc.unsqueeze(1) * agg_att.unsqueeze(3)).sum(2)
 
         agg_score = self.agg_out(self.agg_out_q(q_weighted_agg) +
-                            self.agg_out_c(col_emb)).squeeze()
+                            self.agg_out_c(col_emb))
 
         score = (col_num_score, col_score, agg_num_score, agg_score)
 
@@ -14,6 +14,10 @@ if __name__ == '__main__':
             help='to dataset directory where includes train, test and table json file.')
     parser.add_argument('--train_emb', action='store_true',
             help='Train word embedding.')
+    parser.add_argument('--prefetch', type=int, default=2,
+            help='Batches prepared in the background while training, 0 to build them inline.')
+    parser.add_argument('--bucket', action='store_true',
+            help='Batch questions of similar length and column count together to cut padding.')
 
     args = parser.parse_args()
 
@@ -53,7 +57,7 @@ if __name__ == '__main__':
 
     for i in range(300):
         print 'Epoch %d @ %s'%(i+1, datetime.datetime.now())
-        print ' Loss = %s'%epoch_train(model, optimizer, BATCH_SIZE, sql_data, table_data, schemas, TRAIN_ENTRY)
+        print ' Loss = %s'%epoch_train(model, optimizer, BATCH_SIZE, sql_data, table_data, schemas, TRAIN_ENTRY, prefetch=args.prefetch, bucket=args.bucket)
         train_tot_acc, train_bkd_acc = epoch_acc(model, BATCH_SIZE, sql_data, table_data, schemas, TRAIN_ENTRY, train_flag = True)
         print ' Train acc_qm: %s' % train_tot_acc
         print ' Breakdown results: sel: %s, cond: %s, group: %s, order: %s'\
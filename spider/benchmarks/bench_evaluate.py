@@ -0,0 +1,122 @@
+"""
+Wall time of evaluate() with and without the per-database schema and connection caches
+
+usage: python benchmarks/bench_evaluate.py [dev.json] [tables.json] [repeats] [rows]   (run from spider/)
+
+Builds a synthetic SQLite file for every database dev.json uses (the tables
+of tables.json, `rows` rows each), scores the gold queries against
+themselves and reports the best of `repeats` in-process evaluate() runs for
+etype all and exec. "uncached" reads the schema and opens a new connection
+for every example, as evaluate did before; "cached" is the current code.
+The parse memo is cleared before every run, so parsing is timed in both
+modes. Also checks that both modes print the same report.
+"""
+from __future__ import print_function
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import evaluation
+import process_sql
+from process_sql import Schema, get_schema
+
+SAMPLE_VALUES = {'number': lambda i: i % 17, 'time': lambda i: '2018-01-%02d' % (i % 28 + 1),
+                 'boolean': lambda i: i % 2}
+
+
+def build_databases(tables, db_ids, db_dir, rows):
+    for entry in tables:
+        if entry['db_id'] not in db_ids:
+            continue
+        os.makedirs(os.path.join(db_dir, entry['db_id']))
+        conn = sqlite3.connect(os.path.join(db_dir, entry['db_id'], entry['db_id'] + '.sqlite'))
+        for tab_id, table in enumerate(entry['table_names_original']):
+            if table.lower().startswith('sqlite_'):
+                # sqlite_sequence and friends are created by SQLite itself
+                continue
+            cols = [(col, entry['column_types'][idx]) for idx, (t, col) in enumerate(entry['column_names_original'])
+                    if t == tab_id]
+            conn.execute('CREATE TABLE "{}" ({})'.format(table, ', '.join('"{}"'.format(col) for col, _ in cols)))
+            values = [[SAMPLE_VALUES.get(typ, lambda i: 'v%d' % (i % 7))(i) for _, typ in cols] for i in range(rows)]
+            conn.executemany('INSERT INTO "{}" VALUES ({})'.format(table, ', '.join('?' * len(cols))), values)
+        conn.commit()
+        conn.close()
+
+
+@contextlib.contextmanager
+def uncached():
+    """Schema read and connection opened per example, closed at the end of the run"""
+    opened = []
+
+    def get_cached_schema(db):
+        return Schema(get_schema(db))
+
+    def get_connection(db):
+        opened.append(sqlite3.connect(db))
+        return opened[-1]
+
+    saved = evaluation.get_cached_schema, evaluation.get_connection
+    evaluation.get_cached_schema, evaluation.get_connection = get_cached_schema, get_connection
+    try:
+        yield
+    finally:
+        evaluation.get_cached_schema, evaluation.get_connection = saved
+        for conn in opened:
+            conn.close()
+
+
+def run(gold, pred, db_dir, etype, kmaps, cached):
+    evaluation._schema_cache.clear()
+    evaluation.close_connections()
+    process_sql._parse_memo.clear()
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        if cached:
+            evaluation.evaluate(gold, pred, db_dir, etype, kmaps)
+        else:
+            with uncached():
+                evaluation.evaluate(gold, pred, db_dir, etype, kmaps)
+    return time.perf_counter() - start, out.getvalue()
+
+
+if __name__ == '__main__':
+    dev_path = sys.argv[1] if len(sys.argv) > 1 else 'evaluation_examples/examples/dev.json'
+    table_path = sys.argv[2] if len(sys.argv) > 2 else 'evaluation_examples/examples/tables.json'
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    rows = int(sys.argv[4]) if len(sys.argv) > 4 else 60
+
+    with open(dev_path) as f:
+        dev = json.load(f)
+    with open(table_path) as f:
+        tables = json.load(f)
+    kmaps = evaluation.build_foreign_key_map_from_json(table_path)
+    tmp = tempfile.mkdtemp()
+    try:
+        db_dir = os.path.join(tmp, 'database')
+        build_databases(tables, set(ex['db_id'] for ex in dev), db_dir, rows)
+        gold = os.path.join(tmp, 'gold.txt')
+        with open(gold, 'w') as f:
+            f.write(''.join('{}\t{}\n'.format(' '.join(ex['query'].split()), ex['db_id']) for ex in dev))
+
+        print('{} examples, {} databases, {} rows per table, best of {}'.format(
+            len(dev), len(set(ex['db_id'] for ex in dev)), rows, repeats))
+        print('{:>6} {:>14} {:>12} {:>8}'.format('etype', 'uncached (s)', 'cached (s)', 'speedup'))
+        for etype in ('all', 'exec'):
+            results = {}
+            for cached in (False, True):
+                runs = [run(gold, gold, db_dir, etype, kmaps, cached) for _ in range(repeats)]
+                results[cached] = min(elapsed for elapsed, _ in runs), runs[0][1]
+            assert results[False][1] == results[True][1], 'reports differ between the two modes'
+            print('{:>6} {:>14.3f} {:>12.3f} {:>7.2f}x'.format(
+                etype, results[False][0], results[True][0], results[False][0] / results[True][0]))
+    finally:
+        evaluation.close_connections()
+        shutil.rmtree(tmp)
@@ -0,0 +1,75 @@
+"""
+Time and peak memory of exec-match result comparison on large synthetic results
+
+usage: python benchmarks/bench_exec_match.py [rows ...]   (run from spider/)
+
+Compares the previous column-list comparison (fetchall both results, build a
+dict of per-column lists) with the streaming multiset comparison used by
+eval_exec_match, for a prediction returning the gold rows in the same order
+and one returning them reordered. Time is measured without tracing.
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import sqlite3
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation import LimitedQuery, execute_with_limits, compare_results
+
+GOLD = 'SELECT id, name, score FROM t'
+PREDS = [('same order', 'SELECT score, id, name FROM t'),
+         ('reordered', 'SELECT score, id, name FROM t ORDER BY score')]
+GOLD_COLUMNS = {('none', 'id'): 0, ('none', 'name'): 1, ('none', 'score'): 2}
+PRED_COLUMNS = {('none', 'score'): 0, ('none', 'id'): 1, ('none', 'name'): 2}
+
+
+def build_db(rows):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER, name TEXT, score REAL)')
+    conn.executemany('INSERT INTO t VALUES (?, ?, ?)',
+                     ((i, 'name_%d' % (i % 1000), (i * 7919) % 10007 / 3.0) for i in range(rows)))
+    return conn
+
+
+def legacy(conn, pred):
+    def res_map(res, columns):
+        return dict((key, [r[idx] for r in res]) for key, idx in columns.items())
+    p_res = conn.execute(pred).fetchall()
+    q_res = conn.execute(GOLD).fetchall()
+    return res_map(p_res, PRED_COLUMNS) == res_map(q_res, GOLD_COLUMNS)
+
+
+def streaming(conn, pred):
+    q_res = execute_with_limits(conn, GOLD, timeout=600)
+    p_res = LimitedQuery(conn, pred, timeout=600)
+    try:
+        return compare_results(p_res.batches(), q_res, PRED_COLUMNS, GOLD_COLUMNS)
+    finally:
+        p_res.close()
+
+
+def measure(fn, conn, pred):
+    start = time.perf_counter()
+    result = fn(conn, pred)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(conn, pred)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [10000, 100000, 1000000]
+    print('{:>10} {:>12} {:>10} {:>8} {:>10} {:>12}'.format(
+        'rows', 'prediction', 'method', 'match', 'time (s)', 'peak (MiB)'))
+    for rows in sizes:
+        conn = build_db(rows)
+        for label, pred in PREDS:
+            for name, fn in (('legacy', legacy), ('streaming', streaming)):
+                result, elapsed, peak = measure(fn, conn, pred)
+                print('{:>10} {:>12} {:>10} {:>8} {:>10.3f} {:>12.1f}'.format(
+                    rows, label, name, str(result), elapsed, peak / 2.0 ** 20))
+        conn.close()
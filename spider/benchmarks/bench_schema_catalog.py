@@ -0,0 +1,89 @@
+"""
+Startup cost of loading schemas from tables.json versus the compiled schema catalog
+
+usage: python benchmarks/bench_schema_catalog.py [tables.json] [repeats]   (run from spider/)
+
+json: json.load + build_foreign_key_map + process_sql.Schema for every database,
+which is what evaluation and preprocessing did on every start.
+catalog open: mmap the catalog and read its header.
+catalog fk maps: open + the foreign key maps of every database.
+catalog all: open + foreign key maps and both Schema id maps of every database.
+Also checks that the catalog reproduces the foreign key maps exactly.
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from process_sql import Schema
+from evaluation import build_foreign_key_map, build_foreign_key_map_from_json
+from schema_catalog import SchemaCatalog, compile_catalog
+
+
+def from_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    for entry in data:
+        build_foreign_key_map(entry)
+        tables = entry['table_names_original']
+        Schema(dict((tab.lower(), [col.lower() for tab_id, col in entry['column_names_original'] if tab_id == idx])
+                    for idx, tab in enumerate(tables)))
+
+
+def catalog_open(path):
+    SchemaCatalog(path).close()
+
+
+def catalog_fk_maps(path):
+    catalog = SchemaCatalog(path)
+    for db_id in catalog.db_ids():
+        catalog.foreign_key_map(db_id)
+    catalog.close()
+
+
+def catalog_all(path):
+    catalog = SchemaCatalog(path)
+    for db_id in catalog.db_ids():
+        catalog.foreign_key_map(db_id)
+        catalog.schema(db_id)
+        catalog.index_schema(db_id)
+    catalog.close()
+
+
+def bench(fn, path, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        fn(path)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    tables_json = sys.argv[1] if len(sys.argv) > 1 else 'evaluation_examples/examples/tables.json'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    fd, path = tempfile.mkstemp(suffix='.catalog')
+    os.close(fd)
+    try:
+        start = time.time()
+        compile_catalog(tables_json, path)
+        print('compile: {:.1f} ms, {} -> {} bytes'.format(
+            (time.time() - start) * 1e3, os.path.getsize(tables_json), os.path.getsize(path)))
+
+        catalog = SchemaCatalog(path)
+        same = dict(catalog.foreign_key_maps()) == build_foreign_key_map_from_json(tables_json)
+        print('{} databases, foreign key maps identical: {}'.format(len(catalog), same))
+        catalog.close()
+
+        base = bench(from_json, tables_json, repeats)
+        print('{:>16}: {:8.2f} ms'.format('json', base * 1e3))
+        for name, fn in (('catalog open', catalog_open), ('catalog fk maps', catalog_fk_maps),
+                         ('catalog all', catalog_all)):
+            elapsed = bench(fn, path, repeats)
+            print('{:>16}: {:8.2f} ms ({:.1f}x faster)'.format(name, elapsed * 1e3, base / elapsed))
+    finally:
+        os.remove(path)
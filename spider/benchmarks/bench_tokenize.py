@@ -0,0 +1,82 @@
+"""
+Microbenchmark of process_sql.tokenize against the previous NLTK-based tokenizer
+
+usage: python benchmarks/bench_tokenize.py [dev.json] [repeats]   (run from spider/)
+
+Also checks that both produce identical tokens for every query in the file.
+The previous implementation needs nltk (with the punkt model) installed.
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from process_sql import tokenize
+
+
+def nltk_tokenize(string):
+    """process_sql.tokenize as it was before the single-pass lexer"""
+    from nltk import word_tokenize
+
+    string = str(string)
+    string = string.replace("\'", "\"")  # ensures all string values wrapped by "" problem??
+    quote_idxs = [idx for idx, char in enumerate(string) if char == '"']
+    assert len(quote_idxs) % 2 == 0, "Unexpected quote"
+
+    # keep string value as token
+    vals = {}
+    for i in range(len(quote_idxs)-1, -1, -2):
+        qidx1 = quote_idxs[i-1]
+        qidx2 = quote_idxs[i]
+        val = string[qidx1: qidx2+1]
+        key = "__val_{}_{}__".format(qidx1, qidx2)
+        string = string[:qidx1] + key + string[qidx2+1:]
+        vals[key] = val
+
+    toks = [word.lower() for word in word_tokenize(string)]
+    # replace with string value token
+    for i in range(len(toks)):
+        if toks[i] in vals:
+            toks[i] = vals[toks[i]]
+
+    # find if there exists !=, >=, <=
+    eq_idxs = [idx for idx, tok in enumerate(toks) if tok == "="]
+    eq_idxs.reverse()
+    prefix = ('!', '>', '<')
+    for eq_idx in eq_idxs:
+        pre_tok = toks[eq_idx-1]
+        if pre_tok in prefix:
+            toks = toks[:eq_idx-1] + [pre_tok + "="] + toks[eq_idx+1: ]
+
+    return toks
+
+
+def bench(fn, queries, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        for query in queries:
+            fn(query)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'evaluation_examples/examples/dev.json'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with open(path) as f:
+        queries = [entry['query'] for entry in json.load(f)]
+
+    mismatches = [q for q in queries if tokenize(q) != nltk_tokenize(q)]
+    print('{} queries, {} token mismatches'.format(len(queries), len(mismatches)))
+    for query in mismatches[:10]:
+        print('  ' + query)
+
+    old = bench(nltk_tokenize, queries, repeats)
+    new = bench(tokenize, queries, repeats)
+    print('nltk tokenize: {:.3f}s ({:.1f} us/query)'.format(old, old / len(queries) * 1e6))
+    print('lexer tokenize: {:.3f}s ({:.1f} us/query), {:.1f}x faster'.format(
+        new, new / len(queries) * 1e6, old / new))
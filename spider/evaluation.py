@@ -22,16 +22,40 @@
 from __future__ import print_function
 import os, sys
 import json
+import pickle
+import hashlib
 import sqlite3
+import time
 import traceback
 import argparse
-
-from process_sql import tokenize, get_schema, get_tables_with_alias, Schema, get_sql
+from collections import Counter
+from operator import itemgetter
+try:
+    from urllib.request import pathname2url
+except ImportError:  # Python 2: sqlite3 cannot open URI filenames
+    pathname2url = None
+
+from sql_tree import SQL_KEYS, SQLNode, Seq, record, freeze, from_dict, canonical
+from schema_catalog import load_catalog
+from process_sql import tokenize, get_schema, get_tables_with_alias, Schema, get_sql, set_parse_cache, \
+    close_parse_cache, normalize_query
 
 # Flag to disable value evaluation
 DISABLE_VALUE = True
 # Flag to disable distinct in select evaluation
 DISABLE_DISTINCT = True
+# Wall-clock limit (seconds) for executing a single query in exec evaluation
+EXEC_TIMEOUT = 30.0
+# Maximum number of rows fetched from a predicted query in exec evaluation
+EXEC_MAX_ROWS = 100000
+# Number of sqlite VM instructions between timeout checks
+PROGRESS_STEPS = 10000
+# Rows fetched per fetchmany call when streaming query results
+FETCH_BATCH_SIZE = 1000
+# Phases timed for every example in the evaluation records
+PHASES = ('parse', 'rebuild', 'exec', 'match')
+
+timer = getattr(time, 'perf_counter', time.time)
 
 
 CLAUSE_KEYWORDS = ('select', 'from', 'where', 'group', 'order', 'limit', 'intersect', 'union', 'except')
@@ -50,6 +74,208 @@ SQL_OPS = ('intersect', 'union', 'except')
 ORDER_OPS = ('desc', 'asc')
 
 
+# Per-database caches shared by all examples of an evaluation run
+_schema_cache = {}
+_connection_pool = {}
+
+
+def get_cached_schema(db):
+    """Schema of a database file, read once per evaluation run"""
+    if db not in _schema_cache:
+        _schema_cache[db] = Schema(get_schema(db))
+    return _schema_cache[db]
+
+
+def get_connection(db):
+    """Read-only connection to a database file, opened once and reused"""
+    if db not in _connection_pool:
+        if pathname2url is None:
+            conn = sqlite3.connect(db)
+            conn.execute('PRAGMA query_only = ON')
+        else:
+            uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(db)))
+            conn = sqlite3.connect(uri, uri=True)
+        _connection_pool[db] = conn
+    return _connection_pool[db]
+
+
+def close_connections():
+    for conn in _connection_pool.values():
+        conn.close()
+    _connection_pool.clear()
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class RowLimitExceeded(Exception):
+    pass
+
+
+class LimitedQuery:
+    """Cursor over a query bounded by a wall-clock timeout and a row cap
+
+    The timeout is enforced with sqlite's progress handler, which aborts the
+    statement from inside the VM, so pathological queries cannot hang the run.
+    The handler is installed around every step, so several limited queries
+    can be open on one connection at once.
+    """
+    def __init__(self, conn, query, timeout=None, max_rows=None):
+        self.conn = conn
+        self.query = query
+        self.max_rows = max_rows
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.count = 0
+        self.cursor = conn.cursor()
+        self._step(self.cursor.execute, query)
+
+    def _step(self, fn, *args):
+        if self.deadline is None:
+            return fn(*args)
+        deadline = self.deadline
+        self.conn.set_progress_handler(lambda: time.time() > deadline, PROGRESS_STEPS)
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise QueryTimeout(self.query)
+            raise
+        finally:
+            self.conn.set_progress_handler(None, 0)
+
+    def fetchmany(self, size=FETCH_BATCH_SIZE):
+        rows = self._step(self.cursor.fetchmany, size)
+        self.count += len(rows)
+        if self.max_rows is not None and self.count > self.max_rows:
+            raise RowLimitExceeded(self.query)
+        return rows
+
+    def batches(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield rows
+
+    def close(self):
+        self.cursor.close()
+
+
+def execute_with_limits(conn, query, timeout=None, max_rows=None):
+    """Execute query and fetch all its rows within the given limits"""
+    cursor = LimitedQuery(conn, query, timeout, max_rows)
+    try:
+        res = []
+        for rows in cursor.batches():
+            res.extend(rows)
+        return res
+    finally:
+        cursor.close()
+
+
+def result_columns(val_units):
+    """Result position of each select item, keyed by its val_unit"""
+    columns = {}
+    for idx, val_unit in enumerate(val_units):
+        key = tuple(val_unit[1]) if not val_unit[2] else (val_unit[0], tuple(val_unit[1]), tuple(val_unit[2]))
+        columns[key] = idx
+    return columns
+
+
+def compare_results(p_batches, q_rows, p_columns, q_columns, ordered=False):
+    """Compare result rows as multisets, or as sequences when ordered
+
+    Rows are projected onto the select items both queries share, so column
+    order in the select clause does not matter. p_batches yields lists of
+    predicted rows and is consumed in a single streaming pass; q_rows is a
+    list. Batches are compared positionally while both results agree, and
+    only the remaining gold rows are counted once the order diverges.
+    """
+    if set(p_columns) != set(q_columns):
+        return False
+    keys = list(q_columns)
+    if not keys:
+        return True
+    # itemgetter with one index returns the value itself, consistently for both sides
+    p_get = itemgetter(*[p_columns[key] for key in keys])
+    q_get = itemgetter(*[q_columns[key] for key in keys])
+
+    n = 0
+    remaining = None
+    for rows in p_batches:
+        p_keys = list(map(p_get, rows))
+        if remaining is None:
+            if p_keys == list(map(q_get, q_rows[n:n + len(p_keys)])):
+                n += len(p_keys)
+                continue
+            if ordered:
+                return False
+            remaining = Counter(map(q_get, q_rows[n:]))
+        for key in p_keys:
+            count = remaining.get(key, 0)
+            if count == 0:
+                return False
+            if count == 1:
+                del remaining[key]
+            else:
+                remaining[key] = count - 1
+    if remaining is None:
+        return n == len(q_rows)
+    return not remaining
+
+
+_db_hashes = {}
+
+
+def get_db_hash(db):
+    """Content hash of a database file, computed once per process"""
+    if db not in _db_hashes:
+        sha = hashlib.sha1()
+        with open(db, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        _db_hashes[db] = sha.hexdigest()
+    return _db_hashes[db]
+
+
+class GoldResultCache:
+    """Persistent store of gold query results keyed by (database file hash, normalized SQL)
+
+    Gold queries and databases do not change between evaluation runs, so only
+    predictions need to be executed once the cache is warm. A changed database
+    file gets a new hash and is therefore never served stale results. Queries
+    are keyed as get_sql sees them (normalize_query), so whitespace inside
+    string values still tells two queries apart.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS gold_results '
+                          '(db_hash TEXT, query TEXT, result BLOB, PRIMARY KEY (db_hash, query))')
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, db, query, execute):
+        """Gold result rows, from the cache or by calling execute(query)"""
+        key = (get_db_hash(db), normalize_query(query))
+        row = self.conn.execute('SELECT result FROM gold_results WHERE db_hash = ? AND query = ?', key).fetchone()
+        if row is not None:
+            self.hits += 1
+            return pickle.loads(bytes(row[0]))
+        self.misses += 1
+        res = execute(query)
+        self.conn.execute('INSERT OR REPLACE INTO gold_results VALUES (?, ?, ?)',
+                          key + (sqlite3.Binary(pickle.dumps(res, 2)),))
+        self.conn.commit()
+        return res
+
+    def close(self):
+        self.conn.close()
+
+
 HARDNESS = {
     "component1": ('where', 'group', 'order', 'limit', 'join', 'or', 'like'),
     "component2": ('except', 'union', 'intersect')
@@ -67,9 +293,9 @@ def condition_has_like(conds):
 def condition_has_sql(conds):
     for cond_unit in conds[::2]:
         val1, val2 = cond_unit[3], cond_unit[4]
-        if val1 is not None and type(val1) is dict:
+        if isinstance(val1, (dict, SQLNode)):
             return True
-        if val2 is not None and type(val2) is dict:
+        if isinstance(val2, (dict, SQLNode)):
             return True
     return False
 
@@ -108,43 +334,30 @@ def get_scores(count, pred_total, label_total):
     return 0,0,0
 
 
+def count_matches(pred_units, label_units):
+    """Number of pred units matched one-to-one by equal label units, compared by hash"""
+    if pred_units == label_units:
+        return len(pred_units)
+    return sum((Counter(pred_units) & Counter(label_units)).values())
+
+
 def eval_sel(pred, label):
     pred_sel = pred['select'][1]
     label_sel = label['select'][1]
-    label_wo_agg = [unit[1] for unit in label_sel]
     pred_total = len(pred_sel)
     label_total = len(label_sel)
-    cnt = 0
-    cnt_wo_agg = 0
-
-    for unit in pred_sel:
-        if unit in label_sel:
-            cnt += 1
-            label_sel.remove(unit)
-        if unit[1] in label_wo_agg:
-            cnt_wo_agg += 1
-            label_wo_agg.remove(unit[1])
-
+    cnt = count_matches(pred_sel, label_sel)
+    cnt_wo_agg = count_matches([unit[1] for unit in pred_sel], [unit[1] for unit in label_sel])
     return label_total, pred_total, cnt, cnt_wo_agg
 
 
 def eval_where(pred, label):
-    pred_conds = [unit for unit in pred['where'][::2]]
-    label_conds = [unit for unit in label['where'][::2]]
-    label_wo_agg = [unit[2] for unit in label_conds]
+    pred_conds = pred['where'][::2]
+    label_conds = label['where'][::2]
     pred_total = len(pred_conds)
     label_total = len(label_conds)
-    cnt = 0
-    cnt_wo_agg = 0
-
-    for unit in pred_conds:
-        if unit in label_conds:
-            cnt += 1
-            label_conds.remove(unit)
-        if unit[2] in label_wo_agg:
-            cnt_wo_agg += 1
-            label_wo_agg.remove(unit[2])
-
+    cnt = count_matches(pred_conds, label_conds)
+    cnt_wo_agg = count_matches([unit[2] for unit in pred_conds], [unit[2] for unit in label_conds])
     return label_total, pred_total, cnt, cnt_wo_agg
 
 
@@ -153,13 +366,9 @@ def eval_group(pred, label):
     label_cols = [unit[1] for unit in label['groupBy']]
     pred_total = len(pred_cols)
     label_total = len(label_cols)
-    cnt = 0
     pred_cols = [pred.split(".")[1] if "." in pred else pred for pred in pred_cols]
     label_cols = [label.split(".")[1] if "." in label else label for label in label_cols]
-    for col in pred_cols:
-        if col in label_cols:
-            cnt += 1
-            label_cols.remove(col)
+    cnt = count_matches(pred_cols, label_cols)
     return label_total, pred_total, cnt
 
 
@@ -206,9 +415,9 @@ def eval_and_or(pred, label):
 def get_nestedSQL(sql):
     nested = []
     for cond_unit in sql['from']['conds'][::2] + sql['where'][::2] + sql['having'][::2]:
-        if type(cond_unit[3]) is dict:
+        if isinstance(cond_unit[3], (dict, SQLNode)):
             nested.append(cond_unit[3])
-        if type(cond_unit[4]) is dict:
+        if isinstance(cond_unit[4], (dict, SQLNode)):
             nested.append(cond_unit[4])
     if sql['intersect'] is not None:
         nested.append(sql['intersect'])
@@ -377,6 +586,11 @@ class Evaluator:
             return "extra"
 
     def eval_exact_match(self, pred, label):
+        """Whether pred matches label; both are SQLNodes or parsed sql dicts"""
+        if not isinstance(pred, SQLNode):
+            pred = from_dict(pred)
+        if not isinstance(label, SQLNode):
+            label = from_dict(label)
         partial_scores = self.eval_partial_match(pred, label)
         self.partial_scores = partial_scores
 
@@ -384,9 +598,11 @@ class Evaluator:
             if score['f1'] != 1:
                 return 0
         if len(label['from']['table_units']) > 0:
-            label_tables = sorted(label['from']['table_units'])
-            pred_tables = sorted(pred['from']['table_units'])
-            return label_tables == pred_tables
+            label_tables = label['from']['table_units']
+            pred_tables = pred['from']['table_units']
+            # the order of the table units does not matter: otherwise compare the canonical FROM clauses
+            return label_tables == pred_tables or \
+                canonical(label)['from']['table_units'] == canonical(pred)['from']['table_units']
         return 1
 
     def eval_partial_match(self, pred, label):
@@ -432,8 +648,7 @@ class Evaluator:
 
 
 def isValidSQL(sql, db):
-    conn = sqlite3.connect(db)
-    cursor = conn.cursor()
+    cursor = get_connection(db).cursor()
     try:
         cursor.execute(sql)
     except:
@@ -454,6 +669,10 @@ def print_scores(scores, etype):
         print('=====================   EXECUTION ACCURACY     =====================')
         this_scores = [scores[level]['exec'] for level in levels]
         print("{:20} {:<20.3f} {:<20.3f} {:<20.3f} {:<20.3f} {:<20.3f}".format("execution", *this_scores))
+        timeouts = [scores[level]['exec_timeout'] for level in levels]
+        print("{:20} {:<20d} {:<20d} {:<20d} {:<20d} {:<20d}".format("exec timeout", *timeouts))
+        row_limits = [scores[level]['exec_row_limit'] for level in levels]
+        print("{:20} {:<20d} {:<20d} {:<20d} {:<20d} {:<20d}".format("exec row limit", *row_limits))
 
     if etype in ["all", "match"]:
         print('\n====================== EXACT MATCHING ACCURACY =====================')
@@ -475,7 +694,165 @@ def print_scores(scores, etype):
             print("{:20} {:<20.3f} {:<20.3f} {:<20.3f} {:<20.3f} {:<20.3f}".format(type_, *this_scores))
 
 
-def evaluate(gold, predict, db_dir, etype, kmaps):
+def empty_sql():
+    """Placeholder parse used when the predicted SQL cannot be parsed"""
+    return {
+        "except": None,
+        "from": {
+            "conds": [],
+            "table_units": []
+        },
+        "groupBy": [],
+        "having": [],
+        "intersect": None,
+        "limit": None,
+        "orderBy": [],
+        "select": [
+            False,
+            []
+        ],
+        "union": None,
+        "where": []
+    }
+
+
+def eval_example(evaluator, p_str, g_str, db_name, db_dir, etype, kmap, gold_cache=None,
+                 timeout=EXEC_TIMEOUT, max_rows=EXEC_MAX_ROWS):
+    """Score one prediction against its gold SQL, returning a per-example record
+
+    The record carries the scores, the exec status and the wall-clock time
+    (seconds) spent in each of PHASES.
+    """
+    timing = {}
+    start = timer()
+    db = os.path.join(db_dir, db_name, db_name + ".sqlite")
+    schema = get_cached_schema(db)
+    g_sql = get_sql(schema, g_str)
+    hardness = evaluator.eval_hardness(g_sql)
+    record = {'db_id': db_name, 'predictSQL': p_str, 'goldSQL': g_str, 'hardness': hardness,
+              'parse_error': False, 'time': timing}
+
+    try:
+        p_sql = get_sql(schema, p_str)
+    except:
+        # If p_sql is not valid, then we will use an empty sql to evaluate with the correct sql
+        p_sql = empty_sql()
+        record['parse_error'] = True
+    timing['parse'] = timer() - start
+
+    # rebuild sql for value evaluation; rebuild_sql_col also freezes the parse into an SQLNode,
+    # and runs first since the two rebuilds touch disjoint parts of the tree
+    phase_start = timer()
+    g_valid_col_units = build_valid_col_units(g_sql['from']['table_units'], schema)
+    g_sql = rebuild_sql_val(rebuild_sql_col(g_valid_col_units, g_sql, kmap))
+    p_valid_col_units = build_valid_col_units(p_sql['from']['table_units'], schema)
+    p_sql = rebuild_sql_val(rebuild_sql_col(p_valid_col_units, p_sql, kmap))
+    timing['rebuild'] = timer() - phase_start
+
+    if etype in ["all", "exec"]:
+        phase_start = timer()
+        record['exec'], record['exec_status'] = exec_match_status(db, p_str, g_str, p_sql, g_sql, gold_cache,
+                                                                  timeout, max_rows)
+        timing['exec'] = timer() - phase_start
+
+    if etype in ["all", "match"]:
+        phase_start = timer()
+        record['exact'] = evaluator.eval_exact_match(p_sql, g_sql)
+        record['partial'] = evaluator.partial_scores
+        timing['match'] = timer() - phase_start
+
+    timing['total'] = timer() - start
+    return record
+
+
+def _evaluate_db_group(task):
+    """Worker entry point: score all examples of one database in this process"""
+    db_name, examples, db_dir, etype, kmap, gold_cache_path, timeout, max_rows, parse_cache_path = task
+    evaluator = Evaluator()
+    set_parse_cache(parse_cache_path)
+    gold_cache = GoldResultCache(gold_cache_path) if gold_cache_path else None
+    records = [(idx, eval_example(evaluator, p_str, g_str, db_name, db_dir, etype, kmap, gold_cache,
+                                  timeout, max_rows))
+               for idx, p_str, g_str in examples]
+    close_connections()
+    close_parse_cache()
+    if gold_cache is None:
+        return records, 0, 0
+    gold_cache.close()
+    return records, gold_cache.hits, gold_cache.misses
+
+
+def iter_records_parallel(plist, glist, db_dir, etype, kmaps, jobs, gold_cache_path=None, cache_stats=None,
+                          timeout=EXEC_TIMEOUT, max_rows=EXEC_MAX_ROWS, parse_cache_path=None):
+    """Score examples in worker processes sharded by db_id, yielding records in input order
+
+    Each database is scored by a single task so its schema and connection stay
+    warm in that worker; records are re-ordered so that aggregation and output
+    are identical to the serial run, and are yielded as soon as every earlier
+    example has been scored.
+    """
+    import multiprocessing
+
+    groups = {}
+    for idx, (p, g) in enumerate(zip(plist, glist)):
+        g_str, db_name = g
+        groups.setdefault(db_name, []).append((idx, p[0], g_str))
+    # largest databases first for better load balance; name breaks ties deterministically
+    tasks = [(db_name, examples, db_dir, etype, kmaps[db_name], gold_cache_path, timeout, max_rows, parse_cache_path)
+             for db_name, examples in sorted(groups.items(), key=lambda kv: (-len(kv[1]), kv[0]))]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        records = {}
+        next_idx = 0
+        for group, hits, misses in pool.imap_unordered(_evaluate_db_group, tasks):
+            records.update(group)
+            if cache_stats is not None:
+                cache_stats['hits'] += hits
+                cache_stats['misses'] += misses
+            while next_idx in records:
+                yield records.pop(next_idx)
+                next_idx += 1
+    except BaseException:
+        # a failed worker or a consumer that stopped early: drop the queued work instead of waiting for it
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+def iter_records_serial(plist, glist, db_dir, etype, kmaps, gold_cache_path=None, cache_stats=None,
+                        timeout=EXEC_TIMEOUT, max_rows=EXEC_MAX_ROWS, parse_cache_path=None):
+    evaluator = Evaluator()
+    set_parse_cache(parse_cache_path)
+    gold_cache = GoldResultCache(gold_cache_path) if gold_cache_path else None
+    for p, g in zip(plist, glist):
+        p_str = p[0]
+        g_str, db_name = g
+        yield eval_example(evaluator, p_str, g_str, db_name, db_dir, etype, kmaps[db_name], gold_cache,
+                           timeout, max_rows)
+    close_connections()
+    close_parse_cache()
+    if gold_cache is not None:
+        gold_cache.close()
+        if cache_stats is not None:
+            cache_stats['hits'] += gold_cache.hits
+            cache_stats['misses'] += gold_cache.misses
+
+
+def evaluate(gold, predict, db_dir, etype, kmaps, jobs=1, gold_cache=None,
+             timeout=EXEC_TIMEOUT, max_rows=EXEC_MAX_ROWS, output=None, verbose=True, parse_cache=None):
+    """Score predictions against gold SQL and print the report
+
+    Returns (scores, entries), where entries holds one record per example in
+    input order. When output is given, every record is appended to that JSONL
+    file as soon as it is scored, followed by a final summary line with the
+    scores and the total time per phase. verbose=False suppresses the
+    per-example mismatch listing. parse_cache names an on-disk cache of parsed
+    queries shared across runs.
+    """
     with open(gold) as f:
         glist = [l.strip().split('\t') for l in f.readlines() if len(l.strip()) > 0]
 
@@ -483,7 +860,6 @@ def evaluate(gold, predict, db_dir, etype, kmaps):
         plist = [l.strip().split('\t') for l in f.readlines() if len(l.strip()) > 0]
     # plist = [("select max(Share),min(Share) from performance where Type != 'terminal'", "orchestra")]
     # glist = [("SELECT max(SHARE) ,  min(SHARE) FROM performance WHERE TYPE != 'Live final'", "orchestra")]
-    evaluator = Evaluator()
 
     levels = ['easy', 'medium', 'hard', 'extra', 'all']
     partial_types = ['select', 'select(no AGG)', 'where', 'where(no OP)', 'group(no Having)',
@@ -494,65 +870,58 @@ def evaluate(gold, predict, db_dir, etype, kmaps):
     for level in levels:
         scores[level] = {'count': 0, 'partial': {}, 'exact': 0.}
         scores[level]['exec'] = 0
+        scores[level]['exec_timeout'] = 0
+        scores[level]['exec_row_limit'] = 0
         for type_ in partial_types:
             scores[level]['partial'][type_] = {'acc': 0., 'rec': 0., 'f1': 0.,'acc_count':0,'rec_count':0}
 
+    cache_stats = {'hits': 0, 'misses': 0}
+    if jobs > 1:
+        records = iter_records_parallel(plist, glist, db_dir, etype, kmaps, jobs, gold_cache, cache_stats,
+                                        timeout, max_rows, parse_cache)
+    else:
+        records = iter_records_serial(plist, glist, db_dir, etype, kmaps, gold_cache, cache_stats,
+                                      timeout, max_rows, parse_cache)
+
+    out = open(output, 'w') if output else None
+    phase_time = dict((phase, 0.) for phase in PHASES + ('total',))
     eval_err_num = 0
-    for p, g in zip(plist, glist):
-        p_str = p[0]
-        g_str, db = g
-        db_name = db
-        db = os.path.join(db_dir, db, db + ".sqlite")
-        schema = Schema(get_schema(db))
-        g_sql = get_sql(schema, g_str)
-        hardness = evaluator.eval_hardness(g_sql)
+    for idx, record in enumerate(records):
+        record['index'] = idx
+        entries.append(record)
+        if out is not None:
+            out.write(json.dumps(dict(record, type='example'), sort_keys=True) + '\n')
+            out.flush()
+        for phase, seconds in record['time'].items():
+            phase_time[phase] += seconds
+
+        p_str = record['predictSQL']
+        g_str = record['goldSQL']
+        hardness = record['hardness']
         scores[hardness]['count'] += 1
         scores['all']['count'] += 1
 
-        try:
-            p_sql = get_sql(schema, p_str)
-        except:
-            # If p_sql is not valid, then we will use an empty sql to evaluate with the correct sql
-            p_sql = {
-            "except": None,
-            "from": {
-                "conds": [],
-                "table_units": []
-            },
-            "groupBy": [],
-            "having": [],
-            "intersect": None,
-            "limit": None,
-            "orderBy": [],
-            "select": [
-                False,
-                []
-            ],
-            "union": None,
-            "where": []
-            }
+        if record['parse_error']:
             eval_err_num += 1
-            print("eval_err_num:{}".format(eval_err_num))
-
-        # rebuild sql for value evaluation
-        kmap = kmaps[db_name]
-        g_valid_col_units = build_valid_col_units(g_sql['from']['table_units'], schema)
-        g_sql = rebuild_sql_val(g_sql)
-        g_sql = rebuild_sql_col(g_valid_col_units, g_sql, kmap)
-        p_valid_col_units = build_valid_col_units(p_sql['from']['table_units'], schema)
-        p_sql = rebuild_sql_val(p_sql)
-        p_sql = rebuild_sql_col(p_valid_col_units, p_sql, kmap)
+            if verbose:
+                print("eval_err_num:{}".format(eval_err_num))
 
         if etype in ["all", "exec"]:
-            exec_score = eval_exec_match(db, p_str, g_str, p_sql, g_sql)
+            exec_score = record['exec']
             if exec_score:
                 scores[hardness]['exec'] += 1.0
                 scores['all']['exec'] += 1.0
+            if record['exec_status'] == 'timeout':
+                scores[hardness]['exec_timeout'] += 1
+                scores['all']['exec_timeout'] += 1
+            elif record['exec_status'] == 'row_limit':
+                scores[hardness]['exec_row_limit'] += 1
+                scores['all']['exec_row_limit'] += 1
 
         if etype in ["all", "match"]:
-            exact_score = evaluator.eval_exact_match(p_sql, g_sql)
-            partial_scores = evaluator.partial_scores
-            if exact_score == 0:
+            exact_score = record['exact']
+            partial_scores = record['partial']
+            if exact_score == 0 and verbose:
                 print("{} pred: {}".format(hardness,p_str))
                 print("{} gold: {}".format(hardness,g_str))
                 print("")
@@ -574,14 +943,6 @@ def evaluate(gold, predict, db_dir, etype, kmaps):
                     scores['all']['partial'][type_]['rec_count'] += 1
                 scores['all']['partial'][type_]['f1'] += partial_scores[type_]['f1']
 
-            entries.append({
-                'predictSQL': p_str,
-                'goldSQL': g_str,
-                'hardness': hardness,
-                'exact': exact_score,
-                'partial': partial_scores
-            })
-
     for level in levels:
         if scores[level]['count'] == 0:
             continue
@@ -609,34 +970,67 @@ def evaluate(gold, predict, db_dir, etype, kmaps):
                         scores[level]['partial'][type_]['rec'] + scores[level]['partial'][type_]['acc'])
 
     print_scores(scores, etype)
+    if gold_cache and etype in ["all", "exec"]:
+        print('\n====================== GOLD RESULT CACHE ===========================')
+        print("{:20} {:<20d} {:<20d}".format("hits / misses", cache_stats['hits'], cache_stats['misses']))
 
+    if out is not None:
+        summary = {'type': 'summary', 'etype': etype, 'scores': scores, 'time': phase_time}
+        if gold_cache:
+            summary['gold_cache'] = cache_stats
+        out.write(json.dumps(summary, sort_keys=True) + '\n')
+        out.close()
 
-def eval_exec_match(db, p_str, g_str, pred, gold):
+    return scores, entries
+
+
+def eval_exec_match(db, p_str, g_str, pred, gold, gold_cache=None, timeout=EXEC_TIMEOUT, max_rows=EXEC_MAX_ROWS):
     """
     return 1 if the values between prediction and gold are matching
     in the corresponding index. Currently not support multiple col_unit(pairs).
+    gold results are served from gold_cache (a GoldResultCache) when given.
     """
-    conn = sqlite3.connect(db)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(p_str)
-        p_res = cursor.fetchall()
-    except:
-        return False
+    return exec_match_status(db, p_str, g_str, pred, gold, gold_cache, timeout, max_rows)[0]
 
-    cursor.execute(g_str)
-    q_res = cursor.fetchall()
 
-    def res_map(res, val_units):
-        rmap = {}
-        for idx, val_unit in enumerate(val_units):
-            key = tuple(val_unit[1]) if not val_unit[2] else (val_unit[0], tuple(val_unit[1]), tuple(val_unit[2]))
-            rmap[key] = [r[idx] for r in res]
-        return rmap
+def exec_match_status(db, p_str, g_str, pred, gold, gold_cache=None, timeout=EXEC_TIMEOUT, max_rows=EXEC_MAX_ROWS):
+    """
+    eval_exec_match returning (match, status), where status is one of
+    'ok', 'error' (prediction failed to execute), 'timeout' or 'row_limit'.
+    """
+    conn = get_connection(db)
+    try:
+        p_res = LimitedQuery(conn, p_str, timeout, max_rows)
+    except QueryTimeout:
+        return False, 'timeout'
+    except:
+        return False, 'error'
 
-    p_val_units = [unit[1] for unit in pred['select'][1]]
-    q_val_units = [unit[1] for unit in gold['select'][1]]
-    return res_map(p_res, p_val_units) == res_map(q_res, q_val_units)
+    # gold queries are trusted: bounded in time but never truncated
+    execute = lambda query: execute_with_limits(conn, query, timeout)
+    try:
+        if gold_cache is not None:
+            q_res = gold_cache.fetch(db, g_str, execute)
+        else:
+            q_res = execute(g_str)
+    except QueryTimeout:
+        p_res.close()
+        return False, 'timeout'
+
+    # row order only matters when the gold query asks for it
+    ordered = len(gold['orderBy']) > 0
+    p_columns = result_columns([unit[1] for unit in pred['select'][1]])
+    q_columns = result_columns([unit[1] for unit in gold['select'][1]])
+    try:
+        return compare_results(p_res.batches(), q_res, p_columns, q_columns, ordered), 'ok'
+    except QueryTimeout:
+        return False, 'timeout'
+    except RowLimitExceeded:
+        return False, 'row_limit'
+    except sqlite3.Error:
+        return False, 'error'
+    finally:
+        p_res.close()
 
 
 # Rebuild SQL functions for value evaluation
@@ -645,11 +1039,11 @@ def rebuild_cond_unit_val(cond_unit):
         return cond_unit
 
     not_op, op_id, val_unit, val1, val2 = cond_unit
-    if type(val1) is not dict:
+    if not isinstance(val1, SQLNode):
         val1 = None
     else:
         val1 = rebuild_sql_val(val1)
-    if type(val2) is not dict:
+    if not isinstance(val2, SQLNode):
         val2 = None
     else:
         val2 = rebuild_sql_val(val2)
@@ -666,21 +1060,22 @@ def rebuild_condition_val(condition):
             res.append(rebuild_cond_unit_val(it))
         else:
             res.append(it)
-    return res
+    return Seq(res)
 
 
 def rebuild_sql_val(sql):
+    """SQLNode sql with the values of its conditions dropped; sql itself is not modified"""
     if sql is None or not DISABLE_VALUE:
         return sql
 
-    sql['from']['conds'] = rebuild_condition_val(sql['from']['conds'])
-    sql['having'] = rebuild_condition_val(sql['having'])
-    sql['where'] = rebuild_condition_val(sql['where'])
-    sql['intersect'] = rebuild_sql_val(sql['intersect'])
-    sql['except'] = rebuild_sql_val(sql['except'])
-    sql['union'] = rebuild_sql_val(sql['union'])
-
-    return sql
+    return sql.replace({
+        'from': sql['from'].replace({'conds': rebuild_condition_val(sql['from']['conds'])}),
+        'having': rebuild_condition_val(sql['having']),
+        'where': rebuild_condition_val(sql['where']),
+        'intersect': rebuild_sql_val(sql['intersect']),
+        'except': rebuild_sql_val(sql['except']),
+        'union': rebuild_sql_val(sql['union']),
+    })
 
 
 # Rebuild SQL functions for foreign key evaluation
@@ -723,7 +1118,7 @@ def rebuild_table_unit_col(valid_col_units, table_unit, kmap):
     table_type, col_unit_or_sql = table_unit
     if isinstance(col_unit_or_sql, tuple):
         col_unit_or_sql = rebuild_col_unit_col(valid_col_units, col_unit_or_sql, kmap)
-    return table_type, col_unit_or_sql
+    return table_type, freeze(col_unit_or_sql)
 
 
 def rebuild_cond_unit_col(valid_col_units, cond_unit, kmap):
@@ -732,14 +1127,12 @@ def rebuild_cond_unit_col(valid_col_units, cond_unit, kmap):
 
     not_op, op_id, val_unit, val1, val2 = cond_unit
     val_unit = rebuild_val_unit_col(valid_col_units, val_unit, kmap)
-    return not_op, op_id, val_unit, val1, val2
+    return not_op, op_id, val_unit, freeze(val1), freeze(val2)
 
 
 def rebuild_condition_col(valid_col_units, condition, kmap):
-    for idx in range(len(condition)):
-        if idx % 2 == 0:
-            condition[idx] = rebuild_cond_unit_col(valid_col_units, condition[idx], kmap)
-    return condition
+    return Seq(rebuild_cond_unit_col(valid_col_units, it, kmap) if idx % 2 == 0 else it
+               for idx, it in enumerate(condition))
 
 
 def rebuild_select_col(valid_col_units, sel, kmap):
@@ -752,49 +1145,54 @@ def rebuild_select_col(valid_col_units, sel, kmap):
         new_list.append((agg_id, rebuild_val_unit_col(valid_col_units, val_unit, kmap)))
     if DISABLE_DISTINCT:
         distinct = None
-    return distinct, new_list
+    return distinct, Seq(new_list)
 
 
 def rebuild_from_col(valid_col_units, from_, kmap):
     if from_ is None:
         return from_
 
-    from_['table_units'] = [rebuild_table_unit_col(valid_col_units, table_unit, kmap) for table_unit in from_['table_units']]
-    from_['conds'] = rebuild_condition_col(valid_col_units, from_['conds'], kmap)
-    return from_
+    return record({
+        'table_units': Seq(rebuild_table_unit_col(valid_col_units, table_unit, kmap)
+                           for table_unit in from_['table_units']),
+        'conds': rebuild_condition_col(valid_col_units, from_['conds'], kmap),
+    })
 
 
 def rebuild_group_by_col(valid_col_units, group_by, kmap):
     if group_by is None:
         return group_by
 
-    return [rebuild_col_unit_col(valid_col_units, col_unit, kmap) for col_unit in group_by]
+    return Seq(rebuild_col_unit_col(valid_col_units, col_unit, kmap) for col_unit in group_by)
 
 
 def rebuild_order_by_col(valid_col_units, order_by, kmap):
     if order_by is None or len(order_by) == 0:
-        return order_by
+        return freeze(order_by)
 
     direction, val_units = order_by
-    new_val_units = [rebuild_val_unit_col(valid_col_units, val_unit, kmap) for val_unit in val_units]
+    new_val_units = Seq(rebuild_val_unit_col(valid_col_units, val_unit, kmap) for val_unit in val_units)
     return direction, new_val_units
 
 
 def rebuild_sql_col(valid_col_units, sql, kmap):
+    """SQLNode for a parsed sql dict, with foreign-key columns mapped through kmap"""
     if sql is None:
         return sql
 
-    sql['select'] = rebuild_select_col(valid_col_units, sql['select'], kmap)
-    sql['from'] = rebuild_from_col(valid_col_units, sql['from'], kmap)
-    sql['where'] = rebuild_condition_col(valid_col_units, sql['where'], kmap)
-    sql['groupBy'] = rebuild_group_by_col(valid_col_units, sql['groupBy'], kmap)
-    sql['orderBy'] = rebuild_order_by_col(valid_col_units, sql['orderBy'], kmap)
-    sql['having'] = rebuild_condition_col(valid_col_units, sql['having'], kmap)
-    sql['intersect'] = rebuild_sql_col(valid_col_units, sql['intersect'], kmap)
-    sql['except'] = rebuild_sql_col(valid_col_units, sql['except'], kmap)
-    sql['union'] = rebuild_sql_col(valid_col_units, sql['union'], kmap)
-
-    return sql
+    clauses = {
+        'select': rebuild_select_col(valid_col_units, sql['select'], kmap),
+        'from': rebuild_from_col(valid_col_units, sql['from'], kmap),
+        'where': rebuild_condition_col(valid_col_units, sql['where'], kmap),
+        'groupBy': rebuild_group_by_col(valid_col_units, sql['groupBy'], kmap),
+        'orderBy': rebuild_order_by_col(valid_col_units, sql['orderBy'], kmap),
+        'having': rebuild_condition_col(valid_col_units, sql['having'], kmap),
+        'intersect': rebuild_sql_col(valid_col_units, sql['intersect'], kmap),
+        'except': rebuild_sql_col(valid_col_units, sql['except'], kmap),
+        'union': rebuild_sql_col(valid_col_units, sql['union'], kmap),
+        'limit': sql['limit'],
+    }
+    return SQLNode(clauses[key] for key in SQL_KEYS)
 
 
 def build_foreign_key_map(entry):
@@ -853,6 +1251,20 @@ if __name__ == "__main__":
     parser.add_argument('--db', dest='db', type=str)
     parser.add_argument('--table', dest='table', type=str)
     parser.add_argument('--etype', dest='etype', type=str)
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1,
+                        help='number of worker processes; examples are sharded by db_id')
+    parser.add_argument('--gold_cache', dest='gold_cache', type=str, default=None,
+                        help='sqlite file caching gold execution results across runs')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=EXEC_TIMEOUT,
+                        help='wall-clock limit in seconds for executing a single query')
+    parser.add_argument('--max_rows', dest='max_rows', type=int, default=EXEC_MAX_ROWS,
+                        help='maximum number of rows fetched from a predicted query')
+    parser.add_argument('--output', dest='output', type=str, default=None,
+                        help='JSONL file receiving per-example records and a final summary line')
+    parser.add_argument('--quiet', dest='verbose', action='store_false',
+                        help='do not print mismatched examples')
+    parser.add_argument('--parse_cache', dest='parse_cache', type=str, default=None,
+                        help='sqlite file caching parsed SQL across runs')
     args = parser.parse_args()
 
     gold = args.gold
@@ -863,6 +1275,7 @@ if __name__ == "__main__":
 
     assert etype in ["all", "exec", "match"], "Unknown evaluation method"
 
-    kmaps = build_foreign_key_map_from_json(table)
+    kmaps = load_catalog(table).foreign_key_maps()
 
-    evaluate(gold, pred, db_dir, etype, kmaps)
+    evaluate(gold, pred, db_dir, etype, kmaps, args.jobs, args.gold_cache, args.timeout, args.max_rows,
+             args.output, args.verbose, args.parse_cache)
@@ -1,35 +1,44 @@
+from __future__ import print_function
 import os
 import sys
 import json
+import time
 import sqlite3
+import hashlib
+import argparse
+import traceback
+from multiprocessing import Pool
 from os import listdir, makedirs
 from os.path import isfile, isdir, join, split, exists, splitext
-from nltk import word_tokenize, tokenize
-import traceback
 
 EXIST = {"atis", "geo", "advising", "yelp", "restaurants", "imdb", "academic"}
 
+# Read size of the chunks hashed when a database file's mtime has changed
+HASH_CHUNK_SIZE = 1 << 20
+
 def convert_fk_index(data):
+    """Turn (table, column) foreign key pairs into column index pairs"""
+    tab_ids = {}
+    for i, tab in enumerate(data['table_names_original']):
+        tab_ids.setdefault(tab, i)
+    col_ids = {}
+    for i, (tab_id, col_org) in enumerate(data['column_names_original']):
+        col_ids[(tab_id, col_org)] = i
+
     fk_holder = []
     for fk in data["foreign_keys"]:
         tn, col, ref_tn, ref_col = fk[0][0], fk[0][1], fk[1][0], fk[1][1]
-        ref_cid, cid = None, None
-        try:
-            tid = data['table_names_original'].index(tn)
-            ref_tid = data['table_names_original'].index(ref_tn)
-
-            for i, (tab_id, col_org) in enumerate(data['column_names_original']):
-                if tab_id == ref_tid and ref_col == col_org:
-                    ref_cid = i
-                elif tid == tab_id and col == col_org:
-                    cid = i
-            if ref_cid and cid:
-                fk_holder.append([cid, ref_cid])
-        except:
-	    traceback.print_exc()
-            print "table_names_original: ", data['table_names_original']
-            print "finding tab name: ", tn, ref_tn
-            sys.exit()
+        if tn not in tab_ids or ref_tn not in tab_ids:
+            print("table_names_original: ", data['table_names_original'])
+            print("finding tab name: ", tn, ref_tn)
+            raise ValueError("Unknown table in foreign key of {}: {}".format(data['db_id'], fk))
+        tid, ref_tid = tab_ids[tn], tab_ids[ref_tn]
+        if tid == ref_tid and col == ref_col:
+            continue
+        ref_cid = col_ids.get((ref_tid, ref_col))
+        cid = col_ids.get((tid, col))
+        if ref_cid and cid:
+            fk_holder.append([cid, ref_cid])
     return fk_holder
 
 
@@ -56,7 +65,7 @@ def dump_db_json_schema(db, f):
         data['table_names'].append(table_name.lower().replace("_", ' '))
         fks = conn.execute("PRAGMA foreign_key_list('{}') ".format(table_name)).fetchall()
         #print("db:{} table:{} fks:{}".format(f,table_name,fks))
-	fk_holder.extend([[(table_name, fk[3]), (fk[2], fk[4])] for fk in fks])
+        fk_holder.extend([[(table_name, fk[3]), (fk[2], fk[4])] for fk in fks])
         cur = conn.execute("PRAGMA table_info('{}') ".format(table_name))
         for j, col in enumerate(cur.fetchall()):
             data['column_names_original'].append((i, col[1]))
@@ -84,13 +93,92 @@ def dump_db_json_schema(db, f):
     return data
 
 
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def stamps_path(output_file):
+    """Sidecar recording which database file each entry of output_file was built from"""
+    return output_file + '.stamps'
+
+
+def load_previous(output_file):
+    """Entries and stamps of the previous run, keyed by db_id ({} when there is none)"""
+    try:
+        with open(output_file) as f:
+            tables = dict((tab['db_id'], tab) for tab in json.load(f))
+        with open(stamps_path(output_file)) as f:
+            stamps = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}, {}
+    return tables, stamps
+
+
+def inherited_hash(ex_tab):
+    """Fingerprint of the hand-corrected names an entry inherits"""
+    if ex_tab is None:
+        return None
+    return hashlib.sha1(json.dumps([ex_tab["table_names"], ex_tab["column_names"]],
+                                   sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def current_stamp(db, prev_stamp, ex_tab):
+    """Stamp of a database file; the file is only hashed when its size or mtime changed"""
+    stat = os.stat(db)
+    stamp = {'size': stat.st_size, 'mtime': stat.st_mtime, 'inherited': inherited_hash(ex_tab)}
+    if prev_stamp and prev_stamp['size'] == stat.st_size and prev_stamp['mtime'] == stat.st_mtime:
+        stamp['sha1'] = prev_stamp['sha1']
+    else:
+        stamp['sha1'] = file_hash(db)
+    return stamp
+
+
+def unchanged(stamp, prev_stamp):
+    return prev_stamp is not None and all(stamp[key] == prev_stamp.get(key) for key in ('sha1', 'inherited'))
+
+
+def dump_db_task(task):
+    """Pool worker: read one database, returns (db_id, table, seconds)"""
+    db, df = task
+    start = time.time()
+    table = dump_db_json_schema(db, df)
+    return df, table, time.time() - start
+
+
+def inherit_names(table, ex_tab):
+    """Use the hand-corrected names of the existing tables.json when the structure still matches"""
+    if ex_tab is None:
+        return False
+    prev_tab_num = len(ex_tab["table_names"])
+    prev_col_num = len(ex_tab["column_names"])
+    cur_tab_num = len(table["table_names"])
+    cur_col_num = len(table["column_names"])
+    if prev_tab_num == cur_tab_num and prev_col_num == cur_col_num and prev_tab_num != 0 and prev_col_num > 1:
+        table["table_names"] = ex_tab["table_names"]
+        table["column_names"] = ex_tab["column_names"]
+        return True
+    return False
+
+
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print "Usage: python get_tables.py [dir includes many subdirs containing database.sqlite files] [output file name e.g. output.json] [existing tables.json file to be inherited]"
-        sys.exit()
-    input_dir = sys.argv[1]
-    output_file = sys.argv[2]
-    ex_tab_file = sys.argv[3]
+    parser = argparse.ArgumentParser(
+        usage="python get_tables.py [dir includes many subdirs containing database.sqlite files] "
+              "[output file name e.g. output.json] [existing tables.json file to be inherited]")
+    parser.add_argument('input_dir')
+    parser.add_argument('output_file')
+    parser.add_argument('ex_tab_file')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes reading databases')
+    parser.add_argument('--force', action='store_true',
+                        help='re-read every database, even if unchanged since the previous output')
+    args = parser.parse_args()
+    input_dir = args.input_dir
+    output_file = args.output_file
+    ex_tab_file = args.ex_tab_file
 
     all_fs = [df for df in listdir(input_dir) if exists(join(input_dir, df, df+'.sqlite'))]
     with open(ex_tab_file) as f:
@@ -98,29 +186,46 @@ if __name__ == '__main__':
         #for tab in ex_tabs:
         #    tab["foreign_keys"] = convert_fk_index(tab)
         ex_tabs = {tab["db_id"]: tab for tab in ex_tabs if tab["db_id"] in all_fs}
-        print "precessed file num: ", len(ex_tabs)
+        print("precessed file num: ", len(ex_tabs))
     not_fs = [df for df in listdir(input_dir) if not exists(join(input_dir, df, df+'.sqlite'))]
     for d in not_fs:
-        print "no sqlite file found in: ", d
-    db_files = [(df+'.sqlite', df) for df in listdir(input_dir) if exists(join(input_dir, df, df+'.sqlite'))]
-    tables = []
+        print("no sqlite file found in: ", d)
+    db_files = [(df+'.sqlite', df) for df in all_fs]
+
+    start = time.time()
+    prev_tables, prev_stamps = ({}, {}) if args.force else load_previous(output_file)
+    tables = {}
+    stamps = {}
+    tasks = []
     for f, df in db_files:
-        #if df in ex_tabs.keys():
-            #print 'reading old db: ', df
-        #    tables.append(ex_tabs[df])
         db = join(input_dir, df, f)
-        print '\nreading new db: ', df
-        table = dump_db_json_schema(db, df)
-        prev_tab_num = len(ex_tabs[df]["table_names"])
-        prev_col_num = len(ex_tabs[df]["column_names"])
-        cur_tab_num = len(table["table_names"])
-        cur_col_num = len(table["column_names"])
-        if df in ex_tabs.keys() and prev_tab_num == cur_tab_num and prev_col_num == cur_col_num and prev_tab_num != 0 and len(ex_tabs[df]["column_names"]) > 1:
-            table["table_names"] = ex_tabs[df]["table_names"]
-            table["column_names"] = ex_tabs[df]["column_names"]
+        stamps[df] = current_stamp(db, prev_stamps.get(df), ex_tabs.get(df))
+        if df in prev_tables and unchanged(stamps[df], prev_stamps.get(df)):
+            tables[df] = prev_tables[df]
         else:
-            print "\n----------------------------------problem db: ", df
-        tables.append(table)
-    print "final db num: ", len(tables)
+            tasks.append((db, df))
+    print("unchanged db num: ", len(tables), ", db num to read: ", len(tasks))
+
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = Pool(min(args.jobs, len(tasks)))
+        results = pool.imap_unordered(dump_db_task, tasks)
+    else:
+        pool = None
+        results = (dump_db_task(task) for task in tasks)
+    try:
+        for df, table, elapsed in results:
+            print('read db: {} ({} tables, {:.3f}s)'.format(df, len(table["table_names"]), elapsed))
+            if not inherit_names(table, ex_tabs.get(df)):
+                print("\n----------------------------------problem db: ", df)
+            tables[df] = table
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    tables = [tables[df] for f, df in db_files]
+    print("final db num: ", len(tables), ", total {:.3f}s".format(time.time() - start))
     with open(output_file, 'wt') as out:
-        json.dump(tables, out, sort_keys=True, indent=2, separators=(',', ': '))
\ No newline at end of file
+        json.dump(tables, out, sort_keys=True, indent=2, separators=(',', ': '))
+    with open(stamps_path(output_file), 'wt') as out:
+        json.dump(stamps, out, sort_keys=True, indent=2, separators=(',', ': '))
@@ -3,7 +3,10 @@ import json
 import sqlite3
 import traceback
 import argparse
+from itertools import islice
+from multiprocessing import Pool
 from process_sql import get_sql
+from schema_catalog import SchemaCatalog, load_catalog
 
 
 #TODO: update the following dirs
@@ -12,86 +15,131 @@ db_dir = 'database/'
 output_file = 'dev_new.json'
 table_file = 'spider/tables.json'
 
+# Characters read at a time when streaming the input file
+JSON_CHUNK_SIZE = 1 << 20
+# Examples handed to the worker pool at a time, bounds memory in streaming mode
+WINDOW_SIZE = 10000
+
+
+def iter_json_array(f, chunk_size=JSON_CHUNK_SIZE):
+    """Yield the objects of a JSON array, or of a JSONL file, one at a time without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,[]':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            buf = f.read(chunk_size)
+            pos = 0
+            eof = not buf
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            more = '' if eof else f.read(chunk_size)
+            if not more:
+                raise
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield obj
+        pos = end
+
+
+def parse_example(catalog, data):
+    """Returns (example with its parsed "sql", None) or (None, failure record)"""
+    db_id = data.get("db_id")
+    sql = data.get("query")
+    try:
+        data["sql"] = get_sql(catalog.index_schema(db_id), sql)
+        return data, None
+    except Exception as e:
+        return None, {'db_id': db_id, 'query': sql, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+# Catalog opened once per worker process; it caches the Schema of every db it has seen
+_catalog = None
+
+
+def init_worker(path):
+    global _catalog
+    _catalog = SchemaCatalog(path)
+
+
+def parse_window(window):
+    return [(idx,) + parse_example(_catalog, data) for idx, data in window]
+
+
+def parse_all(examples, catalog, jobs=1):
+    """Yield (index, example or None, failure or None) in input order"""
+    examples = enumerate(examples)
+    if jobs <= 1:
+        for idx, data in examples:
+            yield (idx,) + parse_example(catalog, data)
+        return
 
-class Schema:
-    """
-    Simple schema which maps table&column to a unique identifier
-    """
-    def __init__(self, schema, table):
-        self._schema = schema
-        self._table = table
-        self._idMap = self._map(self._schema, self._table)
-
-    @property
-    def schema(self):
-        return self._schema
-
-    @property
-    def idMap(self):
-        return self._idMap
-
-    def _map(self, schema, table):
-        column_names_original = table['column_names_original']
-        table_names_original = table['table_names_original']
-        #print 'column_names_original: ', column_names_original
-        #print 'table_names_original: ', table_names_original
-        for i, (tab_id, col) in enumerate(column_names_original):
-            if tab_id == -1:
-                idMap = {'*': i}
-            else:
-                key = table_names_original[tab_id].lower()
-                val = col.lower()
-                idMap[key + "." + val] = i
-
-        for i, tab in enumerate(table_names_original):
-            key = tab.lower()
-            idMap[key] = i
-
-        return idMap
-    
-
-def get_schemas_from_json(fpath):
-    with open(fpath) as f:
-        data = json.load(f)
-    db_names = [db['db_id'] for db in data]
-
-    tables = {}
-    schemas = {}
-    for db in data:
-        db_id = db['db_id']
-        schema = {} #{'table': [col.lower, ..., ]} * -> __all__
-        column_names_original = db['column_names_original']
-        table_names_original = db['table_names_original']
-        tables[db_id] = {'column_names_original': column_names_original, 'table_names_original': table_names_original}
-        for i, tabn in enumerate(table_names_original):
-            table = str(tabn.lower())
-            cols = [str(col.lower()) for td, col in column_names_original if td == i]
-            schema[table] = cols
-        schemas[db_id] = schema
-
-    return schemas, db_names, tables
-
-
-
-schemas, db_names, tables = get_schemas_from_json(table_file)
-
-with open(sql_path) as inf:
-    sql_data = json.load(inf)
-
-sql_data_new = []
-for data in sql_data:
+    pool = Pool(jobs, init_worker, (catalog.path,))
     try:
-        db_id = data["db_id"]
-        schema = schemas[db_id]
-        table = tables[db_id]
-        schema = Schema(schema, table)
-        sql = data["query"]
-        sql_label = get_sql(schema, sql)
-        data["sql"] = sql_label
-        sql_data_new.append(data)
-    except:
-        print("db_id: ", db_id)
-        print("sql: ", sql)
-        
-with open(output_file, 'wt') as out:
-    json.dump(sql_data_new, out, sort_keys=True, indent=4, separators=(',', ': '))
\ No newline at end of file
+        while True:
+            window = list(islice(examples, WINDOW_SIZE))
+            if not window:
+                break
+            chunks = [window[i::jobs] for i in range(jobs)]
+            results = [res for chunk in pool.map(parse_window, chunks) for res in chunk]
+            for res in sorted(results, key=lambda res: res[0]):
+                yield res
+    except BaseException:
+        # a failed worker or a consumer that stopped early: drop the queued work instead of waiting for it
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sql_path', default=sql_path, help='examples to parse (JSON array, or JSONL with --stream)')
+    parser.add_argument('--table_file', default=table_file)
+    parser.add_argument('--output', default=output_file)
+    parser.add_argument('--stream', action='store_true',
+                        help='read the input incrementally and write one JSON example per line')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes parsing queries')
+    parser.add_argument('--failures', default=None,
+                        help='JSONL file receiving the examples that fail to parse (default [output].failures)')
+    args = parser.parse_args()
+    failures_path = args.failures or args.output + '.failures'
+
+    catalog = load_catalog(args.table_file)
+
+    with open(args.sql_path) as inf:
+        if args.stream:
+            sql_data = iter_json_array(inf)
+        else:
+            sql_data = json.load(inf)
+
+        sql_data_new = []
+        num_ok = num_failed = 0
+        with open(args.output, 'wt') as out, open(failures_path, 'wt') as fail_out:
+            for idx, data, failure in parse_all(sql_data, catalog, args.jobs):
+                if failure is not None:
+                    num_failed += 1
+                    print("db_id: ", failure['db_id'])
+                    print("sql: ", failure['query'])
+                    failure['index'] = idx
+                    fail_out.write(json.dumps(failure, sort_keys=True) + '\n')
+                    continue
+                num_ok += 1
+                if args.stream:
+                    out.write(json.dumps(data, sort_keys=True) + '\n')
+                else:
+                    sql_data_new.append(data)
+            if not args.stream:
+                json.dump(sql_data_new, out, sort_keys=True, indent=4, separators=(',', ': '))
+
+    print("parsed: {}, failed: {} (see {})".format(num_ok, num_failed, failures_path))
@@ -24,9 +24,14 @@
 # }
 ################################
 
+import re
 import json
+import pickle
+import atexit
+import hashlib
 import sqlite3
-from nltk import word_tokenize
+import threading
+from collections import OrderedDict
 
 CLAUSE_KEYWORDS = ('select', 'from', 'where', 'group', 'order', 'limit', 'intersect', 'union', 'except')
 JOIN_KEYWORDS = ('join', 'on', 'as')
@@ -43,15 +48,37 @@ COND_OPS = ('and', 'or')
 SQL_OPS = ('intersect', 'union', 'except')
 ORDER_OPS = ('desc', 'asc')
 
+# SQL lexer reproducing the token boundaries of NLTK's word_tokenize on SQL text.
+# Characters that are always tokens of their own (incl. unicode quotes and dashes)
+SPLIT_CHARS = r';@#$%&?!*()\[\]{}<>\u00ab\u201c\u2018\u201e\u00bb\u201d\u2019\u2012-\u2015'
+TOKEN_RE = re.compile(
+    r'(?P<space>\s+)'
+    r'|(?P<val>"[^"]*")'
+    r'|(?P<punct>\.{{2,}}|--|``|`|[{split}]|[,:](?!\d))'
+    r'|(?P<word>(?:[^\s"`.,:\-{split}]|[,:](?=\d)|\.(?!\.)|-(?!-))+)'.format(split=SPLIT_CHARS),
+    re.UNICODE)
+# A final period is split off when only closing brackets and spaces follow it
+FINAL_PERIOD_RE = re.compile(r'[^.]\.[\])}>\u00bb\u201d\u2019 ]*\s*$')
+CLOSERS = (')', ']', '}', '>', u'\u00bb', u'\u201d', u'\u2019')
+# Words split in two by NLTK (can|not, gim|me, ...)
+CONTRACTION_RE = re.compile(r'\b(can)(not)\b|\b(gim)(me)\b|\b(gon)(na)\b|\b(got)(ta)\b|\b(lem)(me)\b|\b(wan)(na)$')
+CONTRACTION_PREFIXES = ('can', 'gim', 'gon', 'got', 'lem', 'wan')
+
+# Number of parsed queries kept in memory by get_sql
+PARSE_CACHE_SIZE = 10000
+# Writes to the on-disk parse cache between commits
+PARSE_CACHE_COMMIT_EVERY = 256
+WHITESPACE_RE = re.compile(r'\s+')
 
 
 class Schema:
     """
     Simple schema which maps table&column to a unique identifier
+    A precomputed idMap (e.g. from schema_catalog) skips building it.
     """
-    def __init__(self, schema):
+    def __init__(self, schema, idMap=None):
         self._schema = schema
-        self._idMap = self._map(self._schema)
+        self._idMap = idMap if idMap is not None else self._map(self._schema)
 
     @property
     def schema(self):
@@ -97,6 +124,7 @@ def get_schema(db):
         cursor.execute("PRAGMA table_info({})".format(table))
         schema[table] = [str(col[1].lower()) for col in cursor.fetchall()]
 
+    conn.close()
     return schema
 
 
@@ -116,35 +144,60 @@ def get_schema_from_json(fpath):
 def tokenize(string):
     string = str(string)
     string = string.replace("\'", "\"")  # ensures all string values wrapped by "" problem??
-    quote_idxs = [idx for idx, char in enumerate(string) if char == '"']
-    assert len(quote_idxs) % 2 == 0, "Unexpected quote"
+    assert string.count('"') % 2 == 0, "Unexpected quote"
 
-    # keep string value as token
+    # single pass over the string; string values are kept as one token, and a
+    # value glued to other characters becomes a placeholder inside that token
     vals = {}
-    for i in range(len(quote_idxs)-1, -1, -2):
-        qidx1 = quote_idxs[i-1]
-        qidx2 = quote_idxs[i]
-        val = string[qidx1: qidx2+1]
-        key = "__val_{}_{}__".format(qidx1, qidx2)
-        string = string[:qidx1] + key + string[qidx2+1:]
-        vals[key] = val
-
-    toks = [word.lower() for word in word_tokenize(string)]
-    # replace with string value token
-    for i in range(len(toks)):
-        if toks[i] in vals:
-            toks[i] = vals[toks[i]]
-
-    # find if there exists !=, >=, <=
-    eq_idxs = [idx for idx, tok in enumerate(toks) if tok == "="]
-    eq_idxs.reverse()
+    toks = []
+    pieces = []
+    for match in TOKEN_RE.finditer(string):
+        kind = match.lastgroup
+        if kind == 'word':
+            pieces.append(match.group())
+        elif kind == 'val':
+            key = "__val_{}_{}__".format(match.start(), match.end() - 1)
+            vals[key] = match.group()
+            pieces.append(key)
+        else:
+            if pieces:
+                toks.append(''.join(pieces))
+                pieces = []
+            if kind == 'punct':
+                toks.append(match.group())
+    if pieces:
+        toks.append(''.join(pieces))
+
+    # split off a final period, possibly followed by closing brackets
+    if FINAL_PERIOD_RE.search(string):
+        last = len(toks) - 1
+        while toks[last] in CLOSERS:
+            last -= 1
+        if len(toks[last]) > 1:
+            toks[last:last+1] = [toks[last][:-1], '.']
+
+    lowered = string.lower()
+    split_contractions = any(prefix in lowered for prefix in CONTRACTION_PREFIXES)
+    result = []
     prefix = ('!', '>', '<')
-    for eq_idx in eq_idxs:
-        pre_tok = toks[eq_idx-1]
-        if pre_tok in prefix:
-            toks = toks[:eq_idx-1] + [pre_tok + "="] + toks[eq_idx+1: ]
-
-    return toks
+    for tok in toks:
+        if tok in vals:
+            result.append(vals[tok])
+            continue
+        tok = tok.lower()
+        if split_contractions and CONTRACTION_RE.search(tok):
+            words = CONTRACTION_RE.sub(lambda m: ' ' + ' '.join(g for g in m.groups() if g) + ' ', tok).split()
+        else:
+            words = [tok]
+        for word in words:
+            if word in vals:
+                result.append(vals[word])
+            # merge !=, >=, <=
+            elif word == '=' and result and result[-1] in prefix:
+                result[-1] += '='
+            else:
+                result.append(word)
+    return result
 
 
 def scan_alias(toks):
@@ -547,7 +600,7 @@ def load_data(fpath):
     return data
 
 
-def get_sql(schema, query):
+def parse_query(schema, query):
     toks = tokenize(query)
     tables_with_alias = get_tables_with_alias(schema.schema, toks)
     _, sql = parse_sql(toks, 0, tables_with_alias, schema)
@@ -555,6 +608,121 @@ def get_sql(schema, query):
     return sql
 
 
+def schema_key(schema):
+    """Stable fingerprint of a schema's tables and id map, computed once per schema object"""
+    key = getattr(schema, '_parse_key', None)
+    if key is None:
+        content = json.dumps([schema.schema, schema.idMap], sort_keys=True)
+        key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        schema._parse_key = key
+    return key
+
+
+def normalize_query(query):
+    """Query with quotes unified and whitespace outside string values collapsed, as tokenize sees it"""
+    query = str(query).replace("\'", "\"").strip()
+    if '"' not in query:
+        return ' '.join(query.split())
+    parts = query.split('"')
+    parts[::2] = [WHITESPACE_RE.sub(' ', part) for part in parts[::2]]
+    return '"'.join(parts)
+
+
+class ParseCache:
+    """On-disk store of parse results keyed by (schema fingerprint, normalized query)"""
+    def __init__(self, path):
+        # used from whichever thread calls get_sql, always under _parse_lock
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS parses '
+                          '(schema_key TEXT, query TEXT, ok INTEGER, result BLOB, PRIMARY KEY (schema_key, query))')
+        self.conn.commit()
+        self.pending = 0
+
+    def get(self, key):
+        row = self.conn.execute('SELECT ok, result FROM parses WHERE schema_key = ? AND query = ?', key).fetchone()
+        if row is None:
+            return None
+        return bool(row[0]), bytes(row[1])
+
+    def put(self, key, entry):
+        self.conn.execute('INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?)',
+                          key + (int(entry[0]), sqlite3.Binary(entry[1])))
+        self.pending += 1
+        if self.pending >= PARSE_CACHE_COMMIT_EVERY:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+_parse_memo = OrderedDict()
+# get_sql runs on request threads in app_integrated; guards the memo and the disk cache
+_parse_lock = threading.Lock()
+_parse_disk = {'cache': None}
+
+
+def set_parse_cache(path):
+    """Use the on-disk parse cache at path for get_sql (None to stop using one)"""
+    close_parse_cache()
+    if path:
+        with _parse_lock:
+            _parse_disk['cache'] = ParseCache(path)
+
+
+@atexit.register
+def close_parse_cache():
+    with _parse_lock:
+        if _parse_disk['cache'] is not None:
+            _parse_disk['cache'].close()
+            _parse_disk['cache'] = None
+
+
+def _remember_parse(key, entry):
+    # callers hold _parse_lock
+    _parse_memo[key] = entry
+    if len(_parse_memo) > PARSE_CACHE_SIZE:
+        _parse_memo.popitem(last=False)
+
+
+def get_sql(schema, query):
+    """Parse query against schema, memoized by (schema fingerprint, normalized query)
+
+    Parse results (and parse errors) are kept pickled, so the memo is never
+    affected by callers that modify the returned tree; each call returns a
+    fresh copy. Results are also read from and written to the on-disk cache
+    set with set_parse_cache. Safe to call from several threads; parsing
+    itself runs outside the lock.
+    """
+    query = normalize_query(query)
+    key = (schema_key(schema), query)
+    with _parse_lock:
+        # pop and reinsert marks the entry as most recently used (move_to_end is python 3 only)
+        entry = _parse_memo.pop(key, None)
+        if entry is None:
+            disk = _parse_disk['cache']
+            entry = disk.get(key) if disk is not None else None
+        if entry is not None:
+            _remember_parse(key, entry)
+    if entry is None:
+        try:
+            entry = (True, pickle.dumps(parse_query(schema, query), pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            entry = (False, pickle.dumps(e, pickle.HIGHEST_PROTOCOL))
+        with _parse_lock:
+            disk = _parse_disk['cache']
+            if disk is not None:
+                disk.put(key, entry)
+            _remember_parse(key, entry)
+
+    ok, blob = entry
+    if ok:
+        return pickle.loads(blob)
+    raise pickle.loads(blob)
+
+
 def skip_semicolon(toks, start_idx):
     idx = start_idx
     while idx < len(toks) and toks[idx] == ";":
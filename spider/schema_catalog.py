@@ -0,0 +1,288 @@
+################################
+# Compiled schema catalog built once from tables.json
+#
+# Per db_id the catalog holds everything evaluation, preprocessing and the
+# app otherwise rebuild from tables.json on every start:
+#   entry         the tables.json entry itself
+#   schema        {table: [column, ...]} (lower case, process_sql format)
+#   name_map      process_sql.Schema idMap ('t.c' -> '__t.c__')
+#   index_map     idMap with tables.json indexes ('t.c' -> column index, 't' -> table index)
+#   fk_map        foreign key map used by evaluation ('__t.c__' -> '__t.c__' of the class root)
+#   fk_classes    foreign key equivalence classes as sorted column indexes
+#   column_index  {column: [column index, ...]}
+#   table_index   {table: table index}
+#
+# File layout: MAGIC, 8-byte little-endian length of the header, the pickled
+# header ({'source': (size, mtime), 'dbs': {db_id: {field: (offset, length)}}}),
+# then one pickled blob per field of each database. The file is memory-mapped
+# and a field is only unpickled the first time it is asked for, so reading the
+# foreign key maps does not pay for decoding the full tables.json entries.
+################################
+
+import os
+import json
+import mmap
+import pickle
+import struct
+import hashlib
+import tempfile
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from process_sql import Schema
+
+MAGIC = b'SPCAT01\n'
+HEADER_LEN = struct.Struct('<Q')
+PICKLE_PROTOCOL = 2
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def source_info(tables_json):
+    """(size, mtime) of tables.json, recorded in the catalog to detect staleness"""
+    stat = os.stat(tables_json)
+    return stat.st_size, stat.st_mtime
+
+
+def catalog_path(tables_json):
+    """Default catalog location, next to tables.json"""
+    return os.path.splitext(tables_json)[0] + '.catalog'
+
+
+def _foreign_key_classes(entry):
+    """Foreign key equivalence classes, merged the way evaluation always has"""
+    key_sets = []
+    for key1, key2 in entry['foreign_keys']:
+        for key_set in key_sets:
+            if key1 in key_set or key2 in key_set:
+                break
+        else:
+            key_set = set()
+            key_sets.append(key_set)
+        key_set.add(key1)
+        key_set.add(key2)
+    return [sorted(key_set) for key_set in key_sets]
+
+
+def compile_entry(entry):
+    """Catalog record for one tables.json entry"""
+    tables = [tab.lower() for tab in entry['table_names_original']]
+    columns = entry['column_names_original']
+
+    schema = dict((tab, []) for tab in tables)
+    index_map = {}
+    column_index = {}
+    col_ids = []
+    for idx, (tab_id, col) in enumerate(columns):
+        col = col.lower()
+        column_index.setdefault(col, []).append(idx)
+        if tab_id < 0:
+            index_map['*'] = idx
+            col_ids.append('__all__')
+            continue
+        schema[tables[tab_id]].append(col)
+        index_map[tables[tab_id] + '.' + col] = idx
+        col_ids.append('__' + tables[tab_id] + '.' + col + '__')
+    table_index = {}
+    for idx, tab in enumerate(tables):
+        index_map[tab] = idx
+        table_index[tab] = idx
+
+    fk_classes = _foreign_key_classes(entry)
+    fk_map = {}
+    for key_set in fk_classes:
+        for idx in key_set:
+            fk_map[col_ids[idx]] = col_ids[key_set[0]]
+
+    return {
+        'entry': entry,
+        'schema': schema,
+        'name_map': Schema(schema).idMap,
+        'index_map': index_map,
+        'fk_map': fk_map,
+        'fk_classes': fk_classes,
+        'column_index': column_index,
+        'table_index': table_index,
+    }
+
+
+def compile_catalog(tables_json, path=None):
+    """Compile tables.json into a catalog file and return its path
+
+    The file is written to a temporary name and renamed into place, so
+    readers never see a partial catalog.
+    """
+    path = path or catalog_path(tables_json)
+    source = source_info(tables_json)
+    with open(tables_json) as f:
+        data = json.load(f)
+
+    blobs = []
+    dbs = {}
+    offset = 0
+    for entry in data:
+        fields = dbs[entry['db_id']] = {}
+        for field, value in sorted(compile_entry(entry).items()):
+            blob = pickle.dumps(value, PICKLE_PROTOCOL)
+            fields[field] = (offset, len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+    header = pickle.dumps({'source': source, 'dbs': dbs}, PICKLE_PROTOCOL)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER_LEN.pack(len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        os.chmod(tmp, 0o644)
+        _replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+class SchemaCatalog(object):
+    """Read-only, memory-mapped view of a compiled catalog"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError("Not a schema catalog: {}".format(path))
+        start = len(MAGIC) + HEADER_LEN.size
+        header_len, = HEADER_LEN.unpack(self._mm[len(MAGIC):start])
+        header = pickle.loads(self._mm[start:start + header_len])
+        self.source = tuple(header['source'])
+        self._dbs = header['dbs']
+        self._base = start + header_len
+        self._fields = {}
+        self._schemas = {}
+
+    def __contains__(self, db_id):
+        return db_id in self._dbs
+
+    def __len__(self):
+        return len(self._dbs)
+
+    def db_ids(self):
+        """Database ids in tables.json order"""
+        return sorted(self._dbs, key=lambda db_id: self._dbs[db_id]['entry'][0])
+
+    def field(self, db_id, name):
+        """One field of a database record (see the top of this file), unpickled once"""
+        key = (db_id, name)
+        try:
+            return self._fields[key]
+        except KeyError:
+            pass
+        offset, length = self._dbs[db_id][name]
+        start = self._base + offset
+        value = self._fields[key] = pickle.loads(self._mm[start:start + length])
+        return value
+
+    def record(self, db_id):
+        """Full catalog record of a database"""
+        return dict((name, self.field(db_id, name)) for name in self._dbs[db_id])
+
+    def entry(self, db_id):
+        """The tables.json entry of a database"""
+        return self.field(db_id, 'entry')
+
+    def entries(self):
+        """All tables.json entries, in file order"""
+        return [self.entry(db_id) for db_id in self.db_ids()]
+
+    def schema(self, db_id):
+        """process_sql.Schema with the precomputed name id map"""
+        return self._schema(db_id, 'name_map')
+
+    def index_schema(self, db_id):
+        """process_sql.Schema whose idMap gives tables.json indexes (preprocess format)"""
+        return self._schema(db_id, 'index_map')
+
+    def _schema(self, db_id, kind):
+        key = (db_id, kind)
+        schema = self._schemas.get(key)
+        if schema is None:
+            schema = self._schemas[key] = Schema(self.field(db_id, 'schema'), self.field(db_id, kind))
+        return schema
+
+    def foreign_key_map(self, db_id):
+        return self.field(db_id, 'fk_map')
+
+    def foreign_key_maps(self):
+        """Mapping db_id -> foreign key map, decoding each database on first access"""
+        return ForeignKeyMaps(self)
+
+    def close(self):
+        self._fields.clear()
+        self._schemas.clear()
+        self._mm.close()
+
+
+class ForeignKeyMaps(Mapping):
+    """Lazy {db_id: foreign key map} over a catalog, a drop-in for build_foreign_key_map_from_json"""
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __getitem__(self, db_id):
+        if db_id not in self._catalog:
+            raise KeyError(db_id)
+        return self._catalog.foreign_key_map(db_id)
+
+    def __iter__(self):
+        return iter(self._catalog.db_ids())
+
+    def __len__(self):
+        return len(self._catalog)
+
+
+def _fallback_path(tables_json):
+    digest = hashlib.sha1(os.path.abspath(tables_json).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), 'spider-{}.catalog'.format(digest))
+
+
+def load_catalog(tables_json, path=None):
+    """Open the catalog compiled from tables_json, (re)compiling it when missing or stale
+
+    Without an explicit path the catalog lives next to tables.json, or in the
+    temp dir when that directory is not writable.
+    """
+    candidates = [path] if path else [catalog_path(tables_json), _fallback_path(tables_json)]
+    source = source_info(tables_json)
+    for idx, candidate in enumerate(candidates):
+        if os.path.exists(candidate):
+            try:
+                catalog = SchemaCatalog(candidate)
+            except (ValueError, EnvironmentError, pickle.UnpicklingError, EOFError):
+                catalog = None
+            if catalog is not None:
+                if catalog.source == source:
+                    return catalog
+                catalog.close()
+        try:
+            return SchemaCatalog(compile_catalog(tables_json, candidate))
+        except EnvironmentError:
+            if idx == len(candidates) - 1:
+                raise
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python schema_catalog.py [tables.json] [catalog file, default next to tables.json]")
+        sys.exit(1)
+    out = compile_catalog(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print("Wrote {} ({} bytes)".format(out, os.path.getsize(out)))
@@ -0,0 +1,199 @@
+################################
+# Immutable, hashable form of the parsed SQL produced by process_sql.get_sql
+#
+# sql dict          -> SQLNode (clauses in SQL_KEYS order, hash computed once)
+# other dict        -> Record (sorted (key, value) pairs), e.g. sql['from']
+# list              -> Seq (tuple subclass, turned back into a list by thaw)
+# tuple             -> tuple
+# number/str/None   -> unchanged
+#
+# Equal trees have equal hashes, so comparing two nodes only walks the
+# structure when their hashes agree, and units can be counted in multisets.
+################################
+
+SQL_KEYS = ('from', 'select', 'where', 'groupBy', 'having', 'orderBy', 'limit', 'intersect', 'union', 'except')
+KEY_INDEX = dict((key, idx) for idx, key in enumerate(SQL_KEYS))
+
+
+class _Node(tuple):
+    """Tuple that is only equal to tuples of the same class
+
+    Lists, dicts and tuples of the dict format never compare equal to each
+    other, so their frozen forms must not either.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if not isinstance(other, tuple):
+            return NotImplemented
+        return type(other) is type(self) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash((type(self).__name__, tuple.__hash__(self)))
+
+
+class Seq(_Node):
+    """Immutable stand-in for a list of the dict format"""
+    __slots__ = ()
+
+
+class Record(_Node):
+    """Immutable stand-in for a plain dict of the dict format, as sorted (key, value) pairs"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if not isinstance(key, (int, slice)):
+            for k, v in tuple.__iter__(self):
+                if k == key:
+                    return v
+            raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def replace(self, changes):
+        """Copy with the values of the keys in changes replaced"""
+        fields = dict(tuple.__iter__(self))
+        fields.update(changes)
+        return record(fields)
+
+
+class SQLNode(object):
+    """Immutable parsed query with a cached structural hash
+
+    Clauses can be read like the dict format (node['where']). The hash is
+    computed on first use, so intermediate nodes built while rewriting a
+    tree cost no hashing.
+    """
+    __slots__ = ('clauses', '_hash')
+
+    def __init__(self, clauses):
+        clauses = tuple(clauses)
+        assert len(clauses) == len(SQL_KEYS), "Expected one value per clause"
+        object.__setattr__(self, 'clauses', clauses)
+        object.__setattr__(self, '_hash', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SQLNode is immutable")
+
+    def __getitem__(self, key):
+        return self.clauses[KEY_INDEX[key]]
+
+    def replace(self, changes):
+        """Copy with the clauses in changes (clause name -> value) replaced"""
+        return SQLNode([changes[key] if key in changes else val for key, val in zip(SQL_KEYS, self.clauses)])
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(self.clauses))
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, SQLNode):
+            return NotImplemented
+        return hash(self) == hash(other) and self.clauses == other.clauses
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __reduce__(self):
+        return SQLNode, (self.clauses,)
+
+    def __repr__(self):
+        return 'SQLNode({})'.format(', '.join('{}={!r}'.format(key, val) for key, val in zip(SQL_KEYS, self.clauses)))
+
+
+def record(fields):
+    """Record for a dict whose values are already frozen"""
+    return Record(sorted(fields.items()))
+
+
+def is_sql(obj):
+    return isinstance(obj, dict) and 'select' in obj
+
+
+def freeze(obj):
+    """Immutable form of any part of a parse tree"""
+    if isinstance(obj, dict):
+        if 'select' in obj:
+            return SQLNode([freeze(obj[key]) for key in SQL_KEYS])
+        return record(dict([(key, freeze(val)) for key, val in obj.items()]))
+    if isinstance(obj, list):
+        return Seq([freeze(val) for val in obj])
+    if isinstance(obj, tuple):
+        return tuple([freeze(val) for val in obj])
+    return obj
+
+
+def thaw(obj):
+    """Dict-format form of any part of a frozen parse tree"""
+    if isinstance(obj, SQLNode):
+        return dict((key, thaw(val)) for key, val in zip(SQL_KEYS, obj.clauses))
+    if isinstance(obj, Record):
+        return dict((key, thaw(val)) for key, val in tuple.__iter__(obj))
+    if isinstance(obj, Seq):
+        return [thaw(val) for val in obj]
+    if isinstance(obj, tuple):
+        return tuple(thaw(val) for val in obj)
+    return obj
+
+
+def from_dict(sql):
+    """SQLNode for a parsed sql dict"""
+    assert is_sql(sql), "Expected a parsed sql dict"
+    return freeze(sql)
+
+
+def to_dict(node):
+    """Parsed sql dict for an SQLNode; round-trips from_dict exactly"""
+    assert isinstance(node, SQLNode), "Expected an SQLNode"
+    return thaw(node)
+
+
+def _sorted_seq(items):
+    return Seq(sorted(items, key=repr))
+
+
+def _canonical_condition(condition):
+    """Sort the cond units of a condition joined by a single kind of connective"""
+    connectors = set(condition[1::2])
+    if len(connectors) > 1:
+        return condition
+    result = []
+    for idx, unit in enumerate(_sorted_seq(condition[::2])):
+        if idx:
+            result.append(condition[1])
+        result.append(unit)
+    return Seq(result)
+
+
+def canonical(node):
+    """Canonically ordered form of an SQLNode
+
+    Select items, table units and conditions joined by a single kind of
+    connective are order-insensitive in evaluation and get sorted, so
+    queries that differ only in that order get equal nodes; the operands of
+    set operations are made canonical the same way. Everything else keeps
+    its order, including GROUP BY / ORDER BY columns and subqueries inside
+    units, which evaluation compares as written.
+    """
+    if node is None:
+        return None
+    is_distinct, units = node['select']
+    return node.replace({
+        'select': (is_distinct, _sorted_seq(units)),
+        'from': node['from'].replace({
+            'table_units': _sorted_seq(node['from']['table_units']),
+            'conds': _canonical_condition(node['from']['conds']),
+        }),
+        'where': _canonical_condition(node['where']),
+        'having': _canonical_condition(node['having']),
+        'intersect': canonical(node['intersect']),
+        'except': canonical(node['except']),
+        'union': canonical(node['union']),
+    })
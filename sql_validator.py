@@ -0,0 +1,136 @@
+"""
+Pre-execution validation of generated SQL against the cached schema
+Uses the schema-aware Spider parser (spider/process_sql.py) to find unknown
+tables/columns and applies cheap repairs before anything reaches the database
+"""
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spider'))
+from process_sql import Schema, get_sql, CLAUSE_KEYWORDS, JOIN_KEYWORDS, WHERE_OPS, AGG_OPS, COND_OPS, ORDER_OPS
+
+# Tokens that the Spider parser rejects because of unsupported syntax, not unknown names
+SQL_KEYWORDS = set(CLAUSE_KEYWORDS + JOIN_KEYWORDS + WHERE_OPS + AGG_OPS + COND_OPS + ORDER_OPS) | {
+    'by', 'having', 'distinct', 'case', 'when', 'then', 'else', 'end', 'cast', 'null',
+    'left', 'right', 'inner', 'outer', 'cross', 'full', 'natural', 'using', 'all', 'with',
+}
+
+# Maximum number of identifier repairs attempted on a single query
+MAX_REPAIRS = 5
+
+
+def build_parser_schema(schema_info):
+    """Build a process_sql Schema from the app's schema info ({table: [{'column': ...}]})"""
+    return Schema({
+        table.lower(): [col['column'].lower() for col in columns]
+        for table, columns in schema_info.items()
+    })
+
+
+def _add_alias_keywords(sql_query, parser_schema):
+    """Rewrite implicit table aliases (`FROM author a`) as `author AS a` for the parser"""
+    def add_as(match):
+        table, alias = match.group(2), match.group(3)
+        if table.lower() in parser_schema.schema and alias.lower() not in SQL_KEYWORDS:
+            return f"{match.group(1)}{table} AS {alias}"
+        return match.group(0)
+    return re.sub(r'((?:from|join)\s+|,\s*)([\w.]+)\s+(\w+)', add_as, sql_query, flags=re.IGNORECASE)
+
+
+def find_unknown_identifier(sql_query, parser_schema):
+    """Parse the query and return (kind, token) for the first unknown table/column
+
+    Returns None when the query parses, or when the parser fails for a reason
+    other than an unknown identifier (unsupported syntax is not our business).
+    """
+    try:
+        get_sql(parser_schema, _add_alias_keywords(sql_query, parser_schema))
+        return None
+    except KeyError as e:
+        token = str(e.args[0])
+        if '.' in token and token.rsplit('.', 1)[0] in parser_schema.schema:
+            return 'column', token
+        return 'table', token
+    except AssertionError as e:
+        match = re.match(r'Error col: (.+)$', str(e))
+        if match:
+            return 'column', match.group(1)
+        return None
+    except Exception:
+        return None
+
+
+def _table_candidates(token, tables, namespace):
+    """Tables a misspelt/mis-prefixed table reference may refer to"""
+    flat = token.replace('.', '_')
+    candidates = set()
+    for table in tables:
+        short = table.split('.')[-1]
+        if table.replace('.', '_') == flat or short == token:
+            candidates.add(table)
+        elif namespace and token in (f"{namespace}_{table}", f"{namespace}.{table}"):
+            candidates.add(table)
+    return candidates
+
+
+def suggest_repair(sql_query, kind, token, parser_schema, namespace=None):
+    """Return (bad, good) substrings that fix an unknown identifier, or None"""
+    schema = parser_schema.schema
+
+    # Quoted identifier with the wrong case, e.g. "Name" -> name
+    if token.startswith('"') and token.endswith('"') and token in sql_query:
+        name = token[1:-1].lower()
+        if name in schema or any(name in cols for cols in schema.values()):
+            return token, name
+        return None
+
+    if kind == 'table':
+        candidates = _table_candidates(token, schema, namespace)
+        if len(candidates) == 1:
+            return token, candidates.pop()
+        return None
+
+    # table.column where the table part carries a stale prefix
+    if '.' in token:
+        table, col = token.rsplit('.', 1)
+        candidates = [t for t in _table_candidates(table, schema, namespace) if col in schema[t]]
+        if len(candidates) == 1:
+            return table, candidates[0]
+    return None
+
+
+def _replace_identifier(sql_query, bad, good):
+    """Replace whole-identifier occurrences of bad (case-insensitive)"""
+    if bad.startswith('"'):
+        return sql_query.replace(bad, good)
+    pattern = rf'(?<![\w."]){re.escape(bad)}(?![\w"])'
+    return re.sub(pattern, good, sql_query, flags=re.IGNORECASE)
+
+
+def validate_sql(sql_query, parser_schema, namespace=None):
+    """Validate and cheaply repair a query
+
+    Returns (sql_query, error): error is None when the (possibly repaired)
+    query references only known tables and columns, otherwise a message
+    describing the unknown identifier that could not be repaired.
+    """
+    for _ in range(MAX_REPAIRS + 1):
+        unknown = find_unknown_identifier(sql_query, parser_schema)
+        if unknown is None:
+            return sql_query, None
+
+        kind, token = unknown
+        if token.lower() in SQL_KEYWORDS or (token.startswith('"') and token not in sql_query):
+            # Parser tripped over syntax it does not support (or a string literal); let the database decide
+            return sql_query, None
+
+        repair = suggest_repair(sql_query, kind, token, parser_schema, namespace)
+        if repair is None:
+            return sql_query, f"Unknown {kind} '{token}'"
+        repaired = _replace_identifier(sql_query, *repair)
+        if repaired == sql_query:
+            return sql_query, f"Unknown {kind} '{token}'"
+        sql_query = repaired
+
+    return sql_query, f"Unknown {kind} '{token}'"